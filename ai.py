@@ -1,7 +1,6 @@
 """
 AI components
 """
-import inspect
 from json import dumps, loads
 from math import sqrt
 from random import choice, randint, random
@@ -11,6 +10,7 @@ from bear_hug.ecs import Component, EntityTracker
 from bear_hug.event import BearEvent
 
 from plot import PlotManager
+from registry import ClassRegistry, split_converters
 
 
 def find_closest_enemy(entity, perception_distance, enemy_factions=None):
@@ -70,6 +70,8 @@ class AIComponent(Component):
 
     """
 
+    __slots__ = ('_owner', 'states', 'current_state', 'delay', 'have_waited')
+
     def __init__(self, *args, states={}, state_dump=None,
                  current_state='inactive', **kwargs):
         self._owner = None
@@ -124,13 +126,23 @@ class AIComponent(Component):
             self.have_waited = 0
     # TODO: __repr__ AIComponent and AIState
 
-    def __repr__(self):
-        d = loads(super().__repr__())
-        d['current_state'] = self.current_state
-        d['state_dump'] = {}
+    def to_state(self):
+        d = {'class': self.__class__.__name__,
+             'current_state': self.current_state,
+             'state_dump': {}}
         for state in self.states:
-            d['state_dump'][state] = repr(self.states[state])
-        return dumps(d)
+            d['state_dump'][state] = self.states[state].to_state()
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
+
+    @classmethod
+    def from_state(cls, state, dispatcher):
+        states = {x: deserialize_state(state['state_dump'][x], dispatcher)
+                  for x in state['state_dump']}
+        return cls(dispatcher, states=states,
+                   current_state=state['current_state'])
 
 
 class AIState:
@@ -141,6 +153,9 @@ class AIState:
     components. Unlike the components, though, it does not add itself to the
     owner's __dict__
 
+    States have no __dict__: every subclass should list the attributes it
+    introduces in its __slots__.
+
     :param owner: Entity this state belongs to. Defaults to None
 
     :param enemy_factions: factions this state treats like enemies. Setting this
@@ -157,6 +172,11 @@ class AIState:
     :param player_perception_distance: distance, in chars, at which player
     character is detected. Defaults to 50.
     """
+
+    __slots__ = ('dispatcher', 'owner', 'enemy_factions',
+                 'enemy_perception_distance', 'player_id',
+                 'player_perception_distance', 'current_closest')
+
     def __init__(self, dispatcher, owner=None,
                  enemy_factions=None,
                  enemy_perception_distance=50,
@@ -188,13 +208,19 @@ class AIState:
         """
         raise NotImplementedError('AIState.switch_state should be overridden')
 
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'enemy_factions': self.enemy_factions,
+                'enemy_perception_distance': self.enemy_perception_distance,
+                'player_id': self.player_id,
+                'player_perception_distance': self.player_perception_distance}
+
     def __repr__(self):
-        d = {'class': self.__class__.__name__,
-             'enemy_factions': self.enemy_factions,
-             'enemy_perception_distance': self.enemy_perception_distance,
-             'player_id': self.player_id,
-             'player_perception_distance': self.player_perception_distance}
-        return dumps(d)
+        return dumps(self.to_state())
+
+
+# Classes for `deserialize_state`
+state_classes = ClassRegistry(AIState)
 
 
 class WaitAIState(AIState):
@@ -217,6 +243,9 @@ class WaitAIState(AIState):
     :param check_delay: float. Time, in seconds, between two checks for enemy or
     player presence.
     """
+
+    __slots__ = ('player_arrival_state', 'enemy_arrival_state', 'check_delay')
+
     def __init__(self, *args,
                  player_arrival_state=None,
                  enemy_arrival_state=None,
@@ -254,12 +283,12 @@ class WaitAIState(AIState):
                 return self.player_arrival_state
         return None
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['player_arrival_state'] = self.player_arrival_state
         d['enemy_arrival_state'] = self.enemy_arrival_state
         d['check_delay'] = self.check_delay
-        return dumps(d)
+        return d
 
 
 class RunawayAIState(AIState):
@@ -272,6 +301,9 @@ class RunawayAIState(AIState):
 
     :param step_delay: float. A time it takes to make one step.
     """
+
+    __slots__ = ('wait_state', 'step_delay')
+
     def __init__(self, *args, wait_state=None, step_delay=0.2, **kwargs):
         super().__init__(*args, **kwargs)
         if not isinstance(wait_state, str):
@@ -301,11 +333,11 @@ class RunawayAIState(AIState):
             self.owner.position.walk((0, dy < 0 and -1 or 1))
         return self.step_delay
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['wait_state'] = self.wait_state
         d['step_delay'] = self.step_delay
-        return dumps(d)
+        return d
 
 
 class TalkAIState(AIState):
@@ -329,8 +361,13 @@ class TalkAIState(AIState):
     :param phrase_sounds: an iterable of str or None. If not None, one of these
     lines, chosen randomly at equal probabilities, is played via `play_sound`
     event. Sound validity is not checked and could create crashes if
-    SoundListener doesn't know these sound IDs.
+    MixerListener doesn't know these sound IDs.
     """
+
+    __slots__ = ('wait_state', 'enemy_arrival_state', 'monologue',
+                 'phrase_sounds', 'next_phrase', 'phrase_delay',
+                 'last_used_sound')
+
     def __init__(self, *args,
                  wait_state=None,
                  enemy_arrival_state=None,
@@ -396,7 +433,7 @@ class TalkAIState(AIState):
             else:
                 sound = self.phrase_sounds[0]
             self.dispatcher.add_event(BearEvent('play_sound',
-                                                sound))
+                                                (sound, self.owner.id)))
         self.owner.spawner.spawn('message', (-x_offset, 0),
                                  text=self.monologue[self.next_phrase],
                                  vy=-2,
@@ -409,14 +446,14 @@ class TalkAIState(AIState):
         self.next_phrase += 1
         return self.phrase_delay
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['wait_state'] = self.wait_state
         d['enemy_arrival_state'] = self.enemy_arrival_state
         d['monologue'] = self.monologue
         d['phrase_delay'] = self.phrase_delay
         d['phrase_sounds'] = self.phrase_sounds
-        return dumps(d)
+        return d
 
 
 class CombatAIState(AIState):
@@ -440,6 +477,10 @@ class CombatAIState(AIState):
     :param wait_state: str. a state to which it switches when there is no enemy in
     range.
     """
+
+    __slots__ = ('right_range', 'left_range', 'wait_state', 'dy_preference',
+                 'walk_direction', 'steps_left')
+
     def __init__(self, *args,
                  right_range=(4, 8),
                  left_range=(4, 8),
@@ -531,28 +572,28 @@ class CombatAIState(AIState):
             self.steps_left = randint(4, 7)
 # TODO: prevent nunchaku punks from getting lost after close contact with PC
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['right_range'] = self.right_range
         d['left_range'] = self.left_range
         d['wait_state'] = self.wait_state
-        return dumps(d)
+        return d
 
 
 def deserialize_state(serial, dispatcher):
     """
     Load the AIState from a JSON string or dict.
 
-    This is a stripped-down version of `bear_hug.ecs.deserialize_component`
-    without support for converters.
+    This is a stripped-down version of `components.load_component` without
+    support for converters.
 
     Expects the dict or string to contain ``class`` key with the class name.
-    This class will be used for an AIState instance; it should be imported by
-    the code that calls this function, or somewhere within its call stack. This
-    class should be a subclass of AIState.
+    This class will be used for an AIState instance; it is looked up in
+    `state_classes` and should be a subclass of AIState.
 
     All other keys are used as kwargs for a newly created object. Keys ``owner``
-    and ``dispatcher`` are forbidden and cause an exception to be raised.
+    and ``dispatcher`` are forbidden and cause an exception to be raised, and so
+    do the keys that the state constructor does not accept.
 
     :param serial: A valid JSON string or a dict produced by deserializing such a string.
 
@@ -570,28 +611,8 @@ def deserialize_state(serial, dispatcher):
         if forbidden_key in d.keys():
             raise BearJSONException(f'Forbidden key {forbidden_key} in AIState JSON')
     if 'class' not in d:
-        raise BearJSONException('No class provided in component JSON')
-    types = [x for x in d if '_type' in x]
-    for t in types:
-        del(d[t])
-    # Try to get the Component class from where the function was imported, or
-    # the importers of *that* frame. Without this, the function would only see
-    # classes from this very file, or ones imported into it, and that would
-    # break the deserialization of custom components.
-    class_var = None
-    for frame in inspect.getouterframes(inspect.currentframe()):
-        if d['class'] in frame.frame.f_globals:
-            class_var = frame.frame.f_globals[d['class']]
-            break
-    del frame
-    if not class_var:
-        raise BearJSONException(f"Class name {class_var} not imported anywhere in the frame stack")
-    if not issubclass(class_var, AIState):
-        raise BearJSONException(f"Class name {class_var}mapped to something other than a AIState subclass")
-    kwargs = {}
-    for key in d:
-        if key == 'class':
-            continue
-        else:
-            kwargs[key] = d[key]
-    return class_var(dispatcher, **kwargs)
\ No newline at end of file
+        raise BearJSONException('No class provided in AIState JSON')
+    kwargs, _ = split_converters(d)
+    class_var = state_classes.get(kwargs.pop('class'))
+    state_classes.check_kwargs(class_var, kwargs)
+    return class_var(dispatcher, **kwargs)
@@ -95,9 +95,11 @@ def generate_tiled(atlas, pattern, size):
     return chars, colors
 
 
-def tile_randomly(atlas, *patterns, size):
+def tile_randomly(atlas, *patterns, size, rng=random):
     """
     Tile with patterns in random order.
+
+    :param rng: random.Random instance or the random module
     """""
     tile_chars = []
     tile_colors = []
@@ -121,7 +123,7 @@ def tile_randomly(atlas, *patterns, size):
     r = False
     for tile_y in range(size[1] // tile_height + 1):
         for tile_x in range(size[0] // tile_width + 1):
-            running_pattern = random.randint(0, len(tile_chars) - 1)
+            running_pattern = rng.randint(0, len(tile_chars) - 1)
             for y in range(tile_height):
                 for x in range(tile_width):
                     try:
@@ -175,16 +177,17 @@ def stack_boxes(*boxes, order='vertical'):
     return chars, colors
 
 
-def choose_next(transitions):
+def choose_next(transitions, rng=random):
     """
     Select the next element from probability dict.
 
     The dict should have the form of ``{element: probability}``, ie
     ``{'e1': 0.5, 'e2': 0.1, ...}``. Assumes that probabilities sum to unity.
     :param transitions: Probability dict
+    :param rng: random.Random instance or the random module
     :return: element ID
     """
-    roll = random.random()
+    roll = rng.random()
     total = 0
     for element in transitions:
         total += transitions[element]
@@ -192,7 +195,7 @@ def choose_next(transitions):
             return element
 
 
-def generate_bg(atlas, transition_dict, width):
+def generate_bg(atlas, transition_dict, width, rng=random):
     """
     Randomly assemble the background.
 
@@ -213,6 +216,7 @@ def generate_bg(atlas, transition_dict, width):
     :param atlas:
     :param transition_dict:
     :param width:
+    :param rng: random.Random instance or the random module
     :return:
     """
     for d in transition_dict:
@@ -225,9 +229,9 @@ def generate_bg(atlas, transition_dict, width):
     while running_x < width:
         if not current_element:
             # Start from each element with equal probability
-            element_id = random.choice(elements)
+            element_id = rng.choice(elements)
         else:
-            element_id = choose_next(transition_dict[current_element])
+            element_id = choose_next(transition_dict[current_element], rng=rng)
         current_element = element_id
         element = atlas.get_element(element_id)
         if len(element[0][0]) < width - running_x:
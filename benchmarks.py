@@ -0,0 +1,1150 @@
+#! /usr/bin/env python3.6
+"""
+Performance benchmarks for the game code.
+
+These run without opening a terminal window: the game objects are created
+with the same atlases and event types as in game.py, but the layout is not
+attached to anything and events are dispatched manually.
+
+Most of them create the game objects directly, while `levels` and `stress`
+play the game with a `headless.Simulation` and report tick rates, memory and
+peak entity counts.
+
+Usage: `python3 benchmarks.py [--baseline FILE] [--save-baseline FILE]
+[benchmark_name ...]`. If no names are given, all benchmarks are run. Results
+can be saved as a JSON baseline, and compared to it on later runs: the change
+is shown for every number, be it a time or a count. The baseline for the
+current code is kept in benchmarks_baseline.json; it was taken on one
+machine, so only compare to it on the same hardware and regenerate it after
+changes that affect the numbers.
+
+Benchmarks that build several games collect the garbage left by the previous
+one before timing the next, so that it is not collected mid-measurement.
+"""
+
+import gc
+import json
+import sys
+from argparse import ArgumentParser
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
+from os import path, devnull, remove, stat
+from random import Random
+from tempfile import gettempdir
+from time import perf_counter
+import tracemalloc
+
+from bear_hug.bear_hug import BearLoop
+from bear_hug.bear_utilities import copy_shape
+from bear_hug.ecs import Entity, EntityTracker, WidgetComponent, \
+    PositionComponent, DestructorComponent
+from bear_hug.ecs_widgets import ScrollableECSLayout
+from bear_hug.event import BearEvent
+from bear_hug.widgets import Widget
+
+from headless import NullTerminal, Simulation, create_game, \
+    create_level_manager, fight_script, load_atlas
+from listeners import SpawnItem, SavingListener, LoadingListener, \
+    AutosaveListener
+from mixer import Mixer, MixerListener, NullBackend, load_wave
+from saves import delta_file_name
+from tables import sound_files
+from widgets import ChunkedECSLayout
+
+
+path_base = path.split(path.abspath(__file__))[0]
+
+
+# The game code has a single path for everything. These functions bring back
+# the old ones on a given object, so that benchmarks can compare the two.
+
+def uncache_images(factory):
+    """
+    Make the factory cut every image from the atlas anew.
+    """
+    factory._get_image = factory.atlas.get_element
+
+
+def disable_pools(factory):
+    """
+    Make the factory create every short-lived entity anew.
+
+    Their destructors do not know the factory, so the entities are not
+    returned to the pools either.
+    """
+    for entity_type in factory.pooled_types:
+        factory.blueprints[entity_type] = getattr(factory,
+                                                  f'_create_{entity_type}')
+
+
+def disable_bulk(factory):
+    """
+    Make the factory announce and destroy entities one by one.
+    """
+    @contextmanager
+    def bulk_creation():
+        yield
+
+    def remove_entities(entities, hide=False):
+        for entity in entities:
+            if not entity.destructor.is_destroying:
+                entity.destructor.destroy()
+
+    factory.bulk_creation = bulk_creation
+    factory.remove_entities = remove_entities
+
+
+def plain_decorations(factory):
+    """
+    Make the factory give decorations regular WidgetComponents, which are
+    saved with their full images.
+    """
+    def create(entity_id, entity_type, **kwargs):
+        e = Entity(id=entity_id)
+        widget = Widget(*factory._get_image(entity_type))
+        e.add_component(WidgetComponent(factory.dispatcher, widget))
+        e.add_component(PositionComponent(factory.dispatcher))
+        e.add_component(DestructorComponent(factory.dispatcher))
+        return e
+
+    for entity_type in factory.decorations:
+        factory.blueprints[entity_type] = partial(create,
+                                                  entity_type=entity_type)
+
+
+def disable_grid(collision_listener):
+    """
+    Make the collision listener check every move against all entities.
+
+    Has to be called before any entity is added. The grid gets a single
+    cell, which contains every tracked entity.
+    """
+    collision_listener.cell_size = 10 ** 9
+
+
+def disable_sweep(collision_listener):
+    """
+    Make the collision listener check projectiles only at their new position.
+    """
+    collision_listener.swept_types = ()
+
+
+def disable_preparation(levelgen, keep_prefabs=True):
+    """
+    Stop the level manager from preparing the exit of every level in advance.
+
+    Unless `keep_prefabs` is set, it does not keep ready copies of prefab
+    levels either.
+    """
+    levelgen._prepare_exit = lambda: None
+    if not keep_prefabs:
+        levelgen._prepare_level = lambda level_id: None
+
+
+def bench_spawn_punks(atlas, count=200):
+    """
+    Spawn `count` punks, with and without the factory image cache.
+
+    Only `create_entity` calls are timed, dispatching of the resulting events
+    is not.
+    :return: a dict of {setup_name: seconds}
+    """
+    results = {}
+    for cache_images in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        if not cache_images:
+            uncache_images(factory)
+        start = perf_counter()
+        for i in range(count):
+            factory.create_entity(('nunchaku_punk', 'bottle_punk')[i % 2],
+                                  (10 + i % 400, 20 + i % 20),
+                                  emit_show=False)
+        results[f'cache_images={cache_images}'] = perf_counter() - start
+        dispatcher.dispatch_events()
+    return results
+
+
+def bench_projectiles(atlas, rounds=20, count=50):
+    """
+    Create `count` bullets and punches, destroy them at the end of the tick, and
+    repeat `rounds` times. Runs with and without entity pools.
+    :return: a dict of {setup_name: seconds}
+    """
+    results = {}
+    for use_pools in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        if not use_pools:
+            disable_pools(factory)
+        start = perf_counter()
+        for _ in range(rounds):
+            for i in range(count):
+                factory.create_entity(('bullet', 'punch')[i % 2],
+                                      (10 + i, 20 + i % 20),
+                                      direction=('r', 'l')[i % 4 // 2])
+            dispatcher.dispatch_events()
+            for entity in list(EntityTracker().filter_entities(
+                    lambda x: x.id.startswith(('bullet', 'punch')))):
+                entity.destructor.destroy()
+            dispatcher.add_event(BearEvent('service', 'tick_over'))
+            dispatcher.dispatch_events()
+        setup = f'use_pools={use_pools}'
+        if use_pools:
+            stats = factory.pool_statistics()
+            hits = sum(x['hits'] for x in stats.values())
+            misses = sum(x['misses'] for x in stats.values())
+            setup += f' ({hits} hits, {misses} misses)'
+        results[setup] = perf_counter() - start
+    return results
+
+
+def bench_collisions(atlas, count=100, clutter=300, duration=5):
+    """
+    Shoot `count` bullets at a thin wall through a room cluttered with other
+    barriers, at different frame rates, with and without the collision grid
+    and swept checks for projectiles.
+
+    A dept_wall_inner is 3 chars thick, and a bullet at 4 FPS moves 12 chars
+    per tick. Reports the time per tick and the number of bullets that flew
+    through the wall.
+    :return: a dict of {setup_name: seconds per tick or bullet count}
+    """
+    results = {}
+    for use_grid, sweep in ((False, False), (True, False), (True, True)):
+        for fps in (50, 10, 4):
+            dispatcher, layout, factory = create_game(atlas)
+            if not use_grid:
+                disable_grid(factory.collision_listener)
+            if not sweep:
+                disable_sweep(factory.collision_listener)
+            rng = Random(0)
+            for _ in range(clutter):
+                factory.create_entity('dept_locker', (rng.randint(0, 480),
+                                                      rng.randint(35, 40)))
+            factory.create_entity('dept_wall_inner', (250, 0))
+            dispatcher.dispatch_events()
+            wall = next(EntityTracker().filter_entities(
+                lambda x: x.id.startswith('dept_wall_inner')))
+            for i in range(count):
+                factory.create_entity('bullet', (10 + i // 2, 12 + i % 19),
+                                      direction='r',
+                                      z_level=wall.widget.z_level)
+            dispatcher.dispatch_events()
+            ticks = duration * fps
+            start = perf_counter()
+            for _ in range(ticks):
+                dispatcher.add_event(BearEvent('tick', 1 / fps))
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+            elapsed = perf_counter() - start
+            passed = len(list(EntityTracker().filter_entities(
+                lambda x: x.id.startswith('bullet')
+                and x.position.x > wall.position.x)))
+            setup = f'use_grid={use_grid} sweep={sweep} fps={fps}'
+            results[f'{setup} tick'] = elapsed / ticks
+            results[f'{setup} passed'] = f'{passed}/{count} bullets'
+    return results
+
+
+def bench_spawns(atlas, steps=200):
+    """
+    Walk the player through levels with different numbers of pending spawns,
+    spread over 10000 chars.
+
+    Each step is timed until all events are dispatched, including the spawns
+    it triggered.
+    :return: a dict of {setup_name: seconds per step}
+    """
+    results = {}
+    for count in (10, 100, 1000, 10000):
+        dispatcher, layout, factory = create_game(atlas)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen)
+        factory.create_entity('cop', (5, 25))
+        # Load the image before timing
+        factory.create_entity('can', (0, 0))
+        dispatcher.dispatch_events()
+        rng = Random(0)
+        levelgen.spawner.add_spawns_iterable(
+            SpawnItem('can', (rng.randint(0, 9990), rng.randint(0, 40)),
+                      (10, 20), {})
+            for _ in range(count))
+        player = EntityTracker().entities['cop_1']
+        start = perf_counter()
+        for i in range(steps):
+            player.position.move(5 + i * 2, 25)
+            dispatcher.dispatch_events()
+        results[f'{count} spawns'] = (perf_counter() - start) / steps
+    return results
+
+
+def bench_power(atlas, adds=200):
+    """
+    Place different numbers of spikes and machines, then add other entities
+    while they are present.
+
+    Spikes and machines are placed one by one, 10 chars apart, so each spike
+    is in range of several others.
+    :return: a dict of {setup_name: seconds per placed spike or machine, or
+    per other entity added}
+    """
+    results = {}
+    for count in (10, 100, 1000):
+        dispatcher, layout, factory = create_game(atlas)
+        layout.resize_layout(count * 20 + 100)
+        # Load the images before timing
+        factory.create_entity('can', (0, 0))
+        dispatcher.dispatch_events()
+        start = perf_counter()
+        for i in range(count):
+            factory.create_entity('spike', (i * 20, 20), powered=True)
+            factory.create_entity('science_prop', (i * 20 + 10, 30))
+            dispatcher.dispatch_events()
+        results[f'{count} spikes placement'] = \
+            (perf_counter() - start) / (count * 2)
+        start = perf_counter()
+        for i in range(adds):
+            factory.create_entity('can', (i, 40))
+            dispatcher.dispatch_events()
+        results[f'{count} spikes other entity'] = (perf_counter() - start) / adds
+    return results
+
+
+def bench_saves(atlas, rounds=5):
+    """
+    Save and load the game on populated lab levels, in JSON and binary
+    formats.
+
+    Saving is timed both for the in-frame snapshot and until the file is
+    written by the background thread. Loading is timed until the loaded game
+    is ready for the first frame.
+    :return: a dict of {setup_name: seconds per save or load, or a file size}
+    """
+    results = {}
+    dispatcher, layout, factory = create_game(atlas)
+    levelgen = create_level_manager(dispatcher, factory)
+    disable_preparation(levelgen)
+    MixerListener({}, backend=NullBackend())
+    loop = BearLoop(NullTerminal(), dispatcher)
+    saving = SavingListener()
+    dispatcher.register_listener(saving, ('brut_save_game', 'tick'))
+    dispatcher.register_listener(LoadingListener(dispatcher, factory,
+                                                 levelgen, loop),
+                                 'brut_load_game')
+    factory.create_entity('cop', (5, 25))
+    dispatcher.dispatch_events()
+    formats = (('json', 'brutality_benchmark.json', False),
+               ('binary', 'brutality_benchmark.sav', False),
+               ('zlib', 'brutality_benchmark.sav', True))
+    for level_id in ('lab_corridor', 'lab_corridor_2000'):
+        levelgen.set_level(level_id, seed=0)
+        loop._run_iteration(0)
+        entity_count = len(EntityTracker().entities)
+        for format_name, file_name, compress in formats:
+            save_file = path.join(gettempdir(), file_name)
+            saving.compress = compress
+            snapshot_time = 0
+            save_time = 0
+            load_time = 0
+            for i in range(rounds):
+                start = perf_counter()
+                dispatcher.add_event(BearEvent('brut_save_game', save_file))
+                dispatcher.dispatch_events()
+                snapshot_time += perf_counter() - start
+                saving.wait()
+                save_time += perf_counter() - start
+                start = perf_counter()
+                dispatcher.add_event(BearEvent('brut_load_game', save_file))
+                dispatcher.dispatch_events()
+                load_time += perf_counter() - start
+            setup = f'{level_id} {format_name}'
+            results[f'{setup} snapshot, {entity_count} entities'] = \
+                snapshot_time / rounds
+            results[f'{setup} save, {entity_count} entities'] = \
+                save_time / rounds
+            results[f'{setup} load, {entity_count} entities'] = \
+                load_time / rounds
+            results[f'{setup} file size'] = \
+                f'{stat(save_file).st_size / 1024:.1f} KiB'
+            remove(save_file)
+    return results
+
+
+def bench_autosave(atlas, rounds=5, ticks=10):
+    """
+    Autosave a populated lab level every `ticks` ticks while the player
+    walks through it.
+
+    The first autosave is full, the following `rounds` are deltas. Only the
+    in-frame part is timed, the files are written in the background.
+    :return: a dict of {setup_name: seconds per autosave, or a file size}
+    """
+    results = {}
+    dispatcher, layout, factory = create_game(atlas)
+    levelgen = create_level_manager(dispatcher, factory)
+    disable_preparation(levelgen)
+    MixerListener({}, backend=NullBackend())
+    loop = BearLoop(NullTerminal(), dispatcher)
+    saving = SavingListener()
+    dispatcher.register_listener(saving, ('brut_save_game', 'tick'))
+    save_file = path.join(gettempdir(), 'brutality_benchmark_autosave.sav')
+    # Autosaves are triggered manually
+    autosave = AutosaveListener(file_name=save_file, compaction=rounds)
+    dispatcher.register_listener(autosave, ('ecs_add', 'ecs_move',
+                                            'ecs_remove', 'brut_damage',
+                                            'brut_heal', 'brut_pick_up',
+                                            'brut_use_item',
+                                            'brut_change_ammo'))
+    factory.create_entity('cop', (5, 25))
+    dispatcher.dispatch_events()
+    levelgen.set_level('lab_corridor_2000', seed=0)
+    loop._run_iteration(0)
+    player = EntityTracker().entities['cop_1']
+    delta_time = 0
+    delta_size = 0
+    for i in range(rounds + 1):
+        for j in range(ticks):
+            player.position.move(player.position.x + 2, player.position.y)
+            loop._run_iteration(0.1)
+        start = perf_counter()
+        autosave.autosave()
+        elapsed = perf_counter() - start
+        saving.wait()
+        if i == 0:
+            results[f'full, {len(EntityTracker().entities)} entities'] = \
+                elapsed
+            results['full file size'] = \
+                f'{stat(save_file).st_size / 1024:.1f} KiB'
+        else:
+            delta_time += elapsed
+            delta_size += stat(delta_file_name(save_file, i)).st_size
+    results['delta'] = delta_time / rounds
+    results['delta file size'] = f'{delta_size / rounds / 1024:.1f} KiB'
+    remove(save_file)
+    for i in range(1, rounds + 1):
+        remove(delta_file_name(save_file, i))
+    return results
+
+
+def bench_load_npcs(atlas, count=100, rounds=5):
+    """
+    Load a binary save of a dept corridor with `count` NPCs on it.
+
+    The NPCs are punks and scientists, so the save contains several
+    AIComponents with their states. Loading is timed until the loaded game is
+    ready for the first frame.
+    :return: a dict of {setup_name: seconds per load}
+    """
+    results = {}
+    dispatcher, layout, factory = create_game(atlas)
+    levelgen = create_level_manager(dispatcher, factory)
+    disable_preparation(levelgen)
+    MixerListener({}, backend=NullBackend())
+    loop = BearLoop(NullTerminal(), dispatcher)
+    saving = SavingListener()
+    dispatcher.register_listener(saving, ('brut_save_game', 'tick'))
+    dispatcher.register_listener(LoadingListener(dispatcher, factory,
+                                                 levelgen, loop),
+                                 'brut_load_game')
+    factory.create_entity('cop', (5, 25))
+    dispatcher.dispatch_events()
+    levelgen.set_level('dept_corridor', seed=0)
+    loop._run_iteration(0)
+    for i in range(count):
+        factory.create_entity(('nunchaku_punk', 'bottle_punk',
+                               'scientist_enemy')[i % 3],
+                              (20 + i * 4 % 400, 20 + i % 20))
+    dispatcher.dispatch_events()
+    loop._run_iteration(0)
+    entity_count = len(EntityTracker().entities)
+    save_file = path.join(gettempdir(), 'brutality_benchmark_npcs.sav')
+    dispatcher.add_event(BearEvent('brut_save_game', save_file))
+    dispatcher.dispatch_events()
+    saving.wait()
+    start = perf_counter()
+    for i in range(rounds):
+        dispatcher.add_event(BearEvent('brut_load_game', save_file))
+        dispatcher.dispatch_events()
+    results[f'{count} NPCs, {entity_count} entities'] = \
+        (perf_counter() - start) / rounds
+    remove(save_file)
+    return results
+
+
+def bench_mixer(atlas, duration=10, rate=40):
+    """
+    Mix `duration` seconds of a big fight with a null backend.
+
+    Every block, fight sounds are requested at random, about `rate` of them
+    per second. Mixing is done with several voice caps; the sound priorities
+    and cooldowns are the same for all of them. A long sound is looped
+    throughout, like the background music.
+    :return: a dict of {setup_name: seconds per second of sound, or counters}
+    """
+    results = {}
+    settings = {'step': (0, 0.1), 'spark': (0, 0.1), 'punch': (1, 0.05),
+                'fist': (1, 0.05), 'nunchaku': (1, 0.05), 'shot': (2, 0.03),
+                'punk_hit': (2, 0.1), 'male_dmg': (2, 0.1),
+                'punk_death': (3, 0)}
+    files = {'step': 'step.wav', 'spark': 'spark.wav', 'punch': 'punch.wav',
+             'fist': 'fist.wav', 'nunchaku': 'nunchaku_wave.wav',
+             'shot': 'shot.wav', 'punk_hit': 'punk_hey.wav',
+             'male_dmg': 'male_dmg.wav', 'punk_death': 'punk_ho.wav',
+             'molotov_fire': 'molotov_fire.wav'}
+    sounds = {x: load_wave(path.join(path_base, 'sounds', files[x]))
+              for x in files}
+    names = list(settings)
+    for max_voices in (8, 16, 64):
+        mixer = Mixer(max_voices=max_voices)
+        for sound_name in sounds:
+            mixer.register_sound(sound_name, sounds[sound_name],
+                                 *settings.get(sound_name, (0, 0)))
+        mixer.play('molotov_fire', priority=float('inf'), loop=True)
+        backend = NullBackend()
+        rng = Random(0)
+        blocks = duration * mixer.rate // mixer.block_size
+        chance = rate * mixer.block_size / mixer.rate
+        start = perf_counter()
+        for i in range(blocks):
+            if rng.random() < chance:
+                mixer.play(rng.choice(names), volume=rng.random(),
+                           pan=rng.uniform(-1, 1))
+            backend.write(mixer.mix())
+        results[f'max_voices={max_voices}'] = \
+            (perf_counter() - start) / duration
+        results[f'max_voices={max_voices} played/cooled/stolen/dropped'] = \
+            f'{mixer.played}/{mixer.cooled_down}/{mixer.stolen}/{mixer.dropped}'
+    return results
+
+
+def bench_sound_culling(atlas, ticks=300):
+    """
+    Run lab and ghetto corridors for `ticks` ticks with the game sounds,
+    with and without culling the sounds outside the view.
+
+    The sounds are mixed with a null backend. Spikes, NPCs and molotovs all
+    over the level keep making noise, while the view stays at the start.
+    There is no background music.
+    :return: a dict of {setup_name: seconds per tick or counters}
+    """
+    results = {}
+    # Background music is not in the repository
+    sounds = {x: load_wave(path.join(path_base, 'sounds', sound_files[x]))
+              for x in sound_files
+              if path.exists(path.join(path_base, 'sounds', sound_files[x]))}
+    for culling in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen)
+        jukebox = MixerListener(sounds, backend=NullBackend(),
+                                layout=layout if culling else None)
+        dispatcher.register_listener(jukebox, ['play_sound', 'tick'])
+        loop = BearLoop(NullTerminal(), dispatcher)
+        factory.create_entity('cop', (5, 25))
+        dispatcher.dispatch_events()
+        elapsed = 0
+        for level_id in ('lab_corridor_2000', 'ghetto_corridor_2000'):
+            levelgen.set_level(level_id, seed=0)
+            loop._run_iteration(0)
+            start = perf_counter()
+            for _ in range(ticks):
+                loop._run_iteration(0.05)
+            elapsed += perf_counter() - start
+        mixer = jukebox.mixer
+        setup = f'culling={culling}'
+        results[f'{setup} tick'] = elapsed / ticks / 2
+        results[f'{setup} culled/played'] = \
+            f'{sum(jukebox.culled.values())}/{mixer.played}'
+        results[f'{setup} cooled/stolen/dropped'] = \
+            f'{mixer.cooled_down}/{mixer.stolen}/{mixer.dropped}'
+    return results
+
+
+def bench_levelgen(atlas, rounds=5):
+    """
+    Switch to a 500-wide corridor level of every style `rounds` times, with
+    and without bulk entity creation.
+
+    Each switch is timed until the end of the tick, including teardown of the
+    previous level and dispatching of all resulting events.
+
+    The switches are made with direct `set_level` calls, and then again the
+    way the game makes them: by the level switch listener on a tick, with the
+    events of that tick still queued.
+    :return: a dict of {setup_name: seconds per level}
+    """
+    results = {}
+    for use_bulk in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        if not use_bulk:
+            disable_bulk(factory)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen)
+        factory.create_entity('cop', (5, 25))
+        dispatcher.dispatch_events()
+        gc.collect()
+        for style in sorted(levelgen.styles):
+            total = 0
+            for i in range(rounds):
+                start = perf_counter()
+                levelgen.set_level(f'{style}_corridor', seed=i)
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                total += perf_counter() - start
+            results[f'{style} use_bulk={use_bulk}'] = total / rounds
+        level_switch = levelgen.level_switch
+        for style in sorted(levelgen.styles):
+            total = 0
+            for i in range(rounds):
+                level_switch.is_changing = True
+                level_switch.next_level = f'{style}_corridor'
+                start = perf_counter()
+                dispatcher.add_event(BearEvent('tick', 0.05))
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                total += perf_counter() - start
+            results[f'{style} use_bulk={use_bulk} level switch'] = \
+                total / rounds
+        del dispatcher, layout, factory, levelgen, level_switch
+    return results
+
+
+def bench_streaming(atlas, rounds=5, step=2):
+    """
+    Set a corridor level of every style and scroll the view through it, with
+    and without streaming of the rooms.
+
+    The view is moved by `step` chars per tick, and `LevelManager.update_chunks`
+    is called for it directly. Reports the time to set the level, the worst
+    tick while scrolling and the peak number of live entities.
+    :return: a dict of {setup_name: seconds or count string}
+    """
+    results = {}
+    for stream_distance in (None, 100):
+        for style in ('ghetto', 'dept', 'lab'):
+            set_total = 0
+            worst_tick = 0
+            peak = 0
+            for i in range(rounds):
+                dispatcher, layout, factory = create_game(atlas)
+                levelgen = create_level_manager(dispatcher, factory,
+                                                stream_distance=stream_distance)
+                disable_preparation(levelgen)
+                factory.create_entity('cop', (5, 25))
+                dispatcher.dispatch_events()
+                gc.collect()
+                start = perf_counter()
+                levelgen.set_level(f'{style}_corridor', seed=i)
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                set_total += perf_counter() - start
+                for x in range(0, 420, step):
+                    start = perf_counter()
+                    levelgen.update_chunks(x, layout.view_size[0])
+                    dispatcher.dispatch_events()
+                    dispatcher.add_event(BearEvent('service', 'tick_over'))
+                    dispatcher.dispatch_events()
+                    worst_tick = max(worst_tick, perf_counter() - start)
+                    peak = max(peak, len(EntityTracker().entities))
+                del dispatcher, layout, factory, levelgen
+            setup = f'{style} stream_distance={stream_distance}'
+            results[f'{setup} set_level'] = set_total / rounds
+            results[f'{setup} worst tick'] = worst_tick
+            results[f'{setup} peak'] = f'{peak} entities'
+    return results
+
+
+def bench_long_levels(atlas, width=10000, step=5):
+    """
+    Compare the memory used by an empty ScrollableECSLayout and
+    ChunkedECSLayout of 500 and `width` chars, then set a `width`-wide ghetto
+    corridor and scroll through it, with and without streaming.
+
+    For the level, reports the time to set it, the worst tick while
+    scrolling, the peak number of live entities and the memory allocated
+    since before the level was set, measured at 1/10 and 9/10 of the level
+    (in a separate pass with tracemalloc on).
+    :return: a dict of {setup_name: seconds or size string}
+    """
+    results = {}
+    for layout_width in (500, width):
+        tracemalloc.start()
+        chars = [[' ' for _ in range(layout_width)] for y in range(60)]
+        colors = copy_shape(chars, 'gray')
+        layout = ScrollableECSLayout(chars, colors, view_pos=(0, 0),
+                                     view_size=(81, 50))
+        memory = tracemalloc.get_traced_memory()[0]
+        del chars, colors, layout
+        tracemalloc.stop()
+        results[f'ScrollableECSLayout {layout_width}'] = \
+            f'{memory / 1024:.1f} KiB'
+        tracemalloc.start()
+        layout = ChunkedECSLayout(layout_width, 60, view_pos=(0, 0),
+                                  view_size=(81, 50))
+        memory = tracemalloc.get_traced_memory()[0]
+        del layout
+        tracemalloc.stop()
+        results[f'ChunkedECSLayout {layout_width}'] = \
+            f'{memory / 1024:.1f} KiB'
+    checkpoints = (width // 10, width * 9 // 10)
+    for stream_distance in (None, 100):
+        for measure_memory in (False, True):
+            dispatcher, layout, factory = create_game(atlas)
+            levelgen = create_level_manager(dispatcher, factory,
+                                            stream_distance=stream_distance)
+            disable_preparation(levelgen)
+            factory.create_entity('cop', (5, 25))
+            dispatcher.dispatch_events()
+            gc.collect()
+            if measure_memory:
+                tracemalloc.start()
+            start = perf_counter()
+            levelgen.set_level(f'ghetto_corridor_{width}', seed=0)
+            dispatcher.dispatch_events()
+            dispatcher.add_event(BearEvent('service', 'tick_over'))
+            dispatcher.dispatch_events()
+            set_time = perf_counter() - start
+            worst_tick = 0
+            peak = 0
+            for x in range(0, width - layout.view_size[0], step):
+                start = perf_counter()
+                levelgen.update_chunks(x, layout.view_size[0])
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                worst_tick = max(worst_tick, perf_counter() - start)
+                peak = max(peak, len(EntityTracker().entities))
+                if measure_memory and x in checkpoints:
+                    memory = tracemalloc.get_traced_memory()[0]
+                    results[f'level stream_distance={stream_distance} '
+                            f'memory at {x}'] = f'{memory / 1024:.1f} KiB'
+            if measure_memory:
+                tracemalloc.stop()
+            else:
+                setup = f'level stream_distance={stream_distance}'
+                results[f'{setup} set_level'] = set_time
+                results[f'{setup} worst tick'] = worst_tick
+                results[f'{setup} peak'] = f'{peak} entities'
+            del dispatcher, layout, factory, levelgen
+    return results
+
+
+def bench_level_switch(atlas, rounds=5):
+    """
+    Walk through the story levels from the department to the final one, with
+    and without background pre-generation of the next level.
+
+    The time between the level switches is not measured; with
+    pre-generation, the benchmark waits there until the next level is ready,
+    like a player walking through the level would. Each switch is timed until
+    the end of the tick, including teardown of the previous level and
+    dispatching of all resulting events.
+    :return: a dict of {setup_name: seconds per switch}
+    """
+    levels = ('ghetto_one', 'ghetto_expo_d', 'lab_fight', 'boss_leave_it',
+              'final')
+    results = {}
+    for pregenerate in (False, True):
+        totals = {x: 0 for x in levels}
+        for _ in range(rounds):
+            dispatcher, layout, factory = create_game(atlas)
+            levelgen = create_level_manager(dispatcher, factory)
+            if pregenerate:
+                # Only the exits are prepared
+                levelgen.prefabs = set()
+            else:
+                disable_preparation(levelgen, keep_prefabs=False)
+            factory.create_entity('cop', (5, 25))
+            dispatcher.dispatch_events()
+            levelgen.set_level('department')
+            dispatcher.dispatch_events()
+            for level_id in levels:
+                for prepared in levelgen.prepared_levels.values():
+                    prepared.wait()
+                start = perf_counter()
+                levelgen.set_level(level_id)
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                totals[level_id] += perf_counter() - start
+        for level_id in levels:
+            results[f'{level_id} pregenerate={pregenerate}'] = \
+                totals[level_id] / rounds
+    return results
+
+
+def bench_teardown(atlas, rounds=5):
+    """
+    Destroy levels of different sizes, removing entities one by one and in
+    bulk.
+
+    Teardown is timed until the end of the tick, including dispatching of
+    all resulting events.
+    :return: a dict of {setup_name: seconds per teardown}
+    """
+    results = {}
+    for use_bulk in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        if not use_bulk:
+            disable_bulk(factory)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen)
+        factory.create_entity('cop', (5, 25))
+        dispatcher.dispatch_events()
+        for level_id in ('ghetto_corridor', 'lab_corridor',
+                         'ghetto_corridor_3000'):
+            total = 0
+            for i in range(rounds):
+                levelgen.set_level(level_id, seed=i)
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                start = perf_counter()
+                levelgen.destroy_current_level()
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                total += perf_counter() - start
+            results[f'{level_id} use_bulk={use_bulk}'] = total / rounds
+    return results
+
+
+def bench_prefabs(atlas, rounds=5):
+    """
+    Switch between prefab levels, with and without the prefab cache.
+
+    Every level is visited once before measuring, so that the cache has it.
+    Like in `bench_level_switch`, only the switch frames are timed.
+    :return: a dict of {setup_name: seconds per switch}
+    """
+    levels = ('main_menu', 'department', 'ghetto_test', 'boss_leave_it',
+              'final')
+    results = {}
+    for cache_prefabs in (False, True):
+        dispatcher, layout, factory = create_game(atlas)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen, keep_prefabs=cache_prefabs)
+        factory.create_entity('cop', (5, 25))
+        dispatcher.dispatch_events()
+        totals = {x: 0 for x in levels}
+        for i in range(rounds + 1):
+            for level_id in levels:
+                for prepared in levelgen.prepared_levels.values():
+                    prepared.wait()
+                start = perf_counter()
+                levelgen.set_level(level_id)
+                dispatcher.dispatch_events()
+                dispatcher.add_event(BearEvent('service', 'tick_over'))
+                dispatcher.dispatch_events()
+                if i > 0:
+                    totals[level_id] += perf_counter() - start
+        for level_id in levels:
+            results[f'{level_id} cache_prefabs={cache_prefabs}'] = \
+                totals[level_id] / rounds
+    return results
+
+
+def bench_decorations(atlas, count=1000):
+    """
+    Create `count` decorations of all types from the blueprints table, with
+    and without flyweight decoration widgets. The setup without both image
+    cache and flyweights is how decorations used to be created.
+
+    Reports the memory allocated while creating and adding the decorations,
+    and the size of their serialized representation in a save file. Also
+    checks that the saved decorations can be loaded back.
+    :return: a dict of {setup_name: size string}
+    """
+    results = {}
+    for cache_images, flyweight in ((False, False), (True, False),
+                                    (True, True)):
+        dispatcher, layout, factory = create_game(atlas)
+        if not cache_images:
+            uncache_images(factory)
+        if not flyweight:
+            plain_decorations(factory)
+        types = sorted(factory.decorations)
+        # Cached images are shared, so they are loaded before measuring
+        for entity_type in types:
+            factory._get_image(entity_type)
+        tracemalloc.start()
+        for i in range(count):
+            factory.create_entity(types[i % len(types)],
+                                  (10 + i % 450, 20 + i % 30))
+        dispatcher.dispatch_events()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        saved = [repr(x) for x in EntityTracker().entities.values()]
+        for entity in EntityTracker().entities.values():
+            entity.destructor.destroy()
+        dispatcher.add_event(BearEvent('service', 'tick_over'))
+        dispatcher.dispatch_events()
+        for line in saved:
+            factory.load_entity_from_JSON(line)
+        dispatcher.dispatch_events()
+        assert len(EntityTracker().entities) == count
+        setup = f'cache_images={cache_images} flyweight={flyweight}'
+        results[f'{setup} memory'] = f'{memory / count:.0f} B/entity'
+        results[f'{setup} save'] = \
+            f'{sum(len(x) for x in saved) / count:.0f} B/entity'
+    return results
+
+
+def bench_memory(atlas, count=20):
+    """
+    Measure memory used by NPCs and levels.
+
+    For every NPC type, spawns `count` NPCs and reports the memory allocated
+    per NPC, including its hand and weapon entities. For every level style,
+    reports the memory allocated by generating a corridor level.
+    :return: a dict of {setup_name: size string}
+    """
+    results = {}
+    npc_types = ('nunchaku_punk', 'bottle_punk', 'female_scientist',
+                 'scientist_enemy', 'cop_npc', 'dept_boss')
+    for npc_type in npc_types:
+        dispatcher, layout, factory = create_game(atlas)
+        factory.create_entity('cop', (5, 25))
+        # Load images before measuring, they are shared between NPCs
+        factory.create_entity(npc_type, (50, 25))
+        dispatcher.dispatch_events()
+        tracemalloc.start()
+        for i in range(count):
+            factory.create_entity(npc_type, (60 + i * 20, 25))
+        dispatcher.dispatch_events()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[npc_type] = f'{memory / count / 1024:.1f} KiB/NPC'
+    for style in ('ghetto', 'dept', 'lab'):
+        dispatcher, layout, factory = create_game(atlas)
+        levelgen = create_level_manager(dispatcher, factory)
+        disable_preparation(levelgen)
+        factory.create_entity('cop', (5, 25))
+        dispatcher.dispatch_events()
+        # Generate once to load images
+        levelgen.set_level(f'{style}_corridor', seed=0)
+        dispatcher.dispatch_events()
+        dispatcher.add_event(BearEvent('service', 'tick_over'))
+        dispatcher.dispatch_events()
+        levelgen.destroy_current_level()
+        dispatcher.dispatch_events()
+        dispatcher.add_event(BearEvent('service', 'tick_over'))
+        dispatcher.dispatch_events()
+        tracemalloc.start()
+        levelgen.set_level(f'{style}_corridor', seed=0)
+        dispatcher.dispatch_events()
+        dispatcher.add_event(BearEvent('service', 'tick_over'))
+        dispatcher.dispatch_events()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[f'{style}_corridor'] = f'{memory / 1024:.1f} KiB/level'
+    return results
+
+
+def simulation_results(simulation, ticks, memory, before_tick=None):
+    """
+    Run a simulation and collect its stats for a benchmark report.
+    :param simulation: headless.Simulation instance
+    :param ticks: int. Number of ticks to run at 30 FPS.
+    :param memory: int. Bytes allocated while setting up the simulation.
+    :param before_tick: a callable to run before every tick, or None
+    :return: a dict of {stat_name: seconds or preformatted string}
+    """
+    for _ in range(ticks):
+        if before_tick:
+            before_tick()
+        simulation.step(1 / 30)
+    stats = simulation.stats(fps=30)
+    return {'ticks/s': f'{stats["ticks_per_second"]:.0f}',
+            'p50': stats['p50'],
+            'p99': stats['p99'],
+            'peak entities': f'{stats["peak_entities"]}',
+            'memory': f'{memory / 1024:.0f} KiB'}
+
+
+def bench_levels(atlas, ticks=300):
+    """
+    Play every level for `ticks` ticks, with the player walking right and
+    attacking every 10 ticks.
+
+    These are the hand-made levels of LevelManager (only the playable ones,
+    which have a starting position) and 500-char corridors of every style.
+    Memory is measured for setting the level, with the images already loaded.
+    Level switches are not blocked: if the player walks out of a short level,
+    the rest of the run happens on the next one.
+    :return: a dict of {setup_name: seconds per tick or preformatted string}
+    """
+    results = {}
+    # Load the images, which are then shared by all simulations
+    simulation = Simulation(atlas, level_id=None)
+    level_ids = [x for x in simulation.levelgen.methods
+                 if x in simulation.levelgen.starting_positions]
+    level_ids += ['ghetto_corridor', 'dept_corridor', 'lab_corridor']
+    for level_id in level_ids:
+        simulation.levelgen.set_level(level_id, seed=0)
+        simulation.loop._run_iteration(0)
+    images = simulation.factory.images
+    for level_id in level_ids:
+        simulation = Simulation(atlas, level_id=None,
+                                script=fight_script(ticks))
+        simulation.factory.images = images
+        tracemalloc.start()
+        simulation.levelgen.set_level(level_id, seed=0)
+        simulation.loop._run_iteration(0)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for stat, value in simulation_results(simulation, ticks,
+                                              memory).items():
+            results[f'{level_id} {stat}'] = value
+    return results
+
+
+def bench_stress(atlas, ticks=100):
+    """
+    Run synthetic fights for `ticks` ticks in an empty 500-char room, with
+    the player walking right and attacking every 10 ticks.
+
+    The player has a million hitpoints to survive the crowds. Setups are:
+    100, 300 and 1000 punks all over the room; 200 bullets in flight at all
+    times, replaced as they leave the room; and 50 powered spikes along the
+    floor. Memory is measured for creating and adding the entities.
+    :return: a dict of {setup_name: seconds per tick or preformatted string}
+    """
+    results = {}
+
+    def create_punks(factory, count):
+        rng = Random(0)
+        for i in range(count):
+            factory.create_entity(('nunchaku_punk', 'bottle_punk')[i % 2],
+                                  (rng.randint(20, 480), rng.randint(15, 30)))
+
+    def create_bullets(factory):
+        passed = 0
+        for bullet in EntityTracker().filter_entities(
+                lambda x: x.id.startswith('bullet')):
+            passed += 1
+        for i in range(200 - passed):
+            factory.create_entity('bullet', (20 + i % 400, 20 + i % 20),
+                                  direction=('r', 'l')[i % 2])
+
+    def create_spikes(factory):
+        for i in range(50):
+            factory.create_entity('spike', (20 + i * 9, 30), powered=True)
+        for i in range(5):
+            factory.create_entity('science_prop', (30 + i * 90, 20))
+
+    setups = {'100 punks': lambda factory: create_punks(factory, 100),
+              '300 punks': lambda factory: create_punks(factory, 300),
+              '1000 punks': lambda factory: create_punks(factory, 1000),
+              '200 bullets': create_bullets,
+              '50 spikes': create_spikes}
+    # Load the images, which are then shared by all simulations
+    simulation = Simulation(atlas, level_id=None)
+    create_punks(simulation.factory, 2)
+    create_bullets(simulation.factory)
+    create_spikes(simulation.factory)
+    for entity_type in ('ghetto_bg', 'floor'):
+        simulation.factory.create_entity(entity_type, (0, 0), size=(500, 20))
+    images = simulation.factory.images
+    for setup, create in setups.items():
+        simulation = Simulation(atlas, level_id=None,
+                                script=fight_script(ticks))
+        factory = simulation.factory
+        factory.images = images
+        player = EntityTracker().entities['cop_1']
+        player.health.max_hitpoints = 1000000
+        player.health._hitpoints = 1000000
+        factory.create_entity('ghetto_bg', (0, 0), size=(500, 20))
+        factory.create_entity('floor', (0, 20), size=(500, 30))
+        tracemalloc.start()
+        create(factory)
+        simulation.loop._run_iteration(0)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        before_tick = (lambda: create_bullets(factory)) \
+            if setup == '200 bullets' else None
+        for stat, value in simulation_results(simulation, ticks, memory,
+                                              before_tick).items():
+            results[f'{setup} {stat}'] = value
+    return results
+
+
+def baseline_number(value):
+    """
+    Return the number a benchmark result starts with, or None.
+
+    Timings are floats, other results are strings like '120 KiB'.
+    :param value: float or str
+    :return: float or None
+    """
+    if isinstance(value, float):
+        return value
+    try:
+        return float(value.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+benchmarks = {'spawn_punks': bench_spawn_punks,
+              'projectiles': bench_projectiles,
+              'collisions': bench_collisions,
+              'spawns': bench_spawns,
+              'power': bench_power,
+              'saves': bench_saves,
+              'autosave': bench_autosave,
+              'load_npcs': bench_load_npcs,
+              'mixer': bench_mixer,
+              'sound_culling': bench_sound_culling,
+              'levelgen': bench_levelgen,
+              'decorations': bench_decorations,
+              'memory': bench_memory,
+              'level_switch': bench_level_switch,
+              'teardown': bench_teardown,
+              'prefabs': bench_prefabs,
+              'streaming': bench_streaming,
+              'long_levels': bench_long_levels,
+              'levels': bench_levels,
+              'stress': bench_stress}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('Brutality benchmarks')
+    parser.add_argument('names', nargs='*',
+                        help=f'Benchmarks to run: {", ".join(benchmarks)}')
+    parser.add_argument('--baseline', type=str,
+                        help='JSON file with results to compare against')
+    parser.add_argument('--save-baseline', type=str,
+                        help='Save the results to a JSON file')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            print(f'Unknown benchmark {name}', file=sys.stderr)
+            sys.exit(1)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    atlas = load_atlas()
+    all_results = {}
+    for name in args.names or benchmarks:
+        # Some game code and bear_hug listeners print debug info to stdout
+        with open(devnull, 'w') as null, redirect_stdout(null):
+            results = benchmarks[name](atlas)
+        all_results[name] = results
+        # Timings are reported in seconds, other measurements are
+        # preformatted strings
+        for setup, value in results.items():
+            old_value = baseline_number(baseline.get(name, {}).get(setup, ''))
+            new_value = baseline_number(value)
+            if isinstance(value, float):
+                value = f'{value * 1000:10.2f} ms'
+            change = ''
+            if old_value and new_value is not None:
+                change = f'{(new_value - old_value) / old_value:+8.1%}'
+            print(f'{name:<20} {setup:<48} {value:>13} {change}'.rstrip())
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(all_results, baseline_file, indent=1)
@@ -4,10 +4,136 @@ from math import sqrt
 from random import randint, choice
 
 from bear_hug.bear_utilities import BearECSException, rectangles_collide, \
-    BearException
+    BearException, BearJSONException
 from bear_hug.ecs import Component, PositionComponent, BearEvent, \
     Entity, EntityTracker, CollisionComponent, \
-    DestructorComponent, AnimationWidgetComponent
+    DestructorComponent, WidgetComponent, AnimationWidgetComponent, \
+    SwitchWidgetComponent, Singleton
+from bear_hug.widgets import Listener
+
+from registry import ClassRegistry, split_converters
+from widgets import widget_state, load_widget
+
+# Every character carries a dozen of these, so each component class lists the
+# attributes it introduces in __slots__. Base classes from bear_hug are not
+# slotted, so their attributes (and any ad hoc ones) still go to __dict__.
+# Attributes that are properties anywhere in the MRO must not be slotted.
+
+# Components describe themselves with `to_state()`, which returns a dict, and
+# their __repr__ is the JSON of that dict. `load_component` (or
+# `bear_hug.ecs.deserialize_component`) accepts either. By default, the dict
+# items are passed to the constructor as kwargs; a class that needs anything
+# else defines a `from_state()` classmethod. bear_hug components only have
+# JSON __repr__, so the attributes of those base classes are parsed from it.
+
+# Classes for `load_component`
+component_classes = ClassRegistry(Component)
+
+
+def component_state(component):
+    """
+    Return a dict that describes a component for `load_component`.
+
+    Works for bear_hug components without `to_state()` too. The widgets of
+    WidgetComponents are described by `widgets.widget_state`, so that their
+    images are not encoded to JSON and parsed back.
+    :param component: a Component
+    :return: dict
+    """
+    if hasattr(component, 'to_state'):
+        return component.to_state()
+    if type(component) in (WidgetComponent, SwitchWidgetComponent):
+        return {'class': component.__class__.__name__,
+                'widget': widget_state(component.widget)}
+    return loads(repr(component))
+
+
+def entity_state(entity):
+    """
+    Return a dict that describes an entity for `load_entity`.
+
+    Unlike `repr(entity)`, the components are stored as dicts, not as JSON
+    strings, so the entire entity is encoded only once.
+    :param entity: an Entity
+    :return: dict
+    """
+    return {'id': entity.id,
+            'components': {x: component_state(entity.__dict__[x])
+                           for x in entity.components}}
+
+
+def load_component(state, dispatcher):
+    """
+    Create a component from a dict made by `component_state` or a JSON string.
+
+    Works like `bear_hug.ecs.deserialize_component`, but the class is looked
+    up in `component_classes` instead of the interpreter stack. If the class
+    has `from_state()`, it creates the component. The component is not
+    subscribed to anything or attached to an entity.
+    :param state: dict or JSON string
+    :param dispatcher: BearEventDispatcher for the component
+    :return: Component
+    """
+    if isinstance(state, str):
+        state = loads(state)
+    elif not isinstance(state, dict):
+        raise BearJSONException(f'Attempting to deserialize {type(state)} to Component')
+    for forbidden_key in ('name', 'owner', 'dispatcher'):
+        if forbidden_key in state:
+            raise BearJSONException(f'Forbidden key {forbidden_key} in component JSON')
+    if 'class' not in state:
+        raise BearJSONException('No class provided in component JSON')
+    class_var = component_classes.get(state['class'])
+    if hasattr(class_var, 'from_state'):
+        return class_var.from_state(state, dispatcher)
+    return class_var(dispatcher, **component_kwargs(class_var, state,
+                                                    dispatcher))
+
+
+def component_kwargs(class_var, state, dispatcher):
+    """
+    Return the kwargs for creating a component from a `component_state` dict.
+
+    Applies the converters and loads the widget. Raises BearJSONException if
+    the class does not accept some of the keys.
+    :param class_var: the component class
+    :param state: dict
+    :param dispatcher: BearEventDispatcher for the widget
+    :return: dict
+    """
+    values, converters = split_converters(state)
+    del values['class']
+    component_classes.check_kwargs(class_var, values)
+    kwargs = {}
+    for key, value in values.items():
+        if key in converters:
+            kwargs[key] = converters[key](value)
+        elif key == 'widget':
+            widget = load_widget(value)
+            dispatcher.register_listener(widget, 'tick')
+            kwargs[key] = widget
+        else:
+            kwargs[key] = value
+    return kwargs
+
+
+def load_entity(state, dispatcher):
+    """
+    Create an entity from a dict made by `entity_state` or a JSON string.
+
+    Works like `bear_hug.ecs.deserialize_entity`. The entity is not
+    announced with any events.
+    :param state: dict or JSON string
+    :param dispatcher: BearEventDispatcher for the components
+    :return: Entity
+    """
+    if isinstance(state, str):
+        state = loads(state)
+    elif not isinstance(state, dict):
+        raise BearJSONException(f'Attempting to deserialize {type(state)} to Entity')
+    return Entity(id=state['id'],
+                  components=[load_component(x, dispatcher)
+                              for x in state['components'].values()])
 
 
 class SpeakerWidgetComponent(AnimationWidgetComponent):
@@ -18,6 +144,8 @@ class SpeakerWidgetComponent(AnimationWidgetComponent):
     ('sound', False) and ('sound', True) values
     """
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dispatcher.register_listener(self, 'brut_change_config')
@@ -33,10 +161,48 @@ class SpeakerWidgetComponent(AnimationWidgetComponent):
             return super().on_event(event)
 
 
+class DecorationWidgetComponent(WidgetComponent):
+    """
+    A WidgetComponent for inert decorations.
+
+    All decorations of a given type share a single image, so each entity only
+    carries its own Widget with position and z-level. The component is not
+    subscribed to 'tick', since there is nothing to animate, and it is
+    serialized as an image ID instead of the full chars and colors.
+
+    A deserialized component has no widget; it is set by the EntityFactory
+    that loads the entity.
+    :param image_id: atlas element ID. Usually the same as decoration type
+    :param widget: Widget instance. Can be None only during deserialization
+    """
+
+    __slots__ = ('image_id',)
+
+    def __init__(self, dispatcher, image_id, widget=None, owner=None):
+        # Bypassing WidgetComponent.__init__ to avoid tick subscription and
+        # the widget check that would fail for the deserialized component
+        Component.__init__(self, dispatcher, name='widget', owner=owner)
+        self.image_id = image_id
+        self.widget = widget
+
+    def on_event(self, event):
+        pass
+
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'image_id': self.image_id}
+
+    def __repr__(self):
+        return dumps(self.to_state())
+
+
 class WalkerComponent(PositionComponent):
     """
     A simple PositionComponent that switches widgets appropriately
     """
+
+    __slots__ = ('direction', 'phase', 'moved_this_tick', 'jump_vx', 'jump_vy',
+                 'jump_direction', 'jump_timer', 'jump_duration')
     
     def __init__(self, *args, direction='r', initial_phase='1',
                  jump_duration=0.4, jump_timer=0,
@@ -78,7 +244,8 @@ class WalkerComponent(PositionComponent):
             self.phase = '2'
         else:
             self.phase = '1'
-        self.dispatcher.add_event(BearEvent('play_sound', 'step'))
+        self.dispatcher.add_event(BearEvent('play_sound',
+                                            ('step', self.owner.id)))
         self.owner.widget.switch_to_image(f'{self.direction}_{self.phase}')
 
     def jump(self):
@@ -150,7 +317,7 @@ class WalkerComponent(PositionComponent):
                     self.vy = -1 * self.vy
         return super().on_event(event)
 
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
         d.update({'direction': self.direction,
                   'initial_phase': self.phase,
@@ -159,7 +326,10 @@ class WalkerComponent(PositionComponent):
                   'jump_direction': self.jump_direction,
                   'jump_timer': self.jump_timer,
                   'jump_duration': self.jump_duration})
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class AttachedPositionComponent(PositionComponent):
@@ -170,6 +340,9 @@ class AttachedPositionComponent(PositionComponent):
     other's ``ecs_move`` events and repeats them.
     :param tracked_entity: entity ID
     """
+
+    __slots__ = ('tracked_entity',)
+
     def __init__(self, *args, tracked_entity=None, **kwargs):
         super().__init__(*args, **kwargs)
         # Could be None, in which case it acts like a regular PositionComponent
@@ -186,10 +359,13 @@ class AttachedPositionComponent(PositionComponent):
                 self.relative_move(*rel_move)
         return super().on_event(event)
 
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
         d['tracked_entity'] = self.tracked_entity
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class GravityPositionComponent(PositionComponent):
@@ -199,6 +375,9 @@ class GravityPositionComponent(PositionComponent):
     :param acceleration: A number. Acceleration in chars per second squared.
     Defaults to 10.0
     """
+
+    __slots__ = ('acceleration', 'update_freq', 'have_waited')
+
     def __init__(self, *args, acceleration=10.0, have_waited=0, **kwargs):
         super().__init__(*args, **kwargs)
         self.acceleration = acceleration
@@ -214,17 +393,23 @@ class GravityPositionComponent(PositionComponent):
                 self.have_waited = 0
         return super().on_event(event)
 
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
-        {}.update({'acceleration': self.acceleration,
-                   'have_waited': self.have_waited})
-        return dumps(d)
+        d.update({'acceleration': self.acceleration,
+                  'have_waited': self.have_waited})
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class ProjectileCollisionComponent(CollisionComponent):
     """
     A collision component that damages whatever its owner is collided into
     """
+
+    __slots__ = ('damage',)
+
     def __init__(self, *args, damage=1, **kwargs):
         super().__init__(*args, **kwargs)
         self.damage = damage
@@ -233,16 +418,20 @@ class ProjectileCollisionComponent(CollisionComponent):
         if not entity:
             self.owner.destructor.destroy()
         elif hasattr(EntityTracker().entities[entity], 'collision'):
-            self.dispatcher.add_event(BearEvent('play_sound', 'punch'))
+            self.dispatcher.add_event(BearEvent('play_sound',
+                                                ('punch', self.owner.id)))
             self.dispatcher.add_event(BearEvent(event_type='brut_damage',
                                                 event_value=(entity,
                                                              self.damage)))
             self.owner.destructor.destroy()
         
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
         d['damage'] = self.damage
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class PowerProjectileCollisionComponent(ProjectileCollisionComponent):
@@ -252,6 +441,9 @@ class PowerProjectileCollisionComponent(ProjectileCollisionComponent):
     Acts like a regular ProjectileCollisionComponent unless its target has
     PowerInteractionComponent, in which case it is powered
     """
+
+    __slots__ = ()
+
     def collided_into(self, other):
         if not other:
             self.owner.destructor.destroy()
@@ -274,6 +466,9 @@ class HealingProjectileCollisionComponent(CollisionComponent):
     """
     Like a bullet, except that it heals whoever it hits instead of damaging them
     """
+
+    __slots__ = ('healing',)
+
     def __init__(self, *args, healing=2, **kwargs):
         super().__init__(*args, **kwargs)
         self.healing=healing
@@ -303,6 +498,9 @@ class HazardCollisionComponent(CollisionComponent):
 
     Intended for use with flames, traps and such.
     """
+
+    __slots__ = ('damage', 'damage_cooldown', 'on_cooldown', 'have_waited')
+
     def __init__(self, *args, damage=1, damage_cooldown=0.3,
                  on_cooldown=False, have_waited=0, **kwargs):
         super().__init__(*args, **kwargs)
@@ -334,13 +532,16 @@ class HazardCollisionComponent(CollisionComponent):
                 self.have_waited = 0
         return super().on_event(event)
 
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
         d.update({'damage': self.damage,
                   'damage_cooldown': self.damage_cooldown,
                   'have_waited': self.have_waited,
                   'on_cooldown': self.on_cooldown})
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class GrenadeCollisionComponent(CollisionComponent):
@@ -352,6 +553,9 @@ class GrenadeCollisionComponent(CollisionComponent):
 
     Expects owner to have DestructorComponent
     """
+
+    __slots__ = ()
+
     def collided_into(self, entity):
         if entity is None:
             # If vy is negative (ie on the rise), it's possible that the grenade
@@ -372,6 +576,9 @@ class AmmoPickupCollisionComponent(CollisionComponent):
     an item that requires ammo. If it does, and if that item is not on full
     ammo, recharges the item, emits the appropriate event and self-destructs.
     """
+
+    __slots__ = ()
+
     def collided_by(self, other):
         # No sense instantiating entity tracker three times for as many entities
         tracker = EntityTracker()
@@ -395,6 +602,9 @@ class ScorePickupCollisionComponent(CollisionComponent):
     """
     A collision component for score pickup
     """
+
+    __slots__ = ('score', 'player_entity')
+
     def __init__(self, *args, score=10, player_entity='cop_1', **kwargs):
         super().__init__(*args, **kwargs)
         if not isinstance(score, int):
@@ -420,6 +630,8 @@ class GrenadeComponent(Component):
     explode upon hitting the ground.
     """
 
+    __slots__ = ('spawned_item', 'target_y', 'explosion_sound')
+
     def __init__(self, *args, spawned_item='flame', target_y=None,
                  explosion_sound=None, **kwargs):
         super().__init__(*args, **kwargs)
@@ -435,23 +647,31 @@ class GrenadeComponent(Component):
             if self.owner.position.y >= self.target_y:
                 if self.explosion_sound:
                     self.dispatcher.add_event(BearEvent('play_sound',
-                                                        self.explosion_sound))
+                                                        (self.explosion_sound,
+                                                         self.owner.id)))
                     # TODO: remove flame sound if I add other grenades
                     self.dispatcher.add_event(BearEvent('play_sound',
-                                                        'molotov_fire'))
+                                                        ('molotov_fire',
+                                                         self.owner.id)))
                 self.owner.spawner.spawn(self.spawned_item,
                                          (round(self.owner.widget.width/2),
                                           round(self.owner.widget.height/2)))
                 self.owner.destructor.destroy()
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = {'class': self.__class__.__name__}
         d.update({'spawned_item': self.spawned_item,
                   'target_y': self.target_y})
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class SoundDestructorComponent(DestructorComponent):
+
+    __slots__ = ('bg_sound',)
+
     def __init__(self, *args, bg_sound='supercop_bg', **kwargs):
         super().__init__(*args, **kwargs)
         self.bg_sound = bg_sound
@@ -460,10 +680,101 @@ class SoundDestructorComponent(DestructorComponent):
         self.dispatcher.add_event(BearEvent('set_bg_sound', self.bg_sound))
         super().destroy()
 
+
+class PooledDestructorComponent(DestructorComponent):
+    """
+    A destructor for short-lived entities that are recycled by the factory.
+
+    Works like a regular DestructorComponent, except that the owner keeps its
+    components. They are unsubscribed as usual, but their event types are
+    remembered, and on 'tick_over' the owner is returned to
+    `factory.release_entity()` instead of being dismantled. When the factory
+    reuses the entity, it calls `self.resubscribe()` to restore all
+    subscriptions.
+
+    If `factory` is not set (for example, the entity was loaded from a save),
+    this component behaves exactly like its parent.
+
+    :param factory: EntityFactory instance
+    """
+
+    __slots__ = ('factory', 'pool_key', 'subscriptions')
+
+    def __init__(self, *args, factory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.factory = factory
+        self.pool_key = None
+        self.subscriptions = {}
+
+    def destroy(self):
+        if self.is_destroying:
+            # Already scheduled for destruction this tick
+            return
+        if not self.factory:
+            return super().destroy()
+        self.dispatcher.add_event(BearEvent('ecs_destroy', self.owner.id))
+        self.is_destroying = True
+        for component in self.owner.components:
+            if component != self.name:
+                self._unsubscribe(component)
+
+    def _unsubscribe(self, component):
+        """
+        Unsubscribe a component from everything, remembering event types
+
+        Some components are subscribed to the same event type more than once
+        (eg GravityPositionComponent and its parent both subscribe to 'tick'),
+        so every subscription is removed and remembered.
+        :param component: component name
+        """
+        listener = self.owner.__dict__[component]
+        event_types = []
+        for event_type in self.dispatcher.listeners:
+            while listener in self.dispatcher.listeners[event_type]:
+                self.dispatcher.listeners[event_type].remove(listener)
+                event_types.append(event_type)
+        self.subscriptions[component] = event_types
+
+    def resubscribe(self):
+        """
+        Subscribe all owner's components to the event types they had before
+        destruction.
+        """
+        for component, event_types in self.subscriptions.items():
+            for event_type in event_types:
+                self.dispatcher.listeners[event_type].append(
+                    self.owner.__dict__[component])
+        self.subscriptions = {}
+
+    def on_event(self, event):
+        if not self.factory:
+            return super().on_event(event)
+        if self.is_destroying and event.event_type == 'service' \
+                and event.event_value == 'tick_over':
+            # The dispatcher is iterating over the 'service' listeners right
+            # now. Removing self from that list would make it skip the next
+            # listener, so the lists are replaced instead of changed in place
+            event_types = []
+            for event_type in self.dispatcher.listeners:
+                if self in self.dispatcher.listeners[event_type]:
+                    event_types.append(event_type)
+                    self.dispatcher.listeners[event_type] = \
+                        [x for x in self.dispatcher.listeners[event_type]
+                         if x is not self]
+            self.subscriptions[self.name] = event_types
+            self.is_destroying = False
+            self.factory.release_entity(self.owner)
+
+    # No factory or pool key in __repr__: entities loaded from a save are not
+    # recycled
+
 class HealthComponent(Component):
     """
     A component that monitors owner's health and processes its changes.
     """
+
+    __slots__ = ('max_hitpoints', '_hitpoints')
+
     def __init__(self, *args, hitpoints=3, **kwargs):
         super().__init__(*args, name='health', **kwargs)
         self.dispatcher.register_listener(self, ('brut_damage', 'brut_heal'))
@@ -499,9 +810,12 @@ class HealthComponent(Component):
         """
         raise NotImplementedError('HP update processing should be overridden')
     
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'hitpoints': self.hitpoints}
+
     def __repr__(self):
-        return dumps({'class': self.__class__.__name__,
-                      'hitpoints': self.hitpoints})
+        return dumps(self.to_state())
 
 
 class SwitchHealthComponent(HealthComponent):
@@ -519,6 +833,11 @@ class SwitchHealthComponent(HealthComponent):
 
     Expects owner's widget component to be SwitchWidgetComponent
     """
+
+    __slots__ = ('current_state', 'on_event_type', 'on_event_value',
+                 'on_sound', 'on_widget', 'off_event_type', 'off_event_value',
+                 'off_sound', 'off_widget')
+
     def __init__(self, *args,
                  initial_state=False,
                  on_event_type='brut_change_config',
@@ -575,8 +894,8 @@ class SwitchHealthComponent(HealthComponent):
         return [BearEvent(self.off_event_type, self.off_event_value),
                 BearEvent('play_sound', self.off_sound)]
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['initial_state'] = self.current_state
         d['on_event_type'] = self.on_event_type
         d['on_event_value'] = self.on_event_value
@@ -586,13 +905,16 @@ class SwitchHealthComponent(HealthComponent):
         d['off_event_value'] = self.off_event_value
         d['off_sound'] = self.off_sound
         d['off_widget'] = self.off_widget
-        return dumps(d)
+        return d
 
 
 class DestructorHealthComponent(HealthComponent):
     """
     Destroys entity upon reaching zero HP
     """
+
+    __slots__ = ()
+
     def process_hitpoint_update(self):
         if self.hitpoints == 0 and hasattr(self.owner, 'destructor'):
             self.owner.destructor.destroy()
@@ -602,6 +924,9 @@ class SpawnerDestructorHealthComponent(HealthComponent):
     """
     Destroys entity upon reaching zero HP and spawns an item
     """
+
+    __slots__ = ('spawned_item', 'relative_pos')
+
     def __init__(self, *args, spawned_item='pistol', relative_pos=(0, 0),
                  **kwargs):
         super().__init__(*args, **kwargs)
@@ -622,6 +947,10 @@ class CharacterHealthComponent(HealthComponent):
     Expects owner to have SpawnerComponent, HandInterfaceComponent and
     DestructorComponent
     """
+
+    __slots__ = ('corpse_type', 'hit_sounds', 'heal_sounds', 'death_sounds',
+                 'last_hp', 'score')
+
     def __init__(self, *args, corpse=None, heal_sounds=('bandage', ),
                  hit_sounds=None, death_sounds=None,
                  score=None, **kwargs):
@@ -637,11 +966,13 @@ class CharacterHealthComponent(HealthComponent):
         if 0 < self.hitpoints < self.last_hp and self.hit_sounds:
             self.last_hp = self.hitpoints
             self.dispatcher.add_event(BearEvent('play_sound',
-                                                choice(self.hit_sounds)))
+                                                (choice(self.hit_sounds),
+                                                 self.owner.id)))
         elif 0 < self.last_hp < self.hitpoints and self.heal_sounds:
             self.last_hp = self.hitpoints
             self.dispatcher.add_event(BearEvent('play_sound',
-                                                choice(self.heal_sounds)))
+                                                (choice(self.heal_sounds),
+                                                 self.owner.id)))
         if self.hitpoints == 0:
             self.owner.spawner.spawn(self.corpse_type,
                                      relative_pos=(0, self.owner.widget.height - 9))
@@ -652,7 +983,9 @@ class CharacterHealthComponent(HealthComponent):
             EntityTracker().entities[self.owner.hands.right_item].destructor.destroy()
             # Dump score ball, if any
             if self.score:
-                self.dispatcher.add_event(BearEvent('play_sound', 'coin_drop'))
+                self.dispatcher.add_event(BearEvent('play_sound',
+                                                    ('coin_drop',
+                                                     self.owner.id)))
                 self.owner.spawner.spawn('score_pickup', (randint(-3, 6),
                                                           self.owner.widget.height-2),
                                          score=self.score)
@@ -660,13 +993,14 @@ class CharacterHealthComponent(HealthComponent):
                 if self.owner.id == 'cop_1':
                     self.dispatcher.add_event(BearEvent('set_bg_sound', None))
                 self.dispatcher.add_event(BearEvent('play_sound',
-                                                    choice(self.death_sounds)))
+                                                    (choice(self.death_sounds),
+                                                     self.owner.id)))
             self.owner.destructor.destroy()
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['corpse'] = self.corpse_type
-        return dumps(d)
+        return d
 
 
 class VisualDamageHealthComponent(HealthComponent):
@@ -678,6 +1012,9 @@ class VisualDamageHealthComponent(HealthComponent):
     a dict key, but less than the next one (in increasing order).
     If HP reaches zero and object has a Destructor component, it is destroyed
     """
+
+    __slots__ = ('widgets_dict', 'hit_sounds')
+
     def __init__(self, *args, widgets_dict={}, hit_sounds=(), **kwargs):
         super().__init__(*args, **kwargs)
         self.widgets_dict = OrderedDict()
@@ -691,17 +1028,168 @@ class VisualDamageHealthComponent(HealthComponent):
     def process_hitpoint_update(self):
         if self.hit_sounds:
             self.dispatcher.add_event(BearEvent('play_sound',
-                                                choice(self.hit_sounds)))
+                                                (choice(self.hit_sounds),
+                                                 self.owner.id)))
         if self.hitpoints == 0 and hasattr(self.owner, 'destructor'):
             self.owner.destructor.destroy()
         for x in self.widgets_dict:
             if self.hitpoints >= x:
                 self.owner.widget.switch_to_image(self.widgets_dict[x])
                 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['widgets_dict'] = self.widgets_dict
-        return dumps(d)
+        return d
+
+
+class PowerNetwork(Listener, metaclass=Singleton):
+    """
+    A singleton Listener that keeps track of all entities with
+    PowerInteractionComponent and the links between them.
+
+    Every entity with a `powered` component is a node. Nodes whose component
+    has a `range` (ie spikes) are linked to all other nodes within that range,
+    and shoot sparks at them. Distances are measured between entity positions,
+    which are assumed not to change after the entity is added.
+
+    Nodes are kept in a grid of `cell_size`-sized cells, so adding or removing
+    one only checks its neighbourhood. Should be subscribed to 'ecs_add' and
+    'ecs_destroy'.
+
+    :param cell_size: int. Grid cell size, in chars.
+    """
+    def __init__(self, cell_size=40):
+        super().__init__()
+        self.cell_size = cell_size
+        # Entity ID -> position
+        self.nodes = {}
+        # Entity ID -> the point sparks aim at
+        self.aims = {}
+        # Entity ID -> range, for those nodes that shoot at others
+        self.ranges = {}
+        self.max_range = 0
+        # Entity ID -> a list of entity IDs it shoots at. Lists are in the
+        # order of node creation, so that the choice of a target depends on
+        # the RNG state only
+        self.targets = {}
+        # Entity ID -> a set of entity IDs linked in either direction
+        self.links = {}
+        # Cell -> a set of entity IDs
+        self.cells = {}
+        self.order = {}
+        self.added_count = 0
+
+    def _cell(self, pos):
+        return pos[0] // self.cell_size, pos[1] // self.cell_size
+
+    def _within(self, pos, distance):
+        """
+        Return IDs of all nodes within a given distance from pos.
+        """
+        r = []
+        x0, y0 = self._cell((pos[0] - distance, pos[1] - distance))
+        x1, y1 = self._cell((pos[0] + distance, pos[1] + distance))
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                if (x, y) not in self.cells:
+                    continue
+                for node in self.cells[(x, y)]:
+                    dx = pos[0] - self.nodes[node][0]
+                    dy = pos[1] - self.nodes[node][1]
+                    if dx ** 2 + dy ** 2 <= distance ** 2:
+                        r.append(node)
+        return r
+
+    def _link(self, source, target):
+        self.targets[source].append(target)
+        self.links[source].add(target)
+        self.links[target].add(source)
+
+    def add_node(self, entity):
+        """
+        Add an entity to the network and link it to its neighbours.
+
+        :param entity: an Entity with a `powered` component
+        """
+        if entity.id in self.nodes:
+            self.remove_node(entity.id)
+        pos = entity.position.pos
+        self.nodes[entity.id] = pos
+        self.aims[entity.id] = (pos[0] + entity.widget.width // 2,
+                                pos[1] + entity.widget.height - 12)
+        self.order[entity.id] = self.added_count
+        self.added_count += 1
+        self.links[entity.id] = set()
+        cell = self._cell(pos)
+        if cell not in self.cells:
+            self.cells[cell] = set()
+        self.cells[cell].add(entity.id)
+        if hasattr(entity.powered, 'range'):
+            self.ranges[entity.id] = entity.powered.range
+            self.max_range = max(self.max_range, entity.powered.range)
+            self.targets[entity.id] = []
+            for node in sorted(self._within(pos, entity.powered.range),
+                               key=self.order.get):
+                if node != entity.id:
+                    self._link(entity.id, node)
+        # Nodes that can reach the new one
+        for node in sorted(self._within(pos, self.max_range),
+                           key=self.order.get):
+            if node != entity.id and node in self.ranges:
+                dx = pos[0] - self.nodes[node][0]
+                dy = pos[1] - self.nodes[node][1]
+                if dx ** 2 + dy ** 2 <= self.ranges[node] ** 2:
+                    self._link(node, entity.id)
+
+    def remove_node(self, entity_id):
+        """
+        Remove an entity from the network, with all its links.
+
+        :param entity_id: entity ID
+        """
+        if entity_id not in self.nodes:
+            return
+        for node in self.links.pop(entity_id):
+            self.links[node].discard(entity_id)
+            if node in self.targets and entity_id in self.targets[node]:
+                self.targets[node].remove(entity_id)
+        cell = self._cell(self.nodes.pop(entity_id))
+        self.cells[cell].discard(entity_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        del self.aims[entity_id]
+        del self.order[entity_id]
+        self.ranges.pop(entity_id, None)
+        self.targets.pop(entity_id, None)
+
+    def get_component(self, entity_id):
+        """
+        Return IDs of all nodes connected to a given one, directly or not.
+
+        Links are treated as undirected, so a machine and all spikes powering it
+        are in the same component.
+        :param entity_id: entity ID
+        :return: a set of entity IDs, including `entity_id` itself
+        """
+        if entity_id not in self.nodes:
+            return set()
+        component = {entity_id}
+        queue = [entity_id]
+        while queue:
+            for node in self.links[queue.pop()]:
+                if node not in component:
+                    component.add(node)
+                    queue.append(node)
+        return component
+
+    def on_event(self, event):
+        if event.event_type == 'ecs_add':
+            # The entity may have been destroyed before this event got here
+            entity = EntityTracker().entities.get(event.event_value[0])
+            if entity and 'powered' in entity.components:
+                self.add_node(entity)
+        elif event.event_type == 'ecs_destroy':
+            self.remove_node(event.event_value)
 
 
 class PowerInteractionComponent(Component):
@@ -714,6 +1202,9 @@ class PowerInteractionComponent(Component):
     ray emitters are powered by them, etc. This is the component responsible
     for those behaviours
     """
+
+    __slots__ = ('powered', 'action_cooldown', 'have_waited')
+
     def __init__(self, *args, powered=False, action_cooldown=0.1, **kwargs):
         super().__init__(*args, name='powered', **kwargs)
         self.powered = powered
@@ -738,11 +1229,14 @@ class PowerInteractionComponent(Component):
                 self.take_action()
                 self.have_waited -= self.action_cooldown
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = {'class': self.__class__.__name__}
         d.update({'powered': self.powered,
                   'action_cooldown': self.action_cooldown})
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class SciencePropPowerInteractionComponent(PowerInteractionComponent):
@@ -752,6 +1246,9 @@ class SciencePropPowerInteractionComponent(PowerInteractionComponent):
 
     Expects the owner's WidgetComponent to be a SwitchWidgetComponent
     """
+
+    __slots__ = ()
+
     def get_power(self):
         super().get_power()
         self.owner.widget.switch_to_image('powered')
@@ -759,7 +1256,8 @@ class SciencePropPowerInteractionComponent(PowerInteractionComponent):
     def take_action(self):
         self.powered = False
         self.owner.widget.switch_to_image('unpowered')
-        self.dispatcher.add_event(BearEvent('play_sound', 'blue_machine'))
+        self.dispatcher.add_event(BearEvent('play_sound',
+                                            ('blue_machine', self.owner.id)))
 
 
 class SpikePowerInteractionComponent(PowerInteractionComponent):
@@ -767,53 +1265,23 @@ class SpikePowerInteractionComponent(PowerInteractionComponent):
     Power interaction component for spikes.
 
     They spam sparks towards any entities with PowerInteractionComponent
-    within range
+    within range. The targets are tracked by PowerNetwork.
     """
+
+    __slots__ = ('range',)
+
     def __init__(self, *args, range=40, **kwargs):
         super().__init__(*args, **kwargs)
         self.range = range
-        self.targets = {}
-        self.target_names = []
-        self.dispatcher.register_listener(self, ('ecs_add', 'ecs_destroy'))
 
     def get_power(self):
         super().get_power()
         self.owner.widget.switch_to_image('powered')
 
-    def on_event(self, event):
-        r = super().on_event(event)
-        if event.event_type == 'ecs_add':
-            entity = EntityTracker().entities[event.event_value[0]]
-            if not hasattr(entity, 'powered') or entity.id in self.target_names:
-                return
-            if event.event_value[0] == self.owner.id:
-                # On deployment, look for nearby machines
-                powered = EntityTracker().filter_entities(lambda x: hasattr(x, 'powered'))
-                for machine in powered:
-                    dx = self.owner.position.x - machine.position.x
-                    dy = self.owner.position.y - machine.position.y
-                    dist = sqrt(dx ** 2 + dy ** 2)
-                    if dist <= self.range and machine.id != self.owner.id and \
-                            machine.id not in self.target_names:
-                        self.targets[machine.id] = (machine.position.pos[0],
-                                                    machine.position.pos[1])
-                        self.target_names.append(machine.id)
-            else:
-                dx = self.owner.position.x - entity.position.x
-                dy = self.owner.position.y - entity.position.y
-                dist = sqrt(dx ** 2 + dy ** 2)
-                if dist <= self.range and entity.id not in self.target_names:
-                    self.targets[entity.id] = (entity.position.pos[0] + entity.widget.width // 2,
-                                               entity.position.pos[1] + entity.widget.height - 12)
-                    self.target_names.append(entity.id)
-        elif event.event_type == 'ecs_destroy':
-            if event.event_value in self.targets:
-                self.target_names.remove(event.event_value)
-                del self.targets[event.event_value]
-
     def take_action(self, *args, **kwargs):
-        if self.targets:
-            target = self.targets[choice(self.target_names)]
+        network = PowerNetwork()
+        if network.targets.get(self.owner.id):
+            target = network.aims[choice(network.targets[self.owner.id])]
             dx = target[0] - self.owner.position.x - 2
             dy = target[1] - self.owner.position.y - 7
             dx_sign = abs(dx) // dx if dx != 0 else 0
@@ -829,12 +1297,12 @@ class SpikePowerInteractionComponent(PowerInteractionComponent):
                                      vy=vy * dy_sign,
                                      **kwargs)
             self.dispatcher.add_event(BearEvent('play_sound',
-                                                'spark'))
+                                                ('spark', self.owner.id)))
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['range'] = self.range
-        return dumps(d)
+        return d
 
 
 class HealerPowerInteractionComponent(PowerInteractionComponent):
@@ -845,6 +1313,9 @@ class HealerPowerInteractionComponent(PowerInteractionComponent):
     Expects its widget to be a SwitchWidget with 'powered' and 'unpowered'
     states.
     """
+
+    __slots__ = ()
+
     def get_power(self):
         super().get_power()
         self.owner.widget.switch_to_image('powered')
@@ -852,7 +1323,8 @@ class HealerPowerInteractionComponent(PowerInteractionComponent):
     def take_action(self, *args, **kwargs):
         vx = randint(-10, 10)
         vy = randint(-10, 10)
-        self.dispatcher.add_event(BearEvent('play_sound', 'balloon'))
+        self.dispatcher.add_event(BearEvent('play_sound',
+                                            ('balloon', self.owner.id)))
         self.owner.spawner.spawn('healing_projectile', (5 * vx // abs(vx) if vx != 0 else choice((5, -5)),
                                                         5 * vy // abs(vy) if vy != 0 else choice((5, -5))),
                                  vx=vx, vy=vy)
@@ -865,6 +1337,9 @@ class SpawnerComponent(Component):
     A component responsible for spawning stuff near its owner
     For projectiles and other such things
     """
+
+    __slots__ = ('factory',)
+
     def __init__(self, *args, factory=None, **kwargs):
         super().__init__(*args, name='spawner', **kwargs)
         self.factory = factory
@@ -892,6 +1367,9 @@ class FactionComponent(Component):
 
     :param phrase_color: str. The color that should be used in speech
     """
+
+    __slots__ = ('faction', 'phrase_color')
+
     colors = {'police': '#aaaaaa',
               'scientists': '#aaaaaa',
               'punks': '#ffffff',
@@ -904,29 +1382,42 @@ class FactionComponent(Component):
         self.faction = faction
         self.phrase_color = self.colors[faction]
         
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'faction': self.faction}
+
     def __repr__(self):
-        return dumps({'class': self.__class__.__name__,
-                      'faction': self.faction})
+        return dumps(self.to_state())
 
 
 class LevelSwitchComponent(Component):
     """
     Stores the level ID for the level switch widgets
     """
+
+    __slots__ = ('next_level',)
+
     # TODO: let LevelSwitchComponent track whether the level was won or lost
     def __init__(self, *args, next_level='ghetto_test', **kwargs):
         super().__init__(*args, name='level_switch', **kwargs)
         self.next_level = next_level
 
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'next_level': self.next_level}
+
     def __repr__(self):
-        return dumps({'class': self.__class__.__name__,
-                      'next_level': self.next_level})
+        return dumps(self.to_state())
 
 
 class InputComponent(Component):
     """
     A component that handles input.
     """
+
+    __slots__ = ('walk_delay', 'current_walk_delay', 'action_delay',
+                 'current_action_delay', 'next_move', 'accepts_input')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, name='controller', **kwargs)
         self.dispatcher.register_listener(self, ['key_down', 'tick'])
@@ -1014,6 +1505,10 @@ class HidingComponent(Component):
 
     Expects owner to have PositionComponent and WidgetComponent
     """
+
+    __slots__ = ('is_working', 'should_hide', 'hide_condition', 'lifetime',
+                 'age')
+
     def __init__(self, *args, hide_condition='keypress',
                  lifetime=1.0, age=0, is_working=False,
                  should_hide=True,
@@ -1073,13 +1568,16 @@ class HidingComponent(Component):
             if self.age >= self.lifetime:
                 self.hide()
 
+    def to_state(self):
+        return {'class': self.__class__.__name__,
+                'hide_condition': self.hide_condition,
+                'should_hide': self.should_hide,
+                'lifetime': self.lifetime,
+                'age': self.age,
+                'is_working': self.is_working}
+
     def __repr__(self):
-        return dumps({'class': self.__class__.__name__,
-                      'hide_condition': self.hide_condition,
-                      'should_hide': self.should_hide,
-                      'lifetime': self.lifetime,
-                      'age': self.age,
-                      'is_working': self.is_working})
+        return dumps(self.to_state())
         
 
 class ParticleDestructorComponent(DestructorComponent):
@@ -1093,6 +1591,10 @@ class ParticleDestructorComponent(DestructorComponent):
     Unlike SpawnerDestructorComponent, contains a pile of data related to the
     particle effects
     """
+
+    __slots__ = ('spawned_item', 'relative_pos', 'size', 'character',
+                 'char_count', 'char_speed', 'color', 'lifetime')
+
     def __init__(self, *args, spawned_item, relative_pos = (0, 0),
                  size=(10, 10),
                  character=',', char_count=8, char_speed=10,
@@ -1116,7 +1618,7 @@ class ParticleDestructorComponent(DestructorComponent):
                                  color=self.color, lifetime=self.lifetime)
         super().destroy()
 
-    def __repr__(self):
+    def to_state(self):
         d = loads(super().__repr__())
         d['spawned_item'] = self.spawned_item
         d['relative_pos'] = self.relative_pos
@@ -1126,7 +1628,10 @@ class ParticleDestructorComponent(DestructorComponent):
         d['char_speed'] = self.char_speed
         d['color'] = self.color
         d['lifetime'] = self.lifetime
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class HandInterfaceComponent(Component):
@@ -1151,6 +1656,10 @@ class HandInterfaceComponent(Component):
     Expects owner to have a PositionComponent.
 
     """
+
+    __slots__ = ('hand_entities', 'hands_offsets', 'item_offsets', 'left_item',
+                 'right_item', 'which_hand')
+
     def __init__(self, *args, hand_entities, hands_offsets, item_offsets,
                  left_item=None,
                  right_item=None,
@@ -1281,7 +1790,8 @@ class HandInterfaceComponent(Component):
             item.position.move(*pos)
             item.widget.z_level = item.position.y + item.widget.height
             item.hiding.unhide()
-            self.dispatcher.add_event(BearEvent('play_sound', 'item_drop'))
+            self.dispatcher.add_event(BearEvent('play_sound',
+                                                ('item_drop', self.owner.id)))
             if restore_fist:
                 # Install fist
                 if hand == 'right':
@@ -1312,14 +1822,17 @@ class HandInterfaceComponent(Component):
                                                      'left',
                                                      self.left_item)))
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = {'class': self.__class__.__name__}
         d['hand_entities'] = self.hand_entities
         d['hands_offsets'] = self.hands_offsets
         d['item_offsets'] = self.item_offsets
         d['left_item'] = self.left_item
         d['right_item'] = self.right_item
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class CollectableBehaviourComponent(Component):
@@ -1328,6 +1841,9 @@ class CollectableBehaviourComponent(Component):
 
     This is actually empty and marks entity as pick up-able.
     """
+
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, name='collectable', **kwargs)
 
@@ -1337,6 +1853,10 @@ class ItemBehaviourComponent(Component):
     A component that makes its Entity an owned item.
     """
 
+    __slots__ = ('single_use', 'max_ammo', '_ammo', 'use_sound',
+                 'is_destroying', 'grab_offset', 'item_name', 'use_delay',
+                 'item_description', '_owning_entity', '_future_owner')
+
     def __init__(self, *args, owning_entity=None,
                  single_use=False,
                  max_ammo=None,
@@ -1415,7 +1935,9 @@ class ItemBehaviourComponent(Component):
         if self.single_use:
             self.is_destroying = True
         if self.use_sound:
-            self.dispatcher.add_event(BearEvent('play_sound', self.use_sound))
+            self.dispatcher.add_event(BearEvent('play_sound',
+                                                (self.use_sound,
+                                                 self.owner.id)))
 
     def on_event(self, event):
         if event.event_type == 'brut_use_item' and event.event_value == self.owner.id:
@@ -1427,20 +1949,26 @@ class ItemBehaviourComponent(Component):
         elif event.event_type == 'tick' and self.is_destroying:
             self.owner.destructor.destroy()
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = {'class': self.__class__.__name__}
         try:
             d['owning_entity'] = self.owning_entity.id
         except AttributeError:
             d['owning_entity'] = self._future_owner
         d['grab_offset'] = self.grab_offset
-        return dumps(d)
+        return d
+
+    def __repr__(self):
+        return dumps(self.to_state())
 
 
 class HealingItemBehaviourComponent(ItemBehaviourComponent):
     """
     Heals owning_entity when used
     """
+
+    __slots__ = ('healing',)
+
     def __init__(self, *args, healing=2, **kwargs):
         super().__init__(*args, **kwargs)
         self.healing = healing
@@ -1463,6 +1991,9 @@ class SpawningItemBehaviourComponent(ItemBehaviourComponent):
     owner's widget to be SwitchWidgetComponent. Expects the method responsible
     for the creation of spawned object to accept ``direction`` kwarg
     """
+
+    __slots__ = ('spawned_items', 'damage')
+
     def __init__(self, *args, spawned_items={'bullet': {'r': (0, 0),
                                                         'l': (0, 0)}},
                  damage=3,
@@ -1475,7 +2006,8 @@ class SpawningItemBehaviourComponent(ItemBehaviourComponent):
         if self.max_ammo:
             if self.ammo == 0:
                 self.dispatcher.add_event(BearEvent('play_sound',
-                                                    'pistol_empty'))
+                                                    ('pistol_empty',
+                                                     self.owner.id)))
                 return
             else:
                 self.ammo -= 1
@@ -1491,9 +2023,9 @@ class SpawningItemBehaviourComponent(ItemBehaviourComponent):
                                      damage=self.damage)
 
 
-    def __repr__(self):
-        d = loads(super().__repr__())
+    def to_state(self):
+        d = super().to_state()
         d['spawned_items'] = self.spawned_items
-        return dumps(d)
+        return d
 
 # TODO: SpeechComponent
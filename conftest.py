@@ -0,0 +1,12 @@
+"""
+Shared fixtures for the tests.
+"""
+
+import pytest
+
+from headless import load_atlas
+
+
+@pytest.fixture(scope='session')
+def atlas():
+    return load_atlas()
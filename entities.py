@@ -1,5 +1,13 @@
-from bear_hug.bear_utilities import copy_shape
-from bear_hug.ecs import WidgetComponent, deserialize_entity, \
+from contextlib import contextmanager
+from copy import copy
+from functools import partial
+from json import loads
+from os import path
+from random import Random
+from threading import Lock
+
+from bear_hug.bear_utilities import copy_shape, BearException
+from bear_hug.ecs import WidgetComponent, \
     WalkerCollisionComponent, DecayComponent, SwitchWidgetComponent
 from bear_hug.widgets import SimpleAnimationWidget, Animation, Widget, \
     SwitchingWidget, Label
@@ -8,14 +16,15 @@ from ai import *
 from background import tile_randomly, generate_bg, ghetto_transition, \
     dept_transition, lab_transition
 from components import *
-from widgets import ParticleWidget, LevelSwitchWidget, SignpostWidget
+from widgets import ParticleWidget, LevelSwitchWidget, SignpostWidget, \
+    ChunkedECSLayout
 
 
 class EntityFactory:
     """
     A factory that produces all objects.
-    Only `factory.create_entity()` and `load_entity_from_JSON()` are exposed;
-    other methods are internal.
+    Only `factory.create_entity()`, `load_entity_from_state()` and
+    `load_entity_from_JSON()` are exposed; other methods are internal.
 
     This class (or its subclass) is expected to have a method for each kind of
     entity it creates. This method should have the name `factory._create_{item}`
@@ -23,108 +32,184 @@ class EntityFactory:
     `create_entity` call, if any, will be passed to the creator method. Since
     creator methods typically rely on `self.dispatcher` and other factory
     attributes, they shouldn't be static or classmethods.
+
+    Simple decorations and barriers don't have creator methods. Instead, they
+    are listed in a blueprints table (`blueprints.tsv`) along with their
+    collision data. Both creator methods and table rows are collected into
+    `self.blueprints` once, when the factory is created.
+
+    Images requested by creator methods are cached per image ID, so that every
+    entity of a given type shares the same chars and colors lists instead of
+    cutting a fresh copy from the atlas each time. Widgets never draw on these
+    lists (switching and animation only rebind `widget.chars` and
+    `widget.colors`), so sharing is safe. Any creator that needs to modify
+    an image in place should call `self.atlas.get_element` instead.
+
+    :param atlas: Atlas or Multiatlas with all the game images
+    :param dispatcher: BearEventDispatcher instance
+    :param layout: ScrollableECSLayout where the entities are shown
+    :param blueprints_file: path to the table of decorations and barriers.
+
+    Random choices made by creator methods use `self.random`, and random
+    backgrounds and floors use `self.bg_random`. LevelManager reseeds both
+    (see `self.seed`) when it builds a level, so that a level with a given
+    seed always looks the same.
+
+    Short-lived entities listed in `self.pooled_types` (projectiles, messages
+    and such) are not dismantled when destroyed. Their PooledDestructorComponent
+    returns them to the factory, which keeps them in `self.pools` and reuses
+    them the next time an entity of the same type is requested. For every
+    pooled type the factory should have a `factory._reset_{item}` method that
+    is called with the recycled entity and the `create_entity` kwargs and
+    brings its components to the state `_create_{item}` would have created.
     """
-    def __init__(self, atlas, dispatcher, layout):
+    def __init__(self, atlas, dispatcher, layout,
+                 blueprints_file=path.join(path.dirname(__file__),
+                                           'blueprints.tsv')):
         self.dispatcher = dispatcher
         self.atlas = atlas
         self.layout = layout
         self.counts = {}
-        # TODO: move decoration and barried data to TSV or something
-        self.decorations = {'can', 'can2', 'cigarettes', 'garbage_bag',
-                            'bucket', 'pizza_box',
-                            'cop_corpse', 'bottle_punk_corpse',
-                            'nunchaku_punk_corpse',
-                            'scientist_f_corpse', 'scientist_f2_corpse',
-                            'scientist_m_corpse', 'scientist_m2_corpse'}
-        self.barriers = {'broken_car', 'barricade_1', 'barricade_2',
-                         'barricade_3', 'dept_locker', 'dept_fence',
-                         'dept_bench', 'dept_wall_inner', 'punchbag',
-                         'dept_table_1', 'dept_table_2', 'dept_chair_1',
-                         'dept_chair_2', 'dept_weight',
-                         'science_table_1', 'science_table_2',
-                         'science_table_3', 'science_table_4',
-                         'science_device_1', 'lab_wall_inner'}
-        self.face_positions = {'broken_car': (0, 3),
-                               'barricade_1': (0, 2),
-                               'barricade_2': (0, 3),
-                               'barricade_3': (0, 5),
-                               'dept_locker': (0, 3),
-                               'dept_fence': (0, 0),
-                               'dept_bench': (0, 2),
-                               'dept_wall_inner': (0, 11),
-                               'lab_wall_inner': (0, 11),
-                               'punchbag': (0, 0),
-                               'dept_weight': (0, 8),
-                               'dept_table_1': (0, 10),
-                               'dept_table_2': (0, 11),
-                               'dept_chair_1': (0, 2),
-                               'dept_chair_2': (0, 2),
-                               'science_table_1': (0, 9),
-                               'science_table_2': (0, 6),
-                               'science_table_3': (0, 9),
-                               'science_table_4': (0, 9),
-                               'science_device_1': (0, 3)}
-        self.face_sizes = {'broken_car': (33, 11),
-                           'barricade_1': (7, 14),
-                           'barricade_2': (9, 11),
-                           'barricade_3': (11, 8),
-                           'dept_locker': (6, 17),
-                           'dept_fence': (21, 14),
-                           'dept_bench': (17, 5),
-                           'dept_wall_inner': (3, 21),
-                           'lab_wall_inner': (3, 20),
-                           'punchbag': (3, 26),
-                           'dept_weight': (23, 5),
-                           'dept_table_1': (10, 8),
-                           'dept_table_2': (11, 8),
-                           'dept_chair_1': (5, 10),
-                           'dept_chair_2': (5, 10),
-                           'science_table_1': (11, 9),
-                           'science_table_2': (29, 9),
-                           'science_table_3': (29, 9),
-                           'science_table_4': (11, 9),
-                           'science_device_1': (6, 17)}
-        self.depths = {'broken_car': 4,
-                       'barricade_1': 5,
-                       'barricade_2': 5,
-                       'barricade_3': 4,
-                       'dept_locker': 3,
-                       'dept_fence': 0,
-                       'dept_bench': 2,
-                       'dept_wall_inner': 11,
-                       'lab_wall_inner': 11,
-                       'punchbag': 1,
-                       'dept_weight': 5,
-                       'dept_table_1': 7,
-                       'dept_table_2': 7,
-                       'dept_chair_1': 1,
-                       'dept_chair_2': 1,
-                       'science_table_1': 7,
-                       'science_table_2': 2,
-                       'science_table_3': 2,
-                       'science_table_4': 7,
-                       'science_device_1': 3}
+        # Levels may be generated by detached copies of the factory in other
+        # threads (see `detached_copy`); they share the counters
+        self.counts_lock = Lock()
+        self.random = Random()
+        self.bg_random = Random()
+        self.images = {}
+        # Values are the kwargs that define the entity structure (widget images
+        # or event subscriptions). An entity is only reused for creation calls
+        # with the same values of these kwargs; all others are set by
+        # `_reset_{item}` methods.
+        self.pooled_types = {'bullet': ('direction',),
+                             'punch': ('direction',),
+                             'spark': (),
+                             'tall_spark': (),
+                             'healing_projectile': (),
+                             'bottle': ('direction',),
+                             'muzzle_flash': ('direction',),
+                             'message': ('destroy_condition',),
+                             'particle_explosion': ()}
+        self.pools = {}
+        self.pool_hits = {}
+        self.pool_misses = {}
+        self.decorations = set()
+        self.barriers = set()
+        # Maps every known entity type to a callable that accepts entity ID and
+        # `create_entity` kwargs and returns the new entity
+        self.blueprints = {}
+        self._compile_blueprints(blueprints_file)
+        # A list of (entity, pos, emit_show) while inside `bulk_creation()`
+        self._bulk = None
+        # GridCollisionListener is not a singleton, so the factory needs to be
+        # told about it to update it during bulk creation and removal
+        self.collision_listener = None
+        self.dispatcher.register_listener(self, 'brut_remove_entities')
+
+    def _compile_blueprints(self, blueprints_file):
+        """
+        Fill `self.blueprints` with creator methods and the types from the
+        blueprints table.
+
+        Table rows are validated here, so that a typo in the data file fails
+        on startup instead of in the middle of level generation.
+        :param blueprints_file: path to the TSV table
+        :return:
+        """
+        for attr in dir(self):
+            if attr.startswith('_create_'):
+                self.blueprints[attr[8:]] = getattr(self, attr)
+        for entity_type in self.pooled_types:
+            self.blueprints[entity_type] = partial(self._acquire_entity,
+                                                   entity_type)
+        with open(blueprints_file) as table:
+            for line_number, line in enumerate(table, start=1):
+                line = line.rstrip('\n')
+                if not line or line.startswith('#'):
+                    continue
+                row = line.split('\t')
+                if len(row) < 2:
+                    raise ValueError(f'No entity kind in {blueprints_file}:{line_number}')
+                entity_type, kind = row[:2]
+                if entity_type in self.blueprints:
+                    raise ValueError(f'Duplicate entity type {entity_type} in {blueprints_file}:{line_number}')
+                try:
+                    self._get_image(entity_type)
+                except (BearException, KeyError):
+                    raise ValueError(f'No atlas image for entity type {entity_type} in {blueprints_file}:{line_number}')
+                if kind == 'decoration':
+                    self.decorations.add(entity_type)
+                    self.blueprints[entity_type] = partial(
+                        self.generate_inactive_decoration,
+                        entity_type=entity_type)
+                elif kind == 'barrier':
+                    try:
+                        face_position = tuple(int(x)
+                                              for x in row[2].split(','))
+                        face_size = tuple(int(x) for x in row[3].split(','))
+                        depth = int(row[4])
+                    except (IndexError, ValueError):
+                        raise ValueError(f'Invalid barrier data for {entity_type} in {blueprints_file}:{line_number}')
+                    if len(face_position) != 2 or len(face_size) != 2 \
+                            or any(x < 0 for x in face_size) or depth < 0:
+                        raise ValueError(f'Invalid barrier data for {entity_type} in {blueprints_file}:{line_number}')
+                    self.barriers.add(entity_type)
+                    self.blueprints[entity_type] = partial(
+                        self.generate_barrier,
+                        entity_type=entity_type,
+                        face_position=face_position,
+                        face_size=face_size,
+                        depth=depth)
+                else:
+                    raise ValueError(f'Invalid kind {kind} for {entity_type} in {blueprints_file}:{line_number}')
+
+    def _get_image(self, image_id):
+        """
+        Return (chars, colors) for a given atlas element.
+
+        The first request for any image ID is passed to the atlas, later ones
+        return the same lists. They are shared by all widgets built from this
+        image and should never be changed in place.
+        :param image_id: str. Atlas element ID
+        :return: (chars, colors) tuple
+        """
+        try:
+            return self.images[image_id]
+        except KeyError:
+            self.images[image_id] = self.atlas.get_element(image_id)
+            return self.images[image_id]
 
     def load_entity_from_JSON(self, json_string, emit_show=True):
         """
-        Create the entity described by a JSON string
+        Create the entity described by a JSON string, ie `repr(entity)`.
+
+        See `load_entity_from_state`.
+        :param json_string:
+        :param emit_show:
+        :return:
+        """
+        self.load_entity_from_state(loads(json_string), emit_show=emit_show)
+
+    def load_entity_from_state(self, state, emit_show=True):
+        """
+        Create the entity described by a dict from `components.entity_state`
         This method does not check or correct anything, instead assuming that
-        the JSON file contains all necessary data. Emits 'ecs_create', 'ecs_add'
+        the dict contains all necessary data. Emits 'ecs_create', 'ecs_add'
         and, if `emit_show` is set to True, 'ecs_show'
-        :param json_string:
+        :param state: dict
         :param emit_show:
         :return:
         """
-        entity = deserialize_entity(json_string, self.dispatcher)
+        entity = load_entity(state, self.dispatcher)
         # make sure there is no collision with entity names that would be
         # generated later
         l = entity.id.split('_')
         name = '_'.join(l[:-1])
-        if name in self.counts:
-            num = int(l[-1])
-            if num > self.counts[name]:
-                print(name, num)
-                self.counts[name] = num
+        with self.counts_lock:
+            if name in self.counts:
+                num = int(l[-1])
+                if num > self.counts[name]:
+                    print(name, num)
+                    self.counts[name] = num
         self.dispatcher.add_event(BearEvent('ecs_create', entity))
         # Following hack is necessary because the SpawnerComponent adresses the
         # factory directly. If the factory could respond to events, the
@@ -132,10 +217,24 @@ class EntityFactory:
         # simple event emitter
         if hasattr(entity, 'spawner'):
             entity.spawner.factory = self
+        # Same for decorations, which are saved without their images
+        if hasattr(entity, 'widget') and \
+                isinstance(entity.widget, DecorationWidgetComponent):
+            entity.widget.widget = Widget(
+                *self._get_image(entity.widget.image_id))
         if emit_show:
-            if hasattr(entity, 'hiding') and entity.hiding.should_hide:
-                # If the entity needs to be hidden, don't add it
-                return
+            # Entities that were in use when the game was saved (eg a hand
+            # in the middle of a punch) are shown regardless, so that they
+            # can be hidden when their time runs out
+            if hasattr(entity, 'hiding') and not entity.hiding.is_working:
+                if entity.hiding.should_hide:
+                    # If the entity needs to be hidden, don't add it
+                    return
+                if hasattr(entity, 'item_behaviour') \
+                        and entity.item_behaviour.owning_entity:
+                    # Items in hands are created with should_hide=False, but
+                    # are not shown until they are used
+                    return
             self.dispatcher.add_event(BearEvent('ecs_add', (entity.id,
                                                         entity.position.x,
                                                         entity.position.y)))
@@ -144,13 +243,12 @@ class EntityFactory:
         """
         Create entity and emit the corresponding events.
 
-        If entity is in ``self.decorations``, calls
-        ``self.generate_inactive_decoration`` with the correct ID and type. In
-        this case, kwargs are ignored, since this kind of entity is not supposed
-        to have anything except widget and position.
-
-        Otherwise calls ``self._create_{entity_type}`` and passes all kwargs to
-        this method.
+        Looks up the entity type in ``self.blueprints`` and calls whatever is
+        registered there: a ``self._create_{entity_type}`` method, or
+        ``self.generate_inactive_decoration`` or ``self.generate_barrier`` for
+        the types from the blueprints table. Kwargs are passed to the creator;
+        decorations and barriers ignore them, since this kind of entity is not
+        supposed to have anything except widget, position and collision.
 
         In either case, this method takes care of providing correct entity ID
         and emitting ``ecs_create`` and, if requested, ``ecs_add``.
@@ -160,68 +258,428 @@ class EntityFactory:
         :param emit_show: bool. If True, emits ecs_add event
         :return:
         """
-        if entity_type in self.counts:
-            self.counts[entity_type] += 1
-        else:
-            self.counts[entity_type] = 1
-        if entity_type in self.decorations:
-            entity = self.generate_inactive_decoration(f'{entity_type}_{self.counts[entity_type]}',
-                                                       entity_type)
-        elif entity_type in self.barriers:
-            entity = self.generate_barrier(f'{entity_type}_{self.counts[entity_type]}',
-                                           entity_type)
-        else:
-            try:
-                entity = getattr(self, f'_create_{entity_type}')(
-                    entity_id=f'{entity_type}_{self.counts[entity_type]}',
-                    **kwargs)
-            except AttributeError:
-                raise BearECSException(f'Incorrect entity type {entity_type}')
+        try:
+            creator = self.blueprints[entity_type]
+        except KeyError:
+            raise BearECSException(f'Incorrect entity type {entity_type}')
+        with self.counts_lock:
+            if entity_type in self.counts:
+                self.counts[entity_type] += 1
+            else:
+                self.counts[entity_type] = 1
+            entity_id = f'{entity_type}_{self.counts[entity_type]}'
+        entity = creator(entity_id=entity_id, **kwargs)
         #Setting position of a child
         entity.position.move(*pos, emit_event=False)
+        if self._bulk is not None:
+            self._bulk.append((entity, pos, emit_show))
+            return
         self.dispatcher.add_event(BearEvent('ecs_create', entity))
         if emit_show:
             self.dispatcher.add_event(BearEvent('ecs_add', (entity.id, *pos)))
 
+    @contextmanager
+    def bulk_creation(self):
+        """
+        A context manager for creating lots of entities at once, eg a level.
+
+        Within it, `create_entity` does not emit 'ecs_create' and 'ecs_add'.
+        Instead, all entities are added to EntityTracker, the layout and
+        `self.collision_listener` directly when the block ends, and the layout
+        is marked for a single redraw. Other listeners to these event types
+        (if any) get the events directly from the factory at the same time.
+
+        Entities that creator methods announce themselves (eg hands and
+        weapons of characters) still go through the queue. Nested calls join
+        the outermost batch.
+        """
+        if self._bulk is not None:
+            yield
+            return
+        self._bulk = []
+        try:
+            yield
+        finally:
+            batch = self._bulk
+            self._bulk = None
+            self._add_entities(batch)
+
+    def _add_entities(self, batch):
+        """
+        Add a batch of entities to the game.
+
+        Does what 'ecs_create' and 'ecs_add' events would have done.
+        :param batch: a list of (entity, pos, emit_show) tuples
+        :return:
+        """
+        tracker = EntityTracker()
+        collision = self.collision_listener
+        for entity, pos, emit_show in batch:
+            tracker.entities[entity.id] = entity
+            self.layout.add_entity(entity)
+            if collision:
+                collision.entities[entity.id] = entity
+        for entity, pos, emit_show in batch:
+            if emit_show:
+                self.layout.add_child(entity.widget.widget, pos)
+                if collision:
+                    collision.track(entity.id)
+        self.layout.need_redraw = True
+        handled = (self.layout, tracker, collision)
+        events = {'ecs_create': [BearEvent('ecs_create', x[0]) for x in batch],
+                  'ecs_add': [BearEvent('ecs_add', (x[0].id, *x[1]))
+                              for x in batch if x[2]]}
+        for event_type in events:
+            for listener in list(self.dispatcher.listeners[event_type]):
+                if any(listener is x for x in handled):
+                    continue
+                for event in events[event_type]:
+                    r = listener.on_event(event)
+                    if isinstance(r, BearEvent):
+                        self.dispatcher.add_event(r)
+                    elif r:
+                        for returned in r:
+                            self.dispatcher.add_event(returned)
+
+    def remove_entities(self, entities, hide=False):
+        """
+        Remove a batch of entities from the game, eg the entire level.
+
+        Does what `entity.destructor.destroy()` and the resulting 'ecs_destroy'
+        events would have done, but in a single pass: every dispatcher list is
+        filtered once, and a single 'brut_remove_entities' event is emitted
+        instead of an 'ecs_destroy' per entity. When the factory gets it,
+        EntityTracker, the layout and `self.collision_listener` forget the
+        entities directly, and other 'ecs_destroy' listeners get the events
+        straight from the factory. Destructors are not called, so there are no
+        side effects such as particles or sounds.
+
+        Like with `destroy()`, the entities stay known to everyone until the
+        event is processed, so the events already queued about them (eg
+        collisions) can still be handled. With `hide`, their widgets are
+        removed from the layout right away. A level teardown needs that:
+        otherwise the next level is added before the old one is cleared, and
+        the layout has to filter every pointer list of the old level instead
+        of dropping its chunks whole.
+
+        Pooled entities are returned to their pools. Other entities are not
+        dismantled and are left to the garbage collector, since this may be
+        called while the dispatcher is delivering an event to their components.
+
+        Entities that are already being destroyed are skipped, their
+        destructors will finish the job.
+        :param entities: an iterable of entities
+        :param hide: bool. If True, widgets are removed from the layout now.
+        :return:
+        """
+        batch = [x for x in entities if not x.destructor.is_destroying]
+        if not batch:
+            return
+        # Every listener belonging to the batch -> (PooledDestructorComponent,
+        # component name) if it should be resubscribed later, else None
+        doomed = {}
+        for entity in batch:
+            pooled = isinstance(entity.destructor, PooledDestructorComponent) \
+                and entity.destructor.factory
+            for name in entity.components:
+                component = entity.__dict__[name]
+                doomed[id(component)] = (entity.destructor, name) if pooled \
+                    else None
+                if isinstance(component, AIComponent):
+                    # AI states subscribe on their own
+                    for state in component.states.values():
+                        doomed[id(state)] = None
+                elif isinstance(component, WidgetComponent):
+                    # So do the widgets loaded from JSON
+                    doomed[id(component.widget)] = None
+            entity.destructor.is_destroying = True
+        for event_type in self.dispatcher.listeners:
+            # Replaced rather than changed in place, because the dispatcher may
+            # be iterating over one of these lists right now
+            kept = []
+            for listener in self.dispatcher.listeners[event_type]:
+                if id(listener) not in doomed:
+                    kept.append(listener)
+                elif doomed[id(listener)]:
+                    destructor, name = doomed[id(listener)]
+                    if name not in destructor.subscriptions:
+                        destructor.subscriptions[name] = []
+                    destructor.subscriptions[name].append(event_type)
+            self.dispatcher.listeners[event_type] = kept
+        if hide:
+            self._hide_entities(batch)
+        self.dispatcher.add_event(BearEvent('brut_remove_entities', batch))
+
+    def _hide_entities(self, batch):
+        """
+        Remove the widgets of the entities from the layout.
+
+        The layout still knows the entities, so the events about them are
+        handled as for any other entity that is not shown.
+        :param batch: a list of entities
+        :return:
+        """
+        shown = [x.widget.widget for x in batch
+                 if x.widget.widget in self.layout.child_locations]
+        if isinstance(self.layout, ChunkedECSLayout):
+            self.layout.remove_children(shown)
+        else:
+            for widget in shown:
+                self.layout.remove_child(widget)
+        self.layout.need_redraw = True
+
+    def _finish_removal(self, batch):
+        """
+        Make everyone forget the entities unsubscribed by `remove_entities`.
+
+        Entity IDs may have been reused by the time this is called (eg when a
+        save is loaded right after the level is destroyed), so only the exact
+        same entity objects are removed.
+        :param batch: a list of entities
+        :return:
+        """
+        tracker = EntityTracker()
+        collision = self.collision_listener
+        shown = []
+        for entity in batch:
+            if tracker.entities.get(entity.id) is entity:
+                del tracker.entities[entity.id]
+            if self.layout.entities.get(entity.id) is entity:
+                del self.layout.entities[entity.id]
+                widget = self.layout.widgets.pop(entity.id)
+                if widget in self.layout.child_locations:
+                    shown.append(widget)
+            if collision and collision.entities.get(entity.id) is entity:
+                collision.untrack(entity.id)
+                del collision.entities[entity.id]
+        if isinstance(self.layout, ChunkedECSLayout):
+            self.layout.remove_children(shown)
+        else:
+            for widget in shown:
+                self.layout.remove_child(widget)
+        self.layout.need_redraw = True
+        for entity in batch:
+            if isinstance(entity.destructor, PooledDestructorComponent) \
+                    and entity.destructor.factory:
+                entity.destructor.is_destroying = False
+                self.release_entity(entity)
+        handled = (self.layout, tracker, collision)
+        for listener in list(self.dispatcher.listeners['ecs_destroy']):
+            if any(listener is x for x in handled):
+                continue
+            for entity in batch:
+                r = listener.on_event(BearEvent('ecs_destroy', entity.id))
+                if isinstance(r, BearEvent):
+                    self.dispatcher.add_event(r)
+                elif r:
+                    for returned in r:
+                        self.dispatcher.add_event(returned)
+
+    def on_event(self, event):
+        if event.event_type == 'brut_remove_entities':
+            self._finish_removal(event.event_value)
+
+    def seed(self, seed):
+        """
+        Reseed the random generators used by this factory.
+
+        Entities and backgrounds get separate streams, so that a change in the
+        number of random calls by one doesn't affect the other.
+        :param seed: any value accepted by random.seed
+        :return:
+        """
+        self.random.seed(f'{seed}/entities')
+        self.bg_random.seed(f'{seed}/backgrounds')
+
+    def detached_copy(self, dispatcher):
+        """
+        Return a copy of the factory that builds entities away from the game.
+
+        The copy is meant to be used in another thread (see
+        `mapgen.PreparedLevel`). Its entities are subscribed to `dispatcher`
+        instead of the game one, and `create_entity` only collects them, like
+        in `bulk_creation()`. Nothing is added to the game until the copy is
+        passed to `self.adopt_entities`. The copy shares the counters and the
+        image cache with this factory, but does not use the entity pools.
+        :param dispatcher: a BearEventDispatcher that is not used by the game
+        :return: EntityFactory instance
+        """
+        factory = copy(self)
+        factory.dispatcher = dispatcher
+        factory.random = Random()
+        factory.bg_random = Random()
+        factory.collision_listener = None
+        factory._bulk = []
+        # Creators are bound to this factory and have to be rebound
+        factory.blueprints = {}
+        for entity_type, creator in self.blueprints.items():
+            if entity_type in self.pooled_types:
+                creator = getattr(factory, f'_create_{entity_type}')
+            elif isinstance(creator, partial):
+                creator = partial(getattr(factory, creator.func.__name__),
+                                  *creator.args, **creator.keywords)
+            else:
+                creator = getattr(factory, creator.__name__)
+            factory.blueprints[entity_type] = creator
+        return factory
+
+    def adopt_entities(self, detached):
+        """
+        Add everything built by a detached copy of this factory to the game.
+
+        Moves all subscriptions and queued events from the copy's dispatcher to
+        the game one, points all components that refer to the copy or its
+        dispatcher to this factory and the game dispatcher, and adds entities
+        like `bulk_creation()` does. Should be called from the main thread,
+        after the copy is no longer used.
+        :param detached: an EntityFactory returned by `self.detached_copy`
+        :return:
+        """
+        staging = detached.dispatcher
+        batch = detached._bulk
+        detached._bulk = None
+        queued = list(staging.deque)
+        staging.deque.clear()
+        entities = [x[0] for x in batch] + [x.event_value for x in queued
+                                             if x.event_type == 'ecs_create']
+        objects = [getattr(entity, x) for entity in entities
+                   for x in entity.components]
+        for listeners in staging.listeners.values():
+            objects.extend(listeners)
+        for obj in objects:
+            self._rebind(obj, detached)
+            if isinstance(obj, AIComponent):
+                for state in obj.states.values():
+                    self._rebind(state, detached)
+        for event_type, listeners in staging.listeners.items():
+            self.dispatcher.listeners[event_type].extend(listeners)
+            listeners.clear()
+        for event in queued:
+            self.dispatcher.add_event(event)
+        self._add_entities(batch)
+
+    def _rebind(self, obj, detached):
+        """
+        Replace references to the detached factory or its dispatcher in the
+        object's attributes
+        """
+        names = list(getattr(obj, '__dict__', ()))
+        for cls in type(obj).__mro__:
+            names.extend(cls.__dict__.get('__slots__', ()))
+        for name in names:
+            value = getattr(obj, name, None)
+            if value is detached:
+                setattr(obj, name, self)
+            elif value is detached.dispatcher:
+                setattr(obj, name, self.dispatcher)
+
+    def _acquire_entity(self, entity_type, entity_id, **kwargs):
+        """
+        Get an entity of a pooled type.
+
+        If there is a recycled entity with the same structure-defining kwargs,
+        it is reset, resubscribed to its events and returned. Otherwise, a new
+        one is created.
+        :param entity_type: str. Entity type code
+        :param entity_id: str. Entity ID
+        :return: Entity
+        """
+        key = (entity_type, *(kwargs.get(x)
+                              for x in self.pooled_types[entity_type]))
+        pool = self.pools.get(key)
+        if pool:
+            self.pool_hits[entity_type] = self.pool_hits.get(entity_type, 0) + 1
+            entity = pool.pop()
+            entity.id = entity_id
+            getattr(self, f'_reset_{entity_type}')(entity, **kwargs)
+            entity.destructor.resubscribe()
+        else:
+            self.pool_misses[entity_type] = \
+                self.pool_misses.get(entity_type, 0) + 1
+            entity = getattr(self, f'_create_{entity_type}')(
+                                                entity_id=entity_id, **kwargs)
+            entity.destructor.factory = self
+            entity.destructor.pool_key = key
+        return entity
+
+    def release_entity(self, entity):
+        """
+        Return a destroyed entity to the pool.
+
+        Called by PooledDestructorComponent at the end of the tick when its
+        owner was destroyed.
+        :param entity: Entity
+        :return:
+        """
+        if entity.destructor.pool_key in self.pools:
+            self.pools[entity.destructor.pool_key].append(entity)
+        else:
+            self.pools[entity.destructor.pool_key] = [entity]
+
+    def pool_statistics(self):
+        """
+        Return entity pool statistics.
+
+        :return: a dict of {entity_type: {'hits': int, 'misses': int,
+        'free': int}} for every pooled type that was ever requested.
+        """
+        r = {}
+        for entity_type in self.pooled_types:
+            if entity_type not in self.pool_hits and \
+                    entity_type not in self.pool_misses:
+                continue
+            r[entity_type] = {'hits': self.pool_hits.get(entity_type, 0),
+                              'misses': self.pool_misses.get(entity_type, 0),
+                              'free': sum(len(self.pools[x])
+                                          for x in self.pools
+                                          if x[0] == entity_type)}
+        return r
+
     def generate_inactive_decoration(self, entity_id, entity_type, **kwargs):
         """
         Generate a simple Entity with Widget and Position, but nothing else.
 
         This method is meant for decorative elements (ie some garbage on the
-        floor). All _create_{garbage_type_item} methods will redirect here to
-        avoid writing tons of boilerplate methods.
+        floor). All decorations from the blueprints table are created here to
+        avoid writing tons of boilerplate methods. Their widgets share the
+        cached image for their type and are saved as an image ID (see
+        DecorationWidgetComponent).
         :param entity_id: Entity ID
         :param type: a type of object.
         :return:
         """
         e = Entity(id=entity_id)
-        widget = Widget(*self.atlas.get_element(entity_type))
-        e.add_component(WidgetComponent(self.dispatcher, widget))
+        widget = Widget(*self._get_image(entity_type))
+        e.add_component(DecorationWidgetComponent(self.dispatcher, entity_type,
+                                                  widget=widget))
         e.add_component(PositionComponent(self.dispatcher))
         e.add_component(DestructorComponent(self.dispatcher))
         return e
 
-    def generate_barrier(self, entity_id, entity_type, **kwargs):
+    def generate_barrier(self, entity_id, entity_type, face_position=(0, 0),
+                         face_size=(0, 0), depth=0, **kwargs):
         """
         Generate a simple Entity with Widget, Position, and CollisionComponent.
 
         This method is used for various un-passable entities without complex
         logic or animations, like walls, fences, barriers, trees and whatnot.
-        It relies on the factory class having self.face_positions,
-        self.face_sizes and self.depths dictionaries for CollisionComponents.
+        Collision data for each barrier type comes from the blueprints table.
         :param entity_id:
         :param type:
+        :param face_position: CollisionComponent face position
+        :param face_size: CollisionComponent face size
+        :param depth: CollisionComponent depth
         :return:
         """
         e = Entity(id=entity_id)
-        widget = Widget(*self.atlas.get_element(entity_type))
+        widget = Widget(*self._get_image(entity_type))
         e.add_component(WidgetComponent(self.dispatcher, widget))
         e.add_component(PositionComponent(self.dispatcher))
         e.add_component(CollisionComponent(self.dispatcher,
-                                           face_position=self.face_positions[entity_type],
-                                           face_size=self.face_sizes[entity_type],
+                                           face_position=face_position,
+                                           face_size=face_size,
                                            z_shift=(1, -1),
-                                           depth=self.depths[entity_type]))
+                                           depth=depth))
         e.add_component(DestructorComponent(self.dispatcher))
         return e
 
@@ -234,7 +692,7 @@ class EntityFactory:
         message.add_component(WidgetComponent(self.dispatcher, widget))
         message.add_component(PositionComponent(self.dispatcher, vx=vx, vy=vy,
                                                 affect_z=False))
-        message.add_component(DestructorComponent(self.dispatcher))
+        message.add_component(PooledDestructorComponent(self.dispatcher))
         message.add_component(DecayComponent(self.dispatcher,
                                              destroy_condition=destroy_condition,
                                              lifetime=lifetime))
@@ -242,7 +700,8 @@ class EntityFactory:
 
     def _create_ghetto_bg(self, entity_id, size=(50, 20), **kwargs):
         wall = Entity(id=entity_id)
-        w = generate_bg(self.atlas, ghetto_transition, size[0])
+        w = generate_bg(self.atlas, ghetto_transition, size[0],
+                        rng=self.bg_random)
         widget = Widget(*w)
         wall.add_component(WidgetComponent(self.dispatcher, widget))
         wall.add_component(PositionComponent(self.dispatcher, affect_z=True))
@@ -252,7 +711,8 @@ class EntityFactory:
 
     def _create_dept_bg(self, entity_id, size=(50, 20), **kwargs):
         wall = Entity(id=entity_id)
-        w = generate_bg(self.atlas, dept_transition, size[0])
+        w = generate_bg(self.atlas, dept_transition, size[0],
+                        rng=self.bg_random)
         widget = Widget(*w)
         wall.add_component(WidgetComponent(self.dispatcher, widget))
         wall.add_component(PositionComponent(self.dispatcher, affect_z=True))
@@ -262,7 +722,8 @@ class EntityFactory:
 
     def _create_lab_bg(self, entity_id, size=(50, 20), **kwargs):
         wall = Entity(id=entity_id)
-        w = generate_bg(self.atlas, lab_transition, size[0])
+        w = generate_bg(self.atlas, lab_transition, size[0],
+                        rng=self.bg_random)
         wall.add_component(WidgetComponent(self.dispatcher, Widget(*w)))
         wall.add_component(PositionComponent(self.dispatcher, affect_z=True))
         wall.add_component(DestructorComponent(self.dispatcher))
@@ -274,7 +735,8 @@ class EntityFactory:
         widget = Widget(*tile_randomly(self.atlas, 'floor_tile_1',
                                                   'floor_tile_2',
                                                   'floor_tile_3',
-                                                  size=size),
+                                                  size=size,
+                                                  rng=self.bg_random),
                         z_level=-1)
         # Disable affect_z so that floor won't overlap everything
         floor.add_component(PositionComponent(self.dispatcher, affect_z=False))
@@ -287,7 +749,7 @@ class EntityFactory:
         # TODO: animate title cards
         e = Entity(entity_id)
         e.add_component(WidgetComponent(self.dispatcher,
-                                        Widget(*self.atlas.get_element(image_id),
+                                        Widget(*self._get_image(image_id),
                                                z_level=100)))
         e.add_component(PositionComponent(self.dispatcher, affect_z=False))
         e.add_component(SoundDestructorComponent(self.dispatcher,
@@ -308,7 +770,7 @@ class EntityFactory:
                            z_level=50)
         e.add_component(WidgetComponent(self.dispatcher, w))
         e.add_component(PositionComponent(self.dispatcher, affect_z=False))
-        e.add_component(DestructorComponent(self.dispatcher))
+        e.add_component(PooledDestructorComponent(self.dispatcher))
         e.add_component(DecayComponent(self.dispatcher,
                                        destroy_condition='timeout',
                                        lifetime=lifetime))
@@ -323,7 +785,7 @@ class EntityFactory:
         A low table that can be shot over.
         """
         e = Entity(id=entity_id)
-        widget = Widget(*self.atlas.get_element('dept_range_table'))
+        widget = Widget(*self._get_image('dept_range_table'))
         e.add_component(WidgetComponent(self.dispatcher, widget))
         e.add_component(PositionComponent(self.dispatcher))
         e.add_component(DestructorComponent(self.dispatcher))
@@ -336,9 +798,9 @@ class EntityFactory:
 
     def _create_barrel(self, entity_id, **kwargs):
         barrel_entity = Entity(id=entity_id)
-        widget = SimpleAnimationWidget(Animation((self.atlas.get_element(
+        widget = SimpleAnimationWidget(Animation((self._get_image(
                                                       'barrel_1'),
-                                                  self.atlas.get_element(
+                                                  self._get_image(
                                                       'barrel_2')),
                                                   3),
                                        emit_ecs=True)
@@ -376,8 +838,8 @@ class EntityFactory:
         :return:
         """
         entity = Entity(id=entity_id)
-        widget = SimpleAnimationWidget(Animation((self.atlas.get_element('flame_1'),
-                                                  self.atlas.get_element('flame_2')),
+        widget = SimpleAnimationWidget(Animation((self._get_image('flame_1'),
+                                                  self._get_image('flame_2')),
                                                  3),
                                        emit_ecs=True)
         entity.add_component(WidgetComponent(self.dispatcher, widget))
@@ -398,10 +860,10 @@ class EntityFactory:
         """
         target_entity = Entity(id=entity_id)
         widget = SwitchingWidget(images_dict={
-                        'intact': self.atlas.get_element('target_intact'),
-                        'slight': self.atlas.get_element('target_1'),
-                        'severe': self.atlas.get_element('target_2'),
-                        'destroyed': self.atlas.get_element('target_destroyed')},
+                        'intact': self._get_image('target_intact'),
+                        'slight': self._get_image('target_1'),
+                        'severe': self._get_image('target_2'),
+                        'destroyed': self._get_image('target_destroyed')},
                                 initial_image='intact')
         target_entity.add_component(SwitchWidgetComponent(self.dispatcher,
                                                           widget))
@@ -425,7 +887,7 @@ class EntityFactory:
     def _create_signpost(self, entity_id, text='TEST TEST\nTEST TEST',
                          text_color='blue'):
         post = Entity(entity_id)
-        widget = SignpostWidget(*self.atlas.get_element('signpost'),
+        widget = SignpostWidget(*self._get_image('signpost'),
                                 text=text, text_color=text_color)
         post.add_component(WidgetComponent(self.dispatcher, widget))
         post.add_component(PositionComponent(self.dispatcher))
@@ -466,11 +928,11 @@ class EntityFactory:
         """
         muzzle = Entity(id=entity_id)
         if direction == 'r':
-            widget = Widget(*self.atlas.get_element('shot_r'))
+            widget = Widget(*self._get_image('shot_r'))
         else:
-            widget = Widget(*self.atlas.get_element('shot_l'))
+            widget = Widget(*self._get_image('shot_l'))
         muzzle.add_component(WidgetComponent(self.dispatcher, widget))
-        muzzle.add_component(DestructorComponent(self.dispatcher))
+        muzzle.add_component(PooledDestructorComponent(self.dispatcher))
         muzzle.add_component(PositionComponent(self.dispatcher))
         muzzle.add_component(DecayComponent(self.dispatcher,
                                             destroy_condition='timeout',
@@ -479,8 +941,8 @@ class EntityFactory:
 
     def _create_spike(self, entity_id, powered=False, **kwargs):
         spike = Entity(id=entity_id)
-        widget = SwitchingWidget(images_dict={'unpowered': self.atlas.get_element('science_spike_unpowered'),
-                                              'powered': self.atlas.get_element('science_spike_powered')},
+        widget = SwitchingWidget(images_dict={'unpowered': self._get_image('science_spike_unpowered'),
+                                              'powered': self._get_image('science_spike_powered')},
                                  initial_image='unpowered')
         spike.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         spike.add_component(PositionComponent(self.dispatcher))
@@ -501,8 +963,8 @@ class EntityFactory:
 
     def _create_science_prop(self, entity_id, **kwargs):
         prop = Entity(entity_id)
-        widget = SwitchingWidget(images_dict={'powered': self.atlas.get_element('science_prop_powered'),
-                                              'unpowered': self.atlas.get_element('science_prop_unpowered')},
+        widget = SwitchingWidget(images_dict={'powered': self._get_image('science_prop_powered'),
+                                              'unpowered': self._get_image('science_prop_unpowered')},
                                  initial_image='unpowered')
         prop.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         prop.add_component(PositionComponent(self.dispatcher))
@@ -519,8 +981,8 @@ class EntityFactory:
 
     def _create_science_healer(self, entity_id, **kwargs):
         healer = Entity(entity_id)
-        widget = SwitchingWidget(images_dict={'powered': self.atlas.get_element('science_healer_powered'),
-                                              'unpowered': self.atlas.get_element('science_healer_unpowered')},
+        widget = SwitchingWidget(images_dict={'powered': self._get_image('science_healer_powered'),
+                                              'unpowered': self._get_image('science_healer_unpowered')},
                                  initial_image='unpowered')
         healer.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         healer.add_component(PositionComponent(self.dispatcher))
@@ -540,8 +1002,8 @@ class EntityFactory:
             initial_image = 'wall_on'
         else:
             initial_image = 'wall_off'
-        widget = SwitchingWidget(images_dict={'wall_on': self.atlas.get_element('wall_switch_on'),
-                                              'wall_off': self.atlas.get_element('wall_switch_off')},
+        widget = SwitchingWidget(images_dict={'wall_on': self._get_image('wall_switch_on'),
+                                              'wall_off': self._get_image('wall_switch_off')},
                                  initial_image=initial_image)
         switch.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         switch.add_component(PositionComponent(self.dispatcher))
@@ -567,8 +1029,8 @@ class EntityFactory:
             initial_image = 'terminal_on'
         else:
             initial_image = 'terminal_off'
-        widget = SwitchingWidget(images_dict={'terminal_on': self.atlas.get_element('terminal_switch_on'),
-                                              'terminal_off': self.atlas.get_element('terminal_switch_off')},
+        widget = SwitchingWidget(images_dict={'terminal_on': self._get_image('terminal_switch_on'),
+                                              'terminal_off': self._get_image('terminal_switch_off')},
                                  initial_image=initial_image)
         switch.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         switch.add_component(PositionComponent(self.dispatcher))
@@ -591,8 +1053,8 @@ class EntityFactory:
     def _create_settings_speaker(self, entity_id, **kwargs):
         speaker = Entity(entity_id)
         widget = SimpleAnimationWidget(
-            Animation((self.atlas.get_element('speaker_1'),
-                       self.atlas.get_element('speaker_2')),
+            Animation((self._get_image('speaker_1'),
+                       self._get_image('speaker_2')),
                       4),
             emit_ecs=True)
         speaker.add_component(SpeakerWidgetComponent(self.dispatcher, widget))
@@ -605,7 +1067,7 @@ class EntityFactory:
     def _create_ammo_pickup(self, entity_id, **kwargs):
         e = Entity(entity_id)
         e.add_component(WidgetComponent(self.dispatcher,
-                                        Widget(*self.atlas.get_element('ammo_pickup'))))
+                                        Widget(*self._get_image('ammo_pickup'))))
         e.add_component(PositionComponent(self.dispatcher))
         e.add_component(DestructorComponent(self.dispatcher))
         e.add_component(AmmoPickupCollisionComponent(self.dispatcher,
@@ -615,9 +1077,9 @@ class EntityFactory:
 
     def _create_score_pickup(self, entity_id, score=5, **kwargs):
         e = Entity(entity_id)
-        widget = SimpleAnimationWidget(Animation((self.atlas.get_element('coin_1'),
-                                                  self.atlas.get_element('coin_3'),
-                                                  self.atlas.get_element('coin_2')),
+        widget = SimpleAnimationWidget(Animation((self._get_image('coin_1'),
+                                                  self._get_image('coin_3'),
+                                                  self._get_image('coin_2')),
                                                  4),
                                        emit_ecs=True)
         e.add_component(WidgetComponent(self.dispatcher, widget))
@@ -635,17 +1097,17 @@ class EntityFactory:
     
     def _create_cop(self, entity_id, **kwargs):
         cop_entity = Entity(id=entity_id)
-        widget = SwitchingWidget(images_dict={'r_1': self.atlas.get_element('cop_r_1'),
-                                              'r_2': self.atlas.get_element('cop_r_2'),
-                                              'l_1': self.atlas.get_element('cop_l_1'),
-                                              'l_2': self.atlas.get_element('cop_l_2')},
+        widget = SwitchingWidget(images_dict={'r_1': self._get_image('cop_r_1'),
+                                              'r_2': self._get_image('cop_r_2'),
+                                              'l_1': self._get_image('cop_l_1'),
+                                              'l_2': self._get_image('cop_l_2')},
                                  initial_image='r_1')
         # Useful for quickly testing assets
         # widget = SwitchingWidget(
-        #     images_dict={'r_1': self.atlas.get_element('scientist_f_r_1'),
-        #                  'r_2': self.atlas.get_element('scientist_f_r_2'),
-        #                  'l_1': self.atlas.get_element('scientist_f_l_1'),
-        #                  'l_2': self.atlas.get_element('scientist_f_l_2')},
+        #     images_dict={'r_1': self._get_image('scientist_f_r_1'),
+        #                  'r_2': self._get_image('scientist_f_r_2'),
+        #                  'l_1': self._get_image('scientist_f_l_1'),
+        #                  'l_2': self._get_image('scientist_f_l_2')},
         #     initial_image='r_1')
         # f_l = self._create_hand(f'{entity_id}_hand_fl',
         #                         'scientist_hand_forward', direction='l')
@@ -712,10 +1174,10 @@ class EntityFactory:
     def _create_cop_npc(self, entity_id, monologue=('Phrase 1', 'Phrase 2'),
                         **kwargs):
         cop_entity = Entity(id=entity_id)
-        widget = SwitchingWidget(images_dict={'r_1': self.atlas.get_element('cop_r_1'),
-                                              'r_2': self.atlas.get_element('cop_r_2'),
-                                              'l_1': self.atlas.get_element('cop_l_1'),
-                                              'l_2': self.atlas.get_element('cop_l_2')},
+        widget = SwitchingWidget(images_dict={'r_1': self._get_image('cop_r_1'),
+                                              'r_2': self._get_image('cop_r_2'),
+                                              'l_1': self._get_image('cop_l_1'),
+                                              'l_2': self._get_image('cop_l_2')},
                                  initial_image='r_1')
         cop_entity.add_component(WalkerComponent(self.dispatcher))
         cop_entity.add_component(SwitchWidgetComponent(self.dispatcher, widget))
@@ -801,10 +1263,10 @@ class EntityFactory:
         # have two right images and two left images for walking. Although the
         # boss cannot walk, he doesn't merit a separate subclass of
         # PositionComponent
-        widget = SwitchingWidget(images_dict={'r_1': self.atlas.get_element('dept_boss_r'),
-                                              'r_2': self.atlas.get_element('dept_boss_r'),
-                                              'l_1': self.atlas.get_element('dept_boss_l'),
-                                              'l_2': self.atlas.get_element('dept_boss_l')},
+        widget = SwitchingWidget(images_dict={'r_1': self._get_image('dept_boss_r'),
+                                              'r_2': self._get_image('dept_boss_r'),
+                                              'l_1': self._get_image('dept_boss_l'),
+                                              'l_2': self._get_image('dept_boss_l')},
                                  initial_image='r_1')
         boss.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         boss.add_component(WalkerComponent(self.dispatcher))
@@ -839,10 +1301,10 @@ class EntityFactory:
 
     def _create_nunchaku_punk(self, entity_id, **kwargs):
         nunchaku = Entity(id=entity_id)
-        widget = SwitchingWidget(images_dict={'r_1': self.atlas.get_element('nunchaku_punk_r_1'),
-                                              'r_2': self.atlas.get_element('nunchaku_punk_r_2'),
-                                              'l_1': self.atlas.get_element('nunchaku_punk_l_1'),
-                                              'l_2': self.atlas.get_element('nunchaku_punk_l_2'),
+        widget = SwitchingWidget(images_dict={'r_1': self._get_image('nunchaku_punk_r_1'),
+                                              'r_2': self._get_image('nunchaku_punk_r_2'),
+                                              'l_1': self._get_image('nunchaku_punk_l_1'),
+                                              'l_2': self._get_image('nunchaku_punk_l_2'),
                                   },
                                  initial_image='l_1')
         nunchaku.add_component(SwitchWidgetComponent(self.dispatcher, widget))
@@ -922,10 +1384,10 @@ class EntityFactory:
     def _create_bottle_punk(self, entity_id, **kwargs):
         punk = Entity(id=entity_id)
         widget = SwitchingWidget(
-            images_dict={'r_1': self.atlas.get_element('bottle_punk_r_1'),
-                         'r_2': self.atlas.get_element('bottle_punk_r_2'),
-                         'l_1': self.atlas.get_element('bottle_punk_l_1'),
-                         'l_2': self.atlas.get_element('bottle_punk_l_2'),
+            images_dict={'r_1': self._get_image('bottle_punk_r_1'),
+                         'r_2': self._get_image('bottle_punk_r_2'),
+                         'l_1': self._get_image('bottle_punk_l_1'),
+                         'l_2': self._get_image('bottle_punk_l_2'),
                          },
             initial_image='l_1')
         punk.add_component(SwitchWidgetComponent(self.dispatcher, widget))
@@ -1009,10 +1471,10 @@ class EntityFactory:
                                  **kwargs):
         scientist = Entity(id=entity_id)
         widget = SwitchingWidget(
-            images_dict={'r_1': self.atlas.get_element('scientist_f2_r_1'),
-                         'r_2': self.atlas.get_element('scientist_f2_r_2'),
-                         'l_1': self.atlas.get_element('scientist_f2_l_1'),
-                         'l_2': self.atlas.get_element('scientist_f2_l_2'),
+            images_dict={'r_1': self._get_image('scientist_f2_r_1'),
+                         'r_2': self._get_image('scientist_f2_r_2'),
+                         'l_1': self._get_image('scientist_f2_l_1'),
+                         'l_2': self._get_image('scientist_f2_l_2'),
                          },
             initial_image='r_1')
         scientist.add_component(SwitchWidgetComponent(self.dispatcher, widget))
@@ -1104,16 +1566,16 @@ class EntityFactory:
     def _create_scientist_enemy(self, entity_id):
         scientist = Entity(id=entity_id)
         # Choosing between two male scientist models
-        prefix = choice(('scientist_m', 'scientist_m2'))
+        prefix = self.random.choice(('scientist_m', 'scientist_m2'))
         if prefix == 'scientist_m':
             hand_prefix = 'scientist_skinny_hand'
         else:
             hand_prefix = 'scientist_hand'
         widget = SwitchingWidget(
-            images_dict={'r_1': self.atlas.get_element(f'{prefix}_r_1'),
-                         'r_2': self.atlas.get_element(f'{prefix}_r_2'),
-                         'l_1': self.atlas.get_element(f'{prefix}_l_1'),
-                         'l_2': self.atlas.get_element(f'{prefix}_l_2'),
+            images_dict={'r_1': self._get_image(f'{prefix}_r_1'),
+                         'r_2': self._get_image(f'{prefix}_r_2'),
+                         'l_1': self._get_image(f'{prefix}_l_1'),
+                         'l_2': self._get_image(f'{prefix}_l_2'),
                          },
             initial_image='r_1')
         scientist.add_component(SwitchWidgetComponent(self.dispatcher, widget))
@@ -1158,8 +1620,7 @@ class EntityFactory:
                                        owning_entity=scientist)
         self.dispatcher.add_event(BearEvent('ecs_create', right_fist))
         if prefix == 'scientist_m2':
-            right_item = self._create_fist(f'fist_{entity_id}_right',
-                                           owning_entity=scientist)
+            right_item = right_fist
             fight_state = CombatAIState(self.dispatcher,
                                         enemy_perception_distance=65,
                                         left_range=(0, 7),
@@ -1173,7 +1634,7 @@ class EntityFactory:
                                           left_range=(0, 7),
                                           right_range=(8, 50),
                                           wait_state='wait')
-        self.dispatcher.add_event(BearEvent('ecs_create', right_item))
+            self.dispatcher.add_event(BearEvent('ecs_create', right_item))
         scientist.add_component(HandInterfaceComponent(self.dispatcher,
                                                        hand_entities={
                                                            'forward_l': f_l.id,
@@ -1207,7 +1668,7 @@ class EntityFactory:
 
     def _create_hand(self, entity_id, hand_type=None, direction='r', **kwargs):
         entity = Entity(entity_id)
-        chars, colors = self.atlas.get_element(f'{hand_type}_{direction}')
+        chars, colors = self._get_image(f'{hand_type}_{direction}')
         entity.add_component(WidgetComponent(self.dispatcher,
                                              Widget(chars, colors)))
         entity.add_component(AttachedPositionComponent(self.dispatcher,
@@ -1221,7 +1682,7 @@ class EntityFactory:
 
     def _create_cop_jump(self, entity_id, direction='r', **kwargs):
         e = Entity(id=entity_id)
-        widget = Widget(*self.atlas.get_element(f'cop_jump_{direction}'))
+        widget = Widget(*self._get_image(f'cop_jump_{direction}'))
         e.add_component(WidgetComponent(self.dispatcher, widget))
         vx = 60 if direction == 'r' else -60
         e.add_component(PositionComponent(self.dispatcher,
@@ -1248,9 +1709,9 @@ class EntityFactory:
             vx = -50
         bullet_entity = Entity(id=entity_id)
         bullet_entity.add_component(WidgetComponent(self.dispatcher,
-            SimpleAnimationWidget(Animation((self.atlas.get_element(f'bullet_{direction}_1'),
-                                             self.atlas.get_element(f'bullet_{direction}_2'),
-                                             self.atlas.get_element(f'bullet_{direction}_3'),
+            SimpleAnimationWidget(Animation((self._get_image(f'bullet_{direction}_1'),
+                                             self._get_image(f'bullet_{direction}_2'),
+                                             self._get_image(f'bullet_{direction}_3'),
                                              ), 10),
                                   z_level=z_level)))
         bullet_entity.add_component(PositionComponent(self.dispatcher, vx=vx,
@@ -1258,7 +1719,7 @@ class EntityFactory:
         bullet_entity.add_component(ProjectileCollisionComponent(self.dispatcher,
                                                                  damage=5,
                                                                  depth=2))
-        bullet_entity.add_component(DestructorComponent(self.dispatcher))
+        bullet_entity.add_component(PooledDestructorComponent(self.dispatcher))
         return bullet_entity
 
     def _create_punch(self, entity_id, direction='r', z_level=10, damage=3,
@@ -1272,7 +1733,7 @@ class EntityFactory:
         """
         punch = Entity(id=entity_id)
         punch.add_component(WidgetComponent(self.dispatcher,
-                                Widget(*self.atlas.get_element(
+                                Widget(*self._get_image(
                                     f'punch_{direction}'),
                                        z_level=z_level)))
         if direction == 'r':
@@ -1284,7 +1745,7 @@ class EntityFactory:
         punch.add_component(ProjectileCollisionComponent(self.dispatcher,
                                                          damage=damage,
                                                          depth=3))
-        punch.add_component(DestructorComponent(self.dispatcher))
+        punch.add_component(PooledDestructorComponent(self.dispatcher))
         punch.add_component(DecayComponent(self.dispatcher,
                                            destroy_condition='timeout',
                                            lifetime=0.1))
@@ -1307,8 +1768,8 @@ class EntityFactory:
         # kind of spark because otherwise pistol sparks would establish
         # permanent lines from shooter to target.
         spark = Entity(id=entity_id)
-        widget = SimpleAnimationWidget(Animation((self.atlas.get_element('spark_1'),
-                                                  self.atlas.get_element('spark_2')),
+        widget = SimpleAnimationWidget(Animation((self._get_image('spark_1'),
+                                                  self._get_image('spark_2')),
                                                  6),
                                        z_level=z_level)
         spark.add_component(WidgetComponent(self.dispatcher, widget))
@@ -1325,7 +1786,7 @@ class EntityFactory:
         spark.add_component(PowerProjectileCollisionComponent(self.dispatcher,
                                                               damage=1,
                                                               depth=3))
-        spark.add_component(DestructorComponent(self.dispatcher))
+        spark.add_component(PooledDestructorComponent(self.dispatcher))
         return spark
 
     def _create_tall_spark(self, entity_id, direction=None,
@@ -1357,18 +1818,18 @@ class EntityFactory:
         spark.add_component(PowerProjectileCollisionComponent(self.dispatcher,
                                                               damage=3,
                                                               depth=1))
-        spark.add_component(DestructorComponent(self.dispatcher))
+        spark.add_component(PooledDestructorComponent(self.dispatcher))
         return spark
 
     def _create_healing_projectile(self, entity_id, vx=0, vy=0, **kwargs):
         cross = Entity(entity_id)
         cross.add_component(WidgetComponent(self.dispatcher,
-                                            Widget(*self.atlas.get_element('science_healing_projectile'))))
+                                            Widget(*self._get_image('science_healing_projectile'))))
         cross.add_component(PositionComponent(self.dispatcher, vx=vx, vy=vy))
         cross.add_component(HealingProjectileCollisionComponent(self.dispatcher,
                                                                 healing=2,
                                                                 depth=2))
-        cross.add_component((DestructorComponent(self.dispatcher)))
+        cross.add_component((PooledDestructorComponent(self.dispatcher)))
         cross.add_component(DecayComponent(self.dispatcher,
                                            destroy_condition='timeout',
                                            lifetime=2.0))
@@ -1382,19 +1843,19 @@ class EntityFactory:
         """
         entity = Entity(id=entity_id)
         if direction == 'r':
-            widget = SimpleAnimationWidget(Animation((self.atlas.get_element('bottle_ne'),
-                                                      self.atlas.get_element('bottle_se'),
-                                                      self.atlas.get_element('bottle_sw'),
-                                                      self.atlas.get_element('bottle_nw')),
+            widget = SimpleAnimationWidget(Animation((self._get_image('bottle_ne'),
+                                                      self._get_image('bottle_se'),
+                                                      self._get_image('bottle_sw'),
+                                                      self._get_image('bottle_nw')),
                                                       8),
                                            z_level=z_level,
                                            emit_ecs=True)
             vx = 17
         else:
-            widget = SimpleAnimationWidget(Animation((self.atlas.get_element('bottle_nw'),
-                                                      self.atlas.get_element('bottle_sw'),
-                                                      self.atlas.get_element('bottle_se'),
-                                                      self.atlas.get_element('bottle_ne')),
+            widget = SimpleAnimationWidget(Animation((self._get_image('bottle_nw'),
+                                                      self._get_image('bottle_sw'),
+                                                      self._get_image('bottle_se'),
+                                                      self._get_image('bottle_ne')),
                                                       8),
                                            z_level=z_level,
                                            emit_ecs=True)
@@ -1403,7 +1864,7 @@ class EntityFactory:
         entity.add_component(GravityPositionComponent(self.dispatcher,
                                                acceleration=40, vx=vx, vy=-35,
                                                affect_z=False))
-        entity.add_component(DestructorComponent(self.dispatcher))
+        entity.add_component(PooledDestructorComponent(self.dispatcher))
         entity.add_component(GrenadeComponent(self.dispatcher,
                                               explosion_sound='molotov_break',
                                               spawned_item='flame'))
@@ -1411,14 +1872,99 @@ class EntityFactory:
         entity.add_component(SpawnerComponent(self.dispatcher, factory=self))
         return entity
 
+################################################################################
+# RECYCLING POOLED ENTITIES
+# Each _reset_{item} accepts the same kwargs as _create_{item}, except for the
+# ones listed in self.pooled_types, which are the same for recycled entity.
+################################################################################
+
+    @staticmethod
+    def _reset_velocity(position, vx=0, vy=0):
+        position.vx = vx
+        position.vy = vy
+        position.x_waited = 0
+        position.y_waited = 0
+
+    @staticmethod
+    def _restart_animation(widget):
+        widget.running_index = 0
+        widget.have_waited = 0
+        widget.chars, widget.colors = widget.animation.frames[0]
+
+    def _reset_message(self, entity, text='Sample text\nsample text',
+                       vx=0, vy=0, lifetime=2.0, color='white', **kwargs):
+        entity.widget.widget = Label(text, z_level=200, color=color)
+        self._reset_velocity(entity.position, vx=vx, vy=vy)
+        if entity.decay.destroy_condition == 'timeout':
+            entity.decay.lifetime = lifetime
+            entity.decay.age = 0
+
+    def _reset_particle_explosion(self, entity, size=(10, 10), character='*',
+                                  char_count=10, char_speed=5, color='red',
+                                  lifetime=1, **kwargs):
+        entity.widget.widget = ParticleWidget(size=size, character=character,
+                                              color=color,
+                                              char_count=char_count,
+                                              char_speed=char_speed,
+                                              z_level=50)
+        entity.decay.lifetime = lifetime
+        entity.decay.age = 0
+
+    def _reset_muzzle_flash(self, entity, **kwargs):
+        entity.decay.age = 0
+
+    def _reset_bullet(self, entity, direction='r', z_level=10, **kwargs):
+        self._restart_animation(entity.widget.widget)
+        entity.widget.z_level = z_level
+        self._reset_velocity(entity.position,
+                             vx=50 if direction == 'r' else -50)
+
+    def _reset_punch(self, entity, direction='r', z_level=10, damage=3,
+                     **kwargs):
+        entity.widget.z_level = z_level
+        self._reset_velocity(entity.position,
+                             vx=50 if direction == 'r' else -50)
+        entity.collision.damage = damage
+        entity.decay.age = 0
+
+    def _reset_spark(self, entity, z_level=10, direction=None,
+                     vx=25, vy=25, **kwargs):
+        self._restart_animation(entity.widget.widget)
+        entity.widget.z_level = z_level
+        if direction:
+            vx = 80 if direction == 'r' else -80
+            vy = 0
+        self._reset_velocity(entity.position, vx=vx, vy=vy)
+
+    def _reset_tall_spark(self, entity, direction=None, vx=25, vy=25,
+                          **kwargs):
+        self._restart_animation(entity.widget.widget)
+        if direction:
+            vx = 80 if direction == 'r' else -80
+            vy = 0
+        self._reset_velocity(entity.position, vx=vx, vy=vy)
+
+    def _reset_healing_projectile(self, entity, vx=0, vy=0, **kwargs):
+        self._reset_velocity(entity.position, vx=vx, vy=vy)
+        entity.decay.age = 0
+
+    def _reset_bottle(self, entity, direction='r', z_level=10, **kwargs):
+        self._restart_animation(entity.widget.widget)
+        entity.widget.z_level = z_level
+        self._reset_velocity(entity.position,
+                             vx=17 if direction == 'r' else -17, vy=-35)
+        entity.position.have_waited = 0
+        # GrenadeComponent doesn't set its own name and is stored as 'Root'
+        entity.Root.target_y = None
+
 ################################################################################
 # ITEMS
 ################################################################################
 
     def _create_pistol(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
-        widget = SwitchingWidget(images_dict={'l': self.atlas.get_element('pistol_l'),
-                                              'r': self.atlas.get_element('pistol_r')},
+        widget = SwitchingWidget(images_dict={'l': self._get_image('pistol_l'),
+                                              'r': self._get_image('pistol_r')},
                                  initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher,
                                                    widget))
@@ -1447,8 +1993,8 @@ class EntityFactory:
     def _create_fist(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(
-            images_dict={'l': self.atlas.get_element('fist_l'),
-                         'r': self.atlas.get_element('fist_r')},
+            images_dict={'l': self._get_image('fist_l'),
+                         'r': self._get_image('fist_r')},
             initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher,
                                                    widget))
@@ -1474,8 +2020,8 @@ class EntityFactory:
     def _create_shiv(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(
-            images_dict={'r': self.atlas.get_element('shiv_r'),
-                         'l': self.atlas.get_element('shiv_l')},
+            images_dict={'r': self._get_image('shiv_r'),
+                         'l': self._get_image('shiv_l')},
             initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         entity.add_component(SpawningItemBehaviourComponent(self.dispatcher,
@@ -1501,8 +2047,8 @@ class EntityFactory:
     def _create_nunchaku(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(
-            images_dict={'l': self.atlas.get_element('nunchaku_l'),
-                         'r': self.atlas.get_element('nunchaku_r')},
+            images_dict={'l': self._get_image('nunchaku_l'),
+                         'r': self._get_image('nunchaku_r')},
             initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher,
                                                    widget))
@@ -1531,8 +2077,8 @@ class EntityFactory:
     def _create_bottle_launcher(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(
-            images_dict={'l': self.atlas.get_element('bottle_ne'),
-                         'r': self.atlas.get_element('bottle_nw')},
+            images_dict={'l': self._get_image('bottle_ne'),
+                         'r': self._get_image('bottle_nw')},
             initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher,
                                                    widget))
@@ -1558,8 +2104,8 @@ class EntityFactory:
     def _create_bandage(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(
-            images_dict={'r': self.atlas.get_element('bandage_r'),
-                         'l': self.atlas.get_element('bandage_l')},
+            images_dict={'r': self._get_image('bandage_r'),
+                         'l': self._get_image('bandage_l')},
             initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         entity.add_component(CollectableBehaviourComponent(self.dispatcher))
@@ -1591,8 +2137,8 @@ class EntityFactory:
     def _create_emitter(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(images_dict={
-                                    'r': self.atlas.get_element('emitter_r'),
-                                    'l': self.atlas.get_element('emitter_l')},
+                                    'r': self._get_image('emitter_r'),
+                                    'l': self._get_image('emitter_l')},
                                  initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         entity.add_component(CollectableBehaviourComponent(self.dispatcher))
@@ -1620,8 +2166,8 @@ class EntityFactory:
     def _create_spikebox(self, entity_id, owning_entity=None, **kwargs):
         entity = Entity(entity_id)
         widget = SwitchingWidget(images_dict={
-                    'r': self.atlas.get_element('spikebox_r'),
-                    'l': self.atlas.get_element('spikebox_l')},
+                    'r': self._get_image('spikebox_r'),
+                    'l': self._get_image('spikebox_l')},
                                  initial_image='r')
         entity.add_component(SwitchWidgetComponent(self.dispatcher, widget))
         entity.add_component(CollectableBehaviourComponent(self.dispatcher))
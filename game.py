@@ -7,26 +7,31 @@ from os import path
 
 from bear_hug.bear_hug import BearTerminal, BearLoop
 from bear_hug.bear_utilities import copy_shape
-from bear_hug.ecs import EntityTracker, CollisionListener
-from bear_hug.ecs_widgets import ScrollableECSLayout
+from bear_hug.ecs import EntityTracker
 from bear_hug.event import BearEventDispatcher, BearEvent
 from bear_hug.resources import Atlas, Multiatlas, XpLoader
 from bear_hug.widgets import Widget, ClosingListener, LoggingListener, \
     MenuWidget, MenuItem
 
+from components import PowerNetwork
 from entities import EntityFactory
 from listeners import ScrollListener, SavingListener, LoadingListener, \
     SpawningListener, LevelSwitchListener, MenuListener, \
     ItemDescriptionListener, ScoreListener, SplashListener, ConfigListener, \
-    ConfigStorage
+    ConfigStorage, StreamingListener, GridCollisionListener, \
+    AutosaveListener, PerfOverlayListener
 from mapgen import LevelManager, restart
+from mixer import MixerListener, NullBackend
 from plot import Goal
-from widgets import HitpointBar, ItemWindow, ScoreWidget
+from tables import event_types, sound_files
+from widgets import HitpointBar, ItemWindow, ScoreWidget, ChunkedECSLayout
 
 parser = ArgumentParser('A game about beating people')
 parser.add_argument('-s', type=str, help='Save file to load on startup')
 parser.add_argument('--disable_sound', action='store_true',
-                    help='Disable all sound. Prevents simpleaudio from importing')
+                    help='Disable all sound. Sounds are not loaded or played')
+parser.add_argument('--disable_autosave', action='store_true',
+                    help='Do not save the game every minute')
 args = parser.parse_args()
 
 ################################################################################
@@ -40,6 +45,9 @@ t = BearTerminal(font_path=path.join(path_base, 'cp437_12x12.png'),
 dispatcher = BearEventDispatcher()
 loop = BearLoop(t, dispatcher)
 dispatcher.register_listener(ClosingListener(), ['misc_input', 'tick'])
+# Toggled by F3. Subscribed before everything else to get the tick first
+perf_overlay = PerfOverlayListener(dispatcher, terminal=t)
+dispatcher.register_listener(perf_overlay, ['tick', 'key_down'])
 t.start()
 
 ################################################################################
@@ -83,37 +91,23 @@ atlas = Multiatlas((Atlas(XpLoader(path.join(path_base, 'test_atlas.xp')),
                     Atlas(XpLoader(path.join(path_base, 'level_headers.xp')),
                           path.join(path_base, 'level_headers.json'))))
 
-chars = [[' ' for _ in range(500)] for y in range(60)]
-colors = copy_shape(chars, 'gray')
-layout = ScrollableECSLayout(chars, colors, view_pos=(0, 0), view_size=(81, 50))
+# LevelManager sets the width for every level
+layout = ChunkedECSLayout(500, 60, view_pos=(0, 0), view_size=(81, 50))
 dispatcher.register_listener(layout, 'all')
+# The factory subscribes to it, so it's registered before the rest
+dispatcher.register_event_type('brut_remove_entities') # list of Entities
 factory = EntityFactory(atlas, dispatcher, layout)
 
 ################################################################################
 # Game-specific event types
-# Expected values for each type shown in comments
+# Expected values for each type are listed in tables.py
 ################################################################################
 
-# Combat system
-dispatcher.register_event_type('brut_damage') # EntityID, value (int)
-dispatcher.register_event_type('brut_heal') # EntityID, value (int)
-# Item manipulations
-dispatcher.register_event_type('brut_use_item') # Entity ID of used item
-dispatcher.register_event_type('brut_use_hand') #hand entity ID
-dispatcher.register_event_type('brut_pick_up') # owner entity ID, which hand (left or right), picked up entity ID
-dispatcher.register_event_type('brut_change_ammo') # Item entity ID, new ammo value
-dispatcher.register_event_type('brut_score') # Value (add to score)
-dispatcher.register_event_type('brut_reset_score') # Value (set score to)
-# View operations
-dispatcher.register_event_type('brut_focus')  # See listeners.ScrollListener
-dispatcher.register_event_type('brut_temporary_focus') # Entity ID
-# Service
-dispatcher.register_event_type('brut_open_menu') # Value ignored
-dispatcher.register_event_type('brut_close_menu') # Value ignored
-dispatcher.register_event_type('brut_show_items') # Value ignored
-dispatcher.register_event_type('brut_save_game') # Path to savefile
-dispatcher.register_event_type('brut_load_game') # Path to savefile
-dispatcher.register_event_type('brut_change_config') # Config key and new value
+for event_type in event_types:
+    # A couple of types were registered early, see above. Registering them
+    # again would unsubscribe their listeners
+    if event_type not in dispatcher.event_types:
+        dispatcher.register_event_type(event_type)
 
 
 ################################################################################
@@ -150,10 +144,11 @@ t.add_widget(hp_bar, (19, 54), layer=2)
 ################################################################################
 
 # Collision
-collision = CollisionListener()
+collision = GridCollisionListener()
 dispatcher.register_listener(collision, ['ecs_create', 'ecs_destroy',
                                          'ecs_remove', 'ecs_add',
                                          'ecs_move'])
+factory.collision_listener = collision
 # Screen scrolling
 dispatcher.register_listener(ScrollListener(layout=layout,
                                             distance=30),
@@ -162,6 +157,8 @@ dispatcher.register_listener(ScrollListener(layout=layout,
                              'tick', 'ecs_move',
                              'ecs_destroy'])
 dispatcher.register_listener(EntityTracker(), ['ecs_create', 'ecs_destroy'])
+# Spikes and the machines they power
+dispatcher.register_listener(PowerNetwork(), ['ecs_add', 'ecs_destroy'])
 # Debug event logger
 logger = LoggingListener(open(path.join(path_base, 'run.log'), mode='w'))
 dispatcher.register_listener(logger, ['ecs_add', 'ecs_remove', 'ecs_destroy',
@@ -172,67 +169,53 @@ config = ConfigListener(terminal=t)
 dispatcher.register_listener(config, 'brut_change_config')
 # Sound
 if not args.disable_sound:
-    sound_files = {'step': 'step.wav',
-                   'shot': 'shot.wav',
-                   'fist': 'fist.wav',
-                   'shiv': 'shiv.wav',
-                   'emitter': 'emitter.wav',
-                   'punch': 'punch.wav',
-                   'spark': 'spark.wav',
-                   'nunchaku': 'nunchaku_wave.wav',
-                   'reload': 'pistol_reload.wav',
-                   'pistol_empty': 'pistol_trigger.wav',
-                   'molotov_break': 'molotov_brake.wav',
-                   'molotov_fire': 'molotov_fire.wav',
-                   'molotov_throw': 'molotov_throw.wav',
-                   'balloon': 'balloon.wav',
-                   'blue_machine': 'blue_machine.wav',
-                   'coin': 'coin.wav',
-                   'coin_drop': 'coin_drop.wav',
-                   'drive': 'drive.wav',
-                   'supercop_bg': 'supercop.wav',
-                   'ghetto_walk_bg': 'ghetto_walk.wav',
-                   'punk_bg': 'punk_bg.wav',
-                   'lab_bg': 'laboratory.wav',
-                   'punk_hit': 'punk_hey.wav',
-                   'punk_death': 'punk_ho.wav',
-                   'cop_hit': 'cop_dmg.wav',
-                   'cop_death': 'cop_death.wav',
-                   'male_dmg': 'male_dmg.wav',
-                   'female_dmg': 'fem_dmg.wav',
-                   'male_death': 'male_death.wav',
-                   'female_death': 'fem_death.wav',
-                   'male_phrase_1': 'male_phrase_1.wav',
-                   'male_phrase_2': 'male_phrase_2.wav',
-                   'male_phrase_3': 'male_phrase_3.wav',
-                   'male_phrase_4': 'male_phrase_4.wav',
-                   'male_phrase_5': 'male_phrase_5.wav',
-                   'female_phrase_1': 'f_scientist_1.wav',
-                   'female_phrase_2': 'f_scientist_2.wav',
-                   'female_phrase_3': 'f_scientist_3.wav',
-                   'female_phrase_4': 'f_scientist_4.wav',
-                   'female_phrase_5': 'f_scientist_5.wav',
-                   'bandage': 'bandage.wav',
-                   'target_hit': 'target.wav',
-                   'item_drop': 'item_drop.wav',
-                   'item_grab': 'item_grab.wav',
-                   'menu': 'menu_switch.wav',
-                   'switch_on': 'switch_on.wav',
-                   'switch_off': 'switch_off.wav',
-                   'neon': 'neon.wav'}
-    from bear_hug.sound import SoundListener
+    # (priority, cooldown in seconds). Frequent sounds that nobody misses
+    # when they are cut short have low priority, unique voice lines and UI
+    # sounds have high. Cooldowns keep a crowd from playing the same sound a
+    # dozen times a frame
+    sound_settings = {'step': (0, 0.1),
+                      'spark': (0, 0.1),
+                      'emitter': (0, 0.2),
+                      'blue_machine': (0, 0.2),
+                      'drive': (0, 0.5),
+                      'balloon': (0, 0.2),
+                      'neon': (0, 0.5),
+                      'punch': (1, 0.05),
+                      'fist': (1, 0.05),
+                      'shiv': (1, 0.05),
+                      'nunchaku': (1, 0.05),
+                      'shot': (2, 0.03),
+                      'target_hit': (1, 0.05),
+                      'punk_hit': (2, 0.1),
+                      'male_dmg': (2, 0.1),
+                      'female_dmg': (2, 0.1),
+                      'punk_death': (3, 0),
+                      'male_death': (3, 0),
+                      'female_death': (3, 0),
+                      'cop_hit': (3, 0.1),
+                      'cop_death': (4, 0),
+                      'menu': (4, 0),
+                      'switch_on': (4, 0),
+                      'switch_off': (4, 0)}
+    for i in range(1, 6):
+        sound_settings[f'male_phrase_{i}'] = (3, 0)
+        sound_settings[f'female_phrase_{i}'] = (3, 0)
     sounds = {}
     for file in sound_files:
         sounds[file] = path.join(path_base, 'sounds', sound_files[file])
-    jukebox = SoundListener(sounds=sounds)
-    # SoundListener starts disabled because otherwise it may play a little chunk
+    jukebox = MixerListener(sounds=sounds, sound_settings=sound_settings,
+                            layout=layout, max_voices=16)
+    # MixerListener starts disabled because otherwise it may play a little chunk
     # of BG sound even with sound disabled through options. Basically, creation
-    # of SoundListener instance happens before reading in the options (which has
+    # of MixerListener instance happens before reading in the options (which has
     # to happen late to make sure every interested party already exists), so it
     # gets to play about 100 ms of music in this window
     jukebox.turn_off()
     dispatcher.register_listener(jukebox,
                                  ['play_sound', 'tick', 'set_bg_sound'])
+else:
+    # Saves still ask it for the current BG sound
+    MixerListener({}, backend=NullBackend())
 
 # Spawner for creating various stuff when player walks to a predetermined area
 # currently only used for tutorial messages, but can be employed by mapgen to eg
@@ -242,7 +225,8 @@ dispatcher.register_listener(spawner, 'ecs_move')
 
 # Level generator
 levelgen = LevelManager(dispatcher, factory,
-                        spawner=spawner, player_entity='cop_1')
+                        spawner=spawner, player_entity='cop_1',
+                        stream_distance=100)
 
 # Level switcher
 level_switch = LevelSwitchListener('cop_1', level_manager=levelgen,
@@ -250,10 +234,21 @@ level_switch = LevelSwitchListener('cop_1', level_manager=levelgen,
 dispatcher.register_listener(level_switch, ('ecs_move', 'ecs_collision',
                                             'tick', 'service'))
 levelgen.level_switch = level_switch
+# Creating rooms ahead of the player and retiring the ones far behind
+streaming = StreamingListener(layout=layout, level_manager=levelgen)
+dispatcher.register_listener(streaming, 'tick')
 
 # Saving and loading
 saving = SavingListener()
-dispatcher.register_listener(saving, 'brut_save_game')
+dispatcher.register_listener(saving, ('brut_save_game', 'tick', 'service'))
+autosave_file = path.join(path_base, 'autosave.sav')
+if not args.disable_autosave:
+    autosave = AutosaveListener(file_name=autosave_file, period=60)
+    dispatcher.register_listener(autosave, ('tick', 'ecs_add', 'ecs_move',
+                                            'ecs_remove', 'brut_damage',
+                                            'brut_heal', 'brut_pick_up',
+                                            'brut_use_item',
+                                            'brut_change_ammo'))
 loading = LoadingListener(dispatcher, factory, levelgen, loop)
 dispatcher.register_listener(loading, 'brut_load_game')\
 
@@ -300,6 +295,25 @@ sc_drugs = Goal(name='scientist_drugs',
 # Game menu
 ################################################################################
 
+def manual_save_file():
+    """
+    Return the file for the menu to load.
+
+    Until the game is saved in the binary format, the menu loads the JSON
+    save made by the older versions.
+    """
+    if not path.exists('save.sav') and path.exists('save.json'):
+        return 'save.json'
+    return 'save.sav'
+
+
+def load_autosave():
+    # Loading starts with destroying the current level, so a missing file
+    # should not get that far
+    if path.exists(autosave_file):
+        return BearEvent('brut_load_game', autosave_file)
+
+
 menu_items = [MenuItem('Continue', color='white', highlight_color='blue',
                        action=lambda: BearEvent('brut_close_menu', None)),
               MenuItem('Restart', color='white', highlight_color='blue',
@@ -308,10 +322,12 @@ menu_items = [MenuItem('Continue', color='white', highlight_color='blue',
                        action=lambda: BearEvent('brut_show_items', None)),
               MenuItem(f'Load (TBD)', color='white', highlight_color='blue',
                        action=lambda: BearEvent('brut_load_game',
-                                                'save.json')),
+                                                manual_save_file())),
               MenuItem(f'Save (TBD)', color='white', highlight_color='blue',
                        action=lambda: BearEvent('brut_save_game',
-                                                'save.json')),
+                                                'save.sav')),
+              MenuItem(f'Load autosave', color='white',
+                       highlight_color='blue', action=load_autosave),
               MenuItem(f'Quit', color='white', highlight_color='blue',
                        action=lambda: BearEvent('misc_input', 'TK_CLOSE'))
               ]
@@ -334,7 +350,7 @@ dispatcher.register_listener(item_descriptions, ['brut_show_items',
 ################################################################################
 
 if args.s:
-    dispatcher.add_event(BearEvent('brut_load_game', 'save.json'))
+    dispatcher.add_event(BearEvent('brut_load_game', args.s))
 
 else:
     factory.create_entity('cop', (5, 25))
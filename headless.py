@@ -0,0 +1,383 @@
+#! /usr/bin/env python3.6
+"""
+Headless game runner.
+
+Builds the game objects like game.py does, but with a NullTerminal instead of
+a window, and steps the loop with fixed tick durations, so a level can be
+simulated much faster than real time. Player input is scripted: events are
+fed to the terminal as if they were typed. Every tick is timed.
+
+Usage: `python3 headless.py [--level LEVEL] [--ticks N] [--fps FPS]
+[--seed SEED] [--walk | --fight] [--script FILE]`. The script is a JSON list of
+``[tick, event_type, event_value]`` entries. Timing stats are printed when the
+simulation is over.
+
+The helpers for creating the game objects are shared with benchmarks.py.
+"""
+
+import json
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import redirect_stdout
+from os import path, devnull
+from time import perf_counter
+
+from bear_hug.bear_hug import BearTerminal, BearLoop, WidgetLocation
+from bear_hug.bear_utilities import BearException
+from bear_hug.ecs import EntityTracker, Singleton
+from bear_hug.event import BearEventDispatcher, BearEvent
+from bear_hug.resources import Atlas, Multiatlas, XpLoader
+from bear_hug.widgets import Widget
+
+from components import PowerNetwork
+from entities import EntityFactory
+from listeners import ScrollListener, SavingListener, LoadingListener, \
+    SpawningListener, LevelSwitchListener, ScoreListener, \
+    StreamingListener, GridCollisionListener
+from mapgen import LevelManager
+from mixer import MixerListener, NullBackend
+from tables import event_types
+from widgets import HitpointBar, ItemWindow, ScoreWidget, ChunkedECSLayout
+
+
+path_base = path.split(path.abspath(__file__))[0]
+
+
+class NullTerminal(BearTerminal):
+    """
+    A BearTerminal that never opens a window and draws nothing.
+
+    Layouts call `terminal.update_widget()` after redrawing themselves; with
+    this class, the redraw itself is still performed and timed. Widgets can be
+    added and removed, but the terminal only remembers where they are.
+
+    Events passed to `add_input` are returned by the next `check_input` call,
+    so the loop dispatches them as if they were typed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_events = []
+
+    def start(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def close(self):
+        pass
+
+    def add_widget(self, widget, pos=(0, 0), layer=0, refresh=False):
+        if widget in self.widget_locations:
+            raise BearException('Cannot add the same widget twice')
+        widget.terminal = self
+        widget.parent = self
+        self.widget_locations[widget] = WidgetLocation(pos=pos, layer=layer)
+
+    def remove_widget(self, widget, refresh=False):
+        del self.widget_locations[widget]
+        widget.terminal = None
+        widget.parent = None
+
+    def update_widget(self, widget, refresh=False):
+        pass
+
+    def add_input(self, event):
+        """
+        Pass an event to the loop on the next tick.
+        :param event: BearEvent
+        """
+        self.input_events.append(event)
+
+    def check_input(self):
+        events = self.input_events
+        self.input_events = []
+        return iter(events)
+
+
+def load_atlas():
+    """
+    Load the game atlases
+    :return: Multiatlas instance
+    """
+    return Multiatlas((Atlas(XpLoader(path.join(path_base, 'test_atlas.xp')),
+                             path.join(path_base, 'test_atlas.json')),
+                       Atlas(XpLoader(path.join(path_base, 'ghetto_bg.xp')),
+                             path.join(path_base, 'ghetto_bg.json')),
+                       Atlas(XpLoader(path.join(path_base, 'department.xp')),
+                             path.join(path_base, 'department.json')),
+                       Atlas(XpLoader(path.join(path_base, 'scientists.xp')),
+                             path.join(path_base, 'scientists.json')),
+                       Atlas(XpLoader(path.join(path_base, 'level_headers.xp')),
+                             path.join(path_base, 'level_headers.json'))))
+
+
+def create_game(atlas, **factory_kwargs):
+    """
+    Create a dispatcher, a layout and an entity factory without a terminal.
+
+    Kwargs are passed to the EntityFactory.
+    :param atlas: Multiatlas instance
+    :return: dispatcher, layout, factory
+    """
+    # Most listeners are singletons; forget the ones made by previous
+    # benchmarks, or they would keep using an old dispatcher and factory
+    Singleton._instances.clear()
+    dispatcher = BearEventDispatcher()
+    layout = ChunkedECSLayout(500, 60, view_pos=(0, 0), view_size=(81, 50))
+    layout.terminal = NullTerminal()
+    dispatcher.register_listener(layout, 'all')
+    for event_type in event_types:
+        dispatcher.register_event_type(event_type)
+    dispatcher.register_listener(EntityTracker(), ['ecs_create', 'ecs_destroy'])
+    dispatcher.register_listener(PowerNetwork(), ['ecs_add', 'ecs_destroy'])
+    factory = EntityFactory(atlas, dispatcher, layout, **factory_kwargs)
+    collision = GridCollisionListener()
+    dispatcher.register_listener(collision, ['ecs_create', 'ecs_destroy',
+                                             'ecs_remove', 'ecs_add',
+                                             'ecs_move'])
+    factory.collision_listener = collision
+    return dispatcher, layout, factory
+
+
+def create_level_manager(dispatcher, factory, **kwargs):
+    """
+    Create a LevelManager with its spawner and level switch, as in game.py
+
+    Kwargs are passed to the LevelManager.
+    :return: LevelManager instance
+    """
+    spawner = SpawningListener('cop_1', factory=factory)
+    dispatcher.register_listener(spawner, 'ecs_move')
+    levelgen = LevelManager(dispatcher, factory,
+                            spawner=spawner, player_entity='cop_1', **kwargs)
+    level_switch = LevelSwitchListener('cop_1', level_manager=levelgen,
+                                       factory=factory)
+    dispatcher.register_listener(level_switch, ('ecs_move', 'ecs_collision',
+                                                'tick', 'service'))
+    levelgen.level_switch = level_switch
+    return levelgen
+
+
+def percentile(values, q):
+    """
+    Return the q-th percentile of values (nearest rank).
+    :param values: a non-empty iterable of numbers
+    :param q: number from 0 to 100
+    :return: a value from values
+    """
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+class Simulation:
+    """
+    The game without a window, stepped by hand.
+
+    Creates the same listeners and HUD widgets as game.py, except for the
+    splash screen, menus, config and autosaves. The player character is
+    created and, unless `level_id` is None, the level is set.
+
+    Scripted events are given as (tick number, BearEvent) pairs, where the
+    first tick is 0. They are passed to the terminal input before their tick,
+    so ``BearEvent('key_down', 'TK_RIGHT')`` acts like a key press.
+
+    :param atlas: Multiatlas instance
+
+    :param level_id: str or None. Level to start on.
+
+    :param seed: int or None. Level seed.
+
+    :param script: an iterable of (tick, BearEvent) pairs.
+
+    :param sounds: a dict of ``{'sound_id': path or array}`` or None. If set,
+    the sounds are mixed with a null backend; otherwise, sound events are
+    ignored.
+    """
+    def __init__(self, atlas, level_id='ghetto_corridor_2000', seed=0,
+                 script=(), sounds=None):
+        self.dispatcher, self.layout, self.factory = create_game(atlas)
+        dispatcher = self.dispatcher
+        self.terminal = NullTerminal()
+        self.terminal.add_widget(self.layout, (0, 0), layer=1)
+        self.loop = BearLoop(self.terminal, dispatcher)
+        self.levelgen = create_level_manager(dispatcher, self.factory,
+                                             stream_distance=100)
+        dispatcher.register_listener(ScrollListener(layout=self.layout,
+                                                    distance=30),
+                                     ['brut_focus', 'brut_temporary_focus',
+                                      'tick', 'ecs_move', 'ecs_destroy'])
+        dispatcher.register_listener(StreamingListener(
+                                         layout=self.layout,
+                                         level_manager=self.levelgen),
+                                     'tick')
+        self.jukebox = MixerListener(sounds or {}, backend=NullBackend(),
+                                     layout=self.layout)
+        if sounds is not None:
+            dispatcher.register_listener(self.jukebox, ['play_sound', 'tick',
+                                                        'set_bg_sound'])
+        dispatcher.register_listener(SavingListener(),
+                                     ('brut_save_game', 'tick', 'service'))
+        dispatcher.register_listener(LoadingListener(dispatcher, self.factory,
+                                                     self.levelgen, self.loop),
+                                     'brut_load_game')
+        # HUD
+        self.terminal.add_widget(Widget(*atlas.get_element('hud_bg')),
+                                 (0, 50), layer=1)
+        hp_bar = HitpointBar(target_entity='cop_1')
+        dispatcher.register_listener(hp_bar, ('brut_damage', 'brut_heal'))
+        self.terminal.add_widget(hp_bar, (19, 54), layer=2)
+        for hand, pos in (('left', (1, 51)), ('right', (66, 51))):
+            item_window = ItemWindow('cop_1', hand, atlas)
+            dispatcher.register_listener(item_window, ('brut_pick_up',
+                                                       'brut_change_ammo'))
+            self.terminal.add_widget(item_window, pos, layer=2)
+            dispatcher.add_event(BearEvent('brut_pick_up', ('cop_1', hand,
+                                                            'fist_pseudo')))
+        score_widget = ScoreWidget(score=0)
+        self.terminal.add_widget(score_widget, (41, 51))
+        dispatcher.register_listener(ScoreListener(dispatcher=dispatcher,
+                                                   terminal=self.terminal,
+                                                   score_widget=score_widget,
+                                                   score=0,
+                                                   player_entity='cop_1',
+                                                   heal_frequency=10),
+                                     ('tick', 'brut_score',
+                                      'brut_reset_score'))
+        self.script = defaultdict(list)
+        for tick, event in script:
+            self.script[tick].append(event)
+        self.tick = 0
+        # Wall time of every tick, in seconds
+        self.tick_times = []
+        self.peak_entities = 0
+        self.factory.create_entity('cop', (5, 25))
+        self.loop._run_iteration(0)
+        if level_id:
+            self.levelgen.set_level(level_id, seed=seed)
+            self.loop._run_iteration(0)
+
+    def step(self, tick_time):
+        """
+        Run a single tick.
+        :param tick_time: float. Simulated tick duration, in seconds.
+        :return: wall time of the tick, in seconds
+        """
+        for event in self.script.pop(self.tick, ()):
+            self.terminal.add_input(event)
+        start = perf_counter()
+        self.loop._run_iteration(tick_time)
+        elapsed = perf_counter() - start
+        self.tick_times.append(elapsed)
+        self.peak_entities = max(self.peak_entities,
+                                 len(EntityTracker().entities))
+        self.tick += 1
+        return elapsed
+
+    def run(self, ticks, fps=30):
+        """
+        Run the simulation for a number of ticks.
+
+        Stops early if the game is shut down.
+        :param ticks: int. Number of ticks.
+        :param fps: number. Simulated ticks per second.
+        :return: a dict of timing stats, see `stats`
+        """
+        for _ in range(ticks):
+            if self.loop.stopped:
+                break
+            self.step(1 / fps)
+        return self.stats(fps)
+
+    def stats(self, fps=30):
+        """
+        Summarize the tick times.
+        :param fps: number. Simulated ticks per second.
+        :return: a dict with the number of ticks, current and peak entity
+        count, total wall and simulated time, the speedup relative to real
+        time and ticks per second of wall time, and the mean, median, 99th
+        percentile and maximum tick time. Times are in seconds.
+        """
+        wall_time = sum(self.tick_times)
+        simulated_time = len(self.tick_times) / fps
+        return {'ticks': len(self.tick_times),
+                'entities': len(EntityTracker().entities),
+                'peak_entities': self.peak_entities,
+                'wall_time': wall_time,
+                'simulated_time': simulated_time,
+                'speedup': simulated_time / wall_time if wall_time else 0,
+                'ticks_per_second': len(self.tick_times) / wall_time
+                                    if wall_time else 0,
+                'mean': wall_time / len(self.tick_times)
+                        if self.tick_times else 0,
+                'p50': percentile(self.tick_times, 50)
+                        if self.tick_times else 0,
+                'p99': percentile(self.tick_times, 99)
+                        if self.tick_times else 0,
+                'max': max(self.tick_times, default=0)}
+
+
+def fight_script(ticks, attack_period=10):
+    """
+    Script the player walking right and attacking.
+
+    The right arrow is held all the time, and every `attack_period` ticks
+    the player attacks with left and right hands in turn.
+    :param ticks: int. Script length.
+    :param attack_period: int. Ticks between attacks.
+    :return: a list of (tick, BearEvent) pairs
+    """
+    script = [(tick, BearEvent('key_down', 'TK_RIGHT'))
+              for tick in range(ticks)]
+    for number, tick in enumerate(range(0, ticks, attack_period)):
+        script.append((tick, BearEvent('key_down',
+                                       ('TK_Q', 'TK_E')[number % 2])))
+    return script
+
+
+def load_script(file_name):
+    """
+    Load a JSON list of [tick, event_type, event_value] entries.
+    :param file_name: path to the script
+    :return: a list of (tick, BearEvent) pairs
+    """
+    with open(file_name) as script_file:
+        return [(tick, BearEvent(event_type, event_value))
+                for tick, event_type, event_value in json.load(script_file)]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('Brutality headless simulation')
+    parser.add_argument('--level', type=str, default='ghetto_corridor_2000',
+                        help='Level ID')
+    parser.add_argument('--ticks', type=int, default=1000,
+                        help='Number of ticks to simulate')
+    parser.add_argument('--fps', type=int, default=30,
+                        help='Simulated ticks per second')
+    parser.add_argument('--seed', type=int, default=0, help='Level seed')
+    parser.add_argument('--walk', action='store_true',
+                        help='Hold the right arrow the whole time')
+    parser.add_argument('--fight', action='store_true',
+                        help='Walk right and attack every 10 ticks')
+    parser.add_argument('--script', type=str,
+                        help='JSON list of [tick, event_type, event_value]')
+    args = parser.parse_args()
+    script = load_script(args.script) if args.script else []
+    if args.walk:
+        script += [(tick, BearEvent('key_down', 'TK_RIGHT'))
+                   for tick in range(args.ticks)]
+    elif args.fight:
+        script += fight_script(args.ticks)
+    # Some game code and bear_hug listeners print debug info to stdout
+    with open(devnull, 'w') as null, redirect_stdout(null):
+        simulation = Simulation(load_atlas(), level_id=args.level,
+                                seed=args.seed, script=script)
+        stats = simulation.run(args.ticks, fps=args.fps)
+    print(f'{stats["ticks"]} ticks, {stats["entities"]} entities at the end, '
+          f'{stats["peak_entities"]} at most')
+    print(f'{stats["simulated_time"]:.1f} s simulated in '
+          f'{stats["wall_time"]:.2f} s, {stats["speedup"]:.1f}x real time, '
+          f'{stats["ticks_per_second"]:.0f} ticks/s')
+    for key in ('mean', 'p50', 'p99', 'max'):
+        print(f'{key:<5} {stats[key] * 1000:8.2f} ms')
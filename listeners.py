@@ -3,17 +3,34 @@ Things that should somehow interact with the events, but are too simple to
 merit a complete entity, or to complicated to be limited to one.
 """
 
-from collections import namedtuple
-from json import dump, load
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque, namedtuple
+from json import dump, dumps, load, loads
+from os import path, remove, replace
+from threading import Thread
+from time import perf_counter
+from uuid import uuid4
 
 from bear_hug.bear_utilities import BearLayoutException, rectangles_collide, \
     copy_shape
-from bear_hug.ecs import EntityTracker, Singleton
+from bear_hug.ecs import EntityTracker, Singleton, CollisionListener, \
+    CollisionComponent, DestructorComponent, PositionComponent, \
+    WidgetComponent, SwitchWidgetComponent
 from bear_hug.ecs_widgets import ScrollableECSLayout
 from bear_hug.event import BearEvent
-from bear_hug.sound import SoundListener
 from bear_hug.widgets import Widget, Listener, MenuWidget, Label
 
+from ai import AIComponent
+from components import ProjectileCollisionComponent, \
+    HealingProjectileCollisionComponent, DecorationWidgetComponent, \
+    LevelSwitchComponent, AmmoPickupCollisionComponent, \
+    ScorePickupCollisionComponent, AttachedPositionComponent, \
+    SpawnerComponent, HidingComponent, CollectableBehaviourComponent, \
+    ItemBehaviourComponent, SpawningItemBehaviourComponent, \
+    HealingItemBehaviourComponent, entity_state
+from mixer import MixerListener
+from saves import SaveWriter, delta_file_name, is_binary_save, \
+    read_records, ENTITY_RECORD, META_RECORD, REMOVED_RECORD
 from widgets import TypingLabelWidget
 
 
@@ -139,18 +156,326 @@ class ScrollListener(Listener, metaclass=Singleton):
                                               0))
 
 
+class StreamingListener(Listener, metaclass=Singleton):
+    """
+    Makes LevelManager create and retire parts of the level as the view moves.
+
+    Each tick, passes the current view of the ScrollableECSLayout to
+    `LevelManager.update_chunks`. Does nothing while the player is outside the
+    view (eg right after the level change, before the ScrollListener has
+    scrolled to the player's new position).
+
+    This Listener is a singleton, and creating more than one is impossible.
+    """
+    def __init__(self, *args, layout=None, level_manager=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not layout or not isinstance(layout, ScrollableECSLayout):
+            raise BearLayoutException('StreamingListener should be initiated with the layout')
+        self.layout = layout
+        # LevelManager type not checked to avoid circular import
+        self.level_manager = level_manager
+
+    def on_event(self, event):
+        if event.event_type == 'tick':
+            view_x = self.layout.view_pos[0]
+            view_width = self.layout.view_size[0]
+            try:
+                x = EntityTracker().entities[
+                    self.level_manager.player_entity].position.x
+            except KeyError:
+                return
+            if view_x <= x < view_x + view_width:
+                self.level_manager.update_chunks(view_x, view_width)
+
+
+class GridCollisionListener(CollisionListener):
+    """
+    A CollisionListener that only checks the entities nearby.
+
+    The stock CollisionListener checks every move against every entity on the
+    screen. This one keeps the collision faces of tracked entities in a
+    uniform grid of `cell_size` chars and only checks the entities in the
+    cells the moved entity touches. An entity is placed in the grid when it
+    is added to the layout and moved in it whenever it moves.
+
+    Projectiles (see `self.swept_types`) move several chars at once when the
+    frame rate is low, and could fly over thin things like walls. For them,
+    the whole way from the previous position to the new one is checked, and
+    collisions are reported in the order the projectile would have met the
+    other entities, so that the first one gets hit regardless of frame rate.
+
+    Reacts to the same events as CollisionListener. Unlike the stock one, it
+    reports every collision only once, even if the entities collide at
+    several z-levels.
+
+    :param cell_size: Grid cell size, in chars.
+    """
+
+    swept_types = (ProjectileCollisionComponent,
+                   HealingProjectileCollisionComponent)
+
+    def __init__(self, *args, cell_size=16, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not isinstance(cell_size, int) or cell_size <= 0:
+            raise ValueError('GridCollisionListener cell_size should be a positive int')
+        self.cell_size = cell_size
+        # Cell -> IDs of the entities whose faces are at least partially there
+        self.cells = {}
+        # ID -> (cells, position) of every entity in the grid
+        self.indexed = {}
+
+    def on_event(self, event):
+        if event.event_type == 'ecs_create':
+            self.entities[event.event_value.id] = event.event_value
+        elif event.event_type == 'ecs_destroy':
+            self.untrack(event.event_value)
+            del self.entities[event.event_value]
+        elif event.event_type == 'ecs_remove':
+            self.untrack(event.event_value)
+        elif event.event_type == 'ecs_add':
+            self.track(event.event_value[0])
+        elif event.event_type == 'ecs_move' \
+                and event.event_value[0] in self.currently_tracked:
+            moved_id, x, y = event.event_value
+            old_pos = self.indexed[moved_id][1] if moved_id in self.indexed \
+                else (x, y)
+            self._index(moved_id, (x, y))
+            return self.check_move(moved_id, old_pos, (x, y))
+
+    def track(self, entity_id):
+        """
+        Start checking collisions for an entity, if it can collide.
+
+        :param entity_id: ID of an entity that was just added to the layout
+        """
+        entity = self.entities[entity_id]
+        if not hasattr(entity, 'collision'):
+            # Anything added to the screen should have position and widget
+            # But if it doesn't have CollisionComponent, it's not our problem
+            return
+        self.currently_tracked.add(entity_id)
+        if hasattr(entity, 'position'):
+            self._index(entity_id, entity.position.pos)
+
+    def untrack(self, entity_id):
+        """
+        Stop checking collisions for an entity.
+
+        :param entity_id: entity ID
+        """
+        self.currently_tracked.discard(entity_id)
+        if entity_id in self.indexed:
+            for cell in self.indexed.pop(entity_id)[0]:
+                self.cells[cell].discard(entity_id)
+                if not self.cells[cell]:
+                    del self.cells[cell]
+
+    def _bounds(self, entity, pos):
+        """
+        Return the rectangle where the entity may collide at any z-level.
+
+        :param entity: Entity with the CollisionComponent
+        :param pos: entity position
+        :return: (x, y, width, height)
+        """
+        collision = entity.collision
+        size = collision.face_size
+        if size == (0, 0):
+            size = entity.widget.size
+        # At lower z-levels, the face is shifted by up to depth * z_shift
+        shift_x = collision.z_shift[0] * collision.depth
+        shift_y = collision.z_shift[1] * collision.depth
+        return (pos[0] + collision.face_position[0] + min(shift_x, 0),
+                pos[1] + collision.face_position[1] + min(shift_y, 0),
+                size[0] + abs(shift_x), size[1] + abs(shift_y))
+
+    def _cells(self, bounds):
+        x, y, width, height = bounds
+        return [(cell_x, cell_y)
+                for cell_x in range(x // self.cell_size,
+                                    (x + width - 1) // self.cell_size + 1)
+                for cell_y in range(y // self.cell_size,
+                                    (y + height - 1) // self.cell_size + 1)]
+
+    def _index(self, entity_id, pos):
+        if entity_id in self.indexed:
+            for cell in self.indexed[entity_id][0]:
+                self.cells[cell].discard(entity_id)
+                if not self.cells[cell]:
+                    del self.cells[cell]
+        cells = self._cells(self._bounds(self.entities[entity_id], pos))
+        for cell in cells:
+            if cell in self.cells:
+                self.cells[cell].add(entity_id)
+            else:
+                self.cells[cell] = {entity_id}
+        self.indexed[entity_id] = (cells, pos)
+
+    def check_move(self, moved_id, old_pos, new_pos):
+        """
+        Return collision events caused by the entity moving.
+
+        :param moved_id: ID of the entity that moved
+        :param old_pos: the position it moved from
+        :param new_pos: the position it moved to
+        :return: a list of 'ecs_collision' BearEvents
+        """
+        moved = self.entities[moved_id]
+        if not isinstance(moved.collision, self.swept_types):
+            old_pos = new_pos
+        bounds = self._bounds(moved, new_pos)
+        if old_pos != new_pos:
+            old_bounds = self._bounds(moved, old_pos)
+            left = min(bounds[0], old_bounds[0])
+            top = min(bounds[1], old_bounds[1])
+            bounds = (left, top,
+                      max(bounds[0] + bounds[2],
+                          old_bounds[0] + old_bounds[2]) - left,
+                      max(bounds[1] + bounds[3],
+                          old_bounds[1] + old_bounds[3]) - top)
+        candidates = set()
+        for cell in self._cells(bounds):
+            if cell in self.cells:
+                candidates.update(self.cells[cell])
+        hits = []
+        for other_id in candidates:
+            other = self.entities[other_id]
+            if other_id == moved_id or not hasattr(other, 'position') \
+                    or not hasattr(other, 'collision'):
+                continue
+            t = self._entry_time(moved, old_pos, new_pos, other)
+            if t is not None:
+                hits.append((t, other_id))
+        hits.sort(key=lambda x: x[0])
+        return [BearEvent('ecs_collision', (moved_id, other_id))
+                for t, other_id in hits]
+
+    @staticmethod
+    def _entry_time(moved, old_pos, new_pos, other):
+        """
+        Return when the moving entity first touches the other one.
+
+        Uses the same z-level rules as CollisionListener. The moving entity is
+        assumed to go in a straight line from `old_pos` to `new_pos`.
+
+        :return: a float between 0 and 1 (the fraction of the way), or None
+        if the entities don't collide
+        """
+        moved_z = moved.widget.z_level
+        moved_depth = moved.collision.depth
+        other_z = other.widget.z_level
+        other_depth = other.collision.depth
+        # Only check if two entities are within collidable z-levels
+        if not (moved_z - moved_depth <= other_z
+                and other_z - other_depth <= moved_z):
+            return None
+        moved_face = moved.collision.face_position
+        moved_shift = moved.collision.z_shift
+        moved_size = moved.collision.face_size
+        if moved_size == (0, 0):
+            moved_size = moved.widget.size
+        other_face = other.collision.face_position
+        other_shift = other.collision.z_shift
+        other_size = other.collision.face_size
+        if other_size == (0, 0):
+            other_size = other.widget.size
+        delta = (new_pos[0] - old_pos[0], new_pos[1] - old_pos[1])
+        first = None
+        for z_level in range(max(moved_z - moved_depth, other_z - other_depth),
+                             min(moved_z, other_z) + 1):
+            start = (old_pos[0] + moved_face[0] + moved_shift[0] * (moved_z - z_level),
+                     old_pos[1] + moved_face[1] + moved_shift[1] * (moved_z - z_level))
+            other_pos = (other.position.x + other_face[0] + other_shift[0] * (other_z - z_level),
+                         other.position.y + other_face[1] + other_shift[1] * (other_z - z_level))
+            # Along each axis, the rectangles overlap while the moving one is
+            # between `low` and `high` (the same condition as in
+            # rectangles_collide)
+            enter, leave = 0, 1
+            for axis in (0, 1):
+                low = other_pos[axis] - moved_size[axis] + 1
+                high = other_pos[axis] + other_size[axis] - 1
+                if delta[axis] == 0:
+                    if not low <= start[axis] <= high:
+                        break
+                    continue
+                t1 = (low - start[axis]) / delta[axis]
+                t2 = (high - start[axis]) / delta[axis]
+                enter = max(enter, min(t1, t2))
+                leave = min(leave, max(t1, t2))
+                if enter > leave:
+                    break
+            else:
+                if first is None or enter < first:
+                    first = enter
+        return first
+
+
 # This data class contains all information about what should be spawned and when
 # Attributes are: `item` (str) for item type, `pos` (tuple of ints) for upper
 # left corner of region where a player must walk to trigger this item, `size`
-# (tuple of ints) for the size of this region, and `kwargs` (dict) for any
-# kwargs that should be passed to factory during item creation
-SpawnItem = namedtuple('SpawnItem', ('item', 'pos', 'size', 'kwargs'))
+# (tuple of ints) for the size of this region, `kwargs` (dict) for any
+# kwargs that should be passed to factory during item creation, and `trigger`
+# (str) for the ID of an entity that triggers this item instead of the player.
+# `trigger` is optional, so that the spawns from older saves can be loaded
+SpawnItem = namedtuple('SpawnItem', ('item', 'pos', 'size', 'kwargs',
+                                     'trigger'))
+SpawnItem.__new__.__defaults__ = (None,)
+
+
+class SpawnIndex:
+    """
+    A collection of SpawnItems sorted by the left edge of their areas.
+
+    Finding the areas that intersect a given x range takes O(log n) plus the
+    number of areas that start within `max_width` chars to the left of it.
+    """
+    def __init__(self, spawns=()):
+        self.spawns = sorted(spawns, key=lambda x: x.pos[0])
+        self.starts = [x.pos[0] for x in self.spawns]
+        self.max_width = max((x.size[0] for x in self.spawns), default=0)
+
+    def __len__(self):
+        return len(self.spawns)
+
+    def add(self, spawn):
+        i = bisect_right(self.starts, spawn.pos[0])
+        self.starts.insert(i, spawn.pos[0])
+        self.spawns.insert(i, spawn)
+        self.max_width = max(self.max_width, spawn.size[0])
+
+    def remove(self, spawn):
+        """
+        Remove this very SpawnItem (not just an equal one).
+        """
+        i = bisect_left(self.starts, spawn.pos[0])
+        while self.spawns[i] is not spawn:
+            i += 1
+        del self.starts[i]
+        del self.spawns[i]
+
+    def find(self, pos, size):
+        """
+        Return a list of spawns whose areas collide with a given rectangle.
+
+        :param pos: top left corner of the rectangle, as (x, y) 2-tuple
+        :param size: size of the rectangle, as (width, height) 2-tuple
+        """
+        first = bisect_left(self.starts, pos[0] - self.max_width + 1)
+        last = bisect_right(self.starts, pos[0] + size[0] - 1)
+        return [spawn for spawn in self.spawns[first:last]
+                if rectangles_collide(spawn.pos, spawn.size, pos, size)]
 
 
 class SpawningListener(Listener, metaclass=Singleton):
     """
     Spawns items when player walks into a predefined area.
 
+    Spawns whose `trigger` is set are spawned when that entity walks into
+    their area instead. Spawns are kept in a separate SpawnIndex for every
+    trigger, so a move is only checked against the areas around the entity
+    that moved. All spawns triggered by the same move are created at once,
+    within `factory.bulk_creation()`.
+
     :param player_entity: Str. Player entity ID; this Listener will create
     entities when this entity walks into predefined areas
 
@@ -161,17 +486,30 @@ class SpawningListener(Listener, metaclass=Singleton):
     def __init__(self, player_entity_id,
                  factory=None, spawns=None, **kwargs):
         super().__init__(**kwargs)
-        self.spawns = []
+        # Trigger ID (None for the player) -> SpawnIndex
+        self.indices = {}
         if spawns:
-            for item in self.spawns:
-                if not isinstance(item, SpawnItem):
-                    raise TypeError(f'{type(item)} supplied to SpawningListener instead of SpawnItem')
-                self.spawns.append(item)
+            self.add_spawns_iterable(spawns)
         self.factory = factory
         self.player_id = player_entity_id
         # To be set during the first event
         self.player_entity = None
 
+    @property
+    def spawns(self):
+        """
+        A list of all SpawnItems in this Listener.
+
+        Setting it replaces all spawns.
+        """
+        return [spawn for index in self.indices.values()
+                for spawn in index.spawns]
+
+    @spawns.setter
+    def spawns(self, value):
+        self.indices = {}
+        self.add_spawns_iterable(value)
+
     def set_player(self, value):
         """
         Set tracked entity ID to `value`.
@@ -194,16 +532,31 @@ class SpawningListener(Listener, metaclass=Singleton):
         """
         if not isinstance(item, SpawnItem):
             raise TypeError(f'{type(item)} supplied to SpawningListener instead of SpawnItem')
-        self.spawns.append(item)
+        if item.trigger in self.indices:
+            self.indices[item.trigger].add(item)
+        else:
+            self.indices[item.trigger] = SpawnIndex((item,))
 
     def add_spawns_iterable(self, spawns):
         """
         Add a group of SpawnItems to this listener
+
+        Every index is sorted once for the entire group.
         :param spawns: an iterable of SpawnItem
         :return:
         """
+        groups = {}
         for item in spawns:
-            self.add_spawn(item)
+            if not isinstance(item, SpawnItem):
+                raise TypeError(f'{type(item)} supplied to SpawningListener instead of SpawnItem')
+            if item.trigger in groups:
+                groups[item.trigger].append(item)
+            else:
+                groups[item.trigger] = [item]
+        for trigger, items in groups.items():
+            if trigger in self.indices:
+                items.extend(self.indices[trigger].spawns)
+            self.indices[trigger] = SpawnIndex(items)
 
     def remove_spawns(self, filter=lambda x: True):
         """
@@ -212,54 +565,317 @@ class SpawningListener(Listener, metaclass=Singleton):
         :param filter: callable which accepts a single argument
         :return:
         """
-        # Copy list to avoid all weirdness caused by changing list while
-        # iterating over it
-        tmp_list = [x for x in self.spawns]
-        for spawn in tmp_list:
-            if filter(spawn):
-                self.spawns.remove(spawn)
+        self.spawns = [x for x in self.spawns if not filter(x)]
 
     def on_event(self, event):
-        if event.event_type == 'ecs_move' and \
-                    event.event_value[0] == self.player_id:
-            if not self.player_entity:
-                self.player_entity = EntityTracker().entities[self.player_id]
-            for spawn in self.spawns:
-                try:
-                    if rectangles_collide(spawn.pos, spawn.size,
-                                          self.player_entity.position.pos,
-                                          self.player_entity.widget.size):
-                        self.factory.create_entity(spawn.item,
-                                                   # Spawn in the middle
-                                                   (int(spawn.pos[0]+spawn.size[0]/2),
-                                                    int(spawn.pos[1]+spawn.size[1]/2)),
-                                                   **spawn.kwargs)
-                        self.spawns.remove(spawn)
-                except AttributeError:
-                    # Sometimes it interacts with half-destroyed entities during
-                    # level switch process. 
-                    pass
-
-
-class SavingListener(Listener):
+        if event.event_type == 'ecs_move':
+            if event.event_value[0] == self.player_id:
+                trigger = None
+            else:
+                trigger = event.event_value[0]
+            if trigger not in self.indices:
+                return
+            try:
+                if trigger is None:
+                    if not self.player_entity:
+                        self.player_entity = EntityTracker().entities[self.player_id]
+                    entity = self.player_entity
+                else:
+                    entity = EntityTracker().entities[trigger]
+                triggered = self.indices[trigger].find(entity.position.pos,
+                                                       entity.widget.size)
+            except (AttributeError, KeyError):
+                # Sometimes it interacts with half-destroyed entities during
+                # level switch process.
+                return
+            if not triggered:
+                return
+            # Removed before creating anything, in case creation causes moves
+            for spawn in triggered:
+                self.indices[trigger].remove(spawn)
+            if not self.indices[trigger]:
+                del self.indices[trigger]
+            with self.factory.bulk_creation():
+                for spawn in triggered:
+                    self.factory.create_entity(spawn.item,
+                                               # Spawn in the middle
+                                               (int(spawn.pos[0]+spawn.size[0]/2),
+                                                int(spawn.pos[1]+spawn.size[1]/2)),
+                                               **spawn.kwargs)
+
+
+class SavingListener(Listener, metaclass=Singleton):
     """
     A Listener class that waits for a ''brut_save_game'' event and saves
 
-    Serializes all existing entities, LevelSwitchListener state and spawns in
-    the SpawnListener.
+    Serializes all existing entities, LevelSwitchListener state, spawns in
+    the SpawnListener and the parts of the level LevelManager has not created
+    or has retired (see `LevelManager.get_stream_state`).
+
+    Files with the ``.json`` extension are written as a single JSON object,
+    anything else as a binary save (see `saves.py`).
+
+    Only the snapshot of the game state is taken during the frame: every
+    entity state is encoded to a JSON string, so later changes to the
+    entities do not leak into the save. The file is written by a background
+    thread, first to a temporary file which then replaces the save. Once it
+    is done, a 'brut_save_done' event (with the save path) or a
+    'brut_save_failed' event (with the path and an error message) is emitted
+    on the next 'tick' or 'service' event. If another save is requested in
+    the meantime, it is written after the current one. Unwritten saves are
+    finished on shutdown, and before any save is loaded.
+    :param compress: bool. Whether binary saves are zlib-compressed.
     """
+    def __init__(self, *args, compress=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compress = compress
+        self.thread = None
+        self.thread_report = None
+        # Saves requested while the thread was busy
+        self.pending = []
+        # Events for the saves that are finished, but not reported yet
+        self.reports = []
+
+    @staticmethod
+    def take_snapshot(entities=None, **meta):
+        """
+        Collect the game state.
+        :param entities: an iterable of Entities to save. If None, all
+        entities are saved.
+        :param meta: additional metadata
+        :return: a tuple of (metadata JSON, list of entity state JSONs)
+        """
+        if entities is None:
+            entities = EntityTracker().entities.values()
+        r = dict(meta)
+        # Saving listeners
+        r['level_switch_state'] = LevelSwitchListener().get_state()
+        r['current_level'] = LevelSwitchListener().current_level
+        # Loading spawns from SpawnListener
+        r['spawns'] = SpawningListener().spawns
+        r['bg_sound'] = MixerListener().bg_sound
+        # Rooms that are not created yet and dormant chunks
+        r['stream_state'] = LevelSwitchListener().level_manager.get_stream_state()
+        return dumps(r), [dumps(entity_state(entity)) for entity in entities]
+
+    def write_save(self, file_name, meta, entities, removed=None,
+                   obsolete=()):
+        """
+        Write a snapshot to a file.
+
+        Called from the background thread.
+        :param file_name: save path
+        :param meta: metadata JSON
+        :param entities: list of entity state JSONs
+        :param removed: list of removed entity IDs. Only written to binary
+        saves, and only if not None.
+        :param obsolete: paths of the files to delete once the save is written
+        :return: a 'brut_save_done' or 'brut_save_failed' BearEvent
+        """
+        tmp_name = f'{file_name}.tmp'
+        try:
+            if file_name.endswith('.json'):
+                r = loads(meta)
+                r['entities'] = [loads(x) for x in entities]
+                # Unlike `dumps`, `json.dump` can't use the C encoder
+                with open(tmp_name, mode='w') as save_file:
+                    save_file.write(dumps(r))
+            else:
+                with open(tmp_name, mode='wb') as save_file, \
+                        SaveWriter(save_file, compress=self.compress) as writer:
+                    writer.write_record(META_RECORD, loads(meta))
+                    if removed is not None:
+                        writer.write_record(REMOVED_RECORD, removed)
+                    for state in entities:
+                        writer.write_record(ENTITY_RECORD, loads(state))
+            replace(tmp_name, file_name)
+            for obsolete_file in obsolete:
+                if path.exists(obsolete_file):
+                    remove(obsolete_file)
+        except Exception as e:
+            if path.exists(tmp_name):
+                remove(tmp_name)
+            return BearEvent('brut_save_failed', (file_name, str(e)))
+        return BearEvent('brut_save_done', file_name)
+
+    def request_save(self, file_name, meta, entities, removed=None,
+                     obsolete=()):
+        """
+        Write a snapshot to a file in the background.
+
+        Takes the same arguments as `write_save`.
+        """
+        save = (file_name, meta, entities, removed, obsolete)
+        if self.thread:
+            self.pending.append(save)
+        else:
+            self._start_thread(save)
+
+    def _start_thread(self, save):
+        def run():
+            self.thread_report = self.write_save(*save)
+        self.thread_report = None
+        self.thread = Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def _check_thread(self):
+        """
+        Collect the finished save and start the pending one, if any
+        """
+        if self.thread and not self.thread.is_alive():
+            self.reports.append(self.thread_report)
+            self.thread = None
+            if self.pending:
+                self._start_thread(self.pending.pop(0))
+
+    def wait(self):
+        """
+        Block until all requested saves are written.
+        """
+        while self.thread:
+            self.thread.join()
+            self._check_thread()
+
     def on_event(self, event):
         if event.event_type == 'brut_save_game':
-            r = {}
-            # Saving entities
-            r['entities'] = [repr(entity) for entity in EntityTracker().entities.values()]
-            # Saving listeners
-            r['level_switch_state'] = LevelSwitchListener().get_state()
-            r['current_level'] = LevelSwitchListener().current_level
-            # Loading spawns from SpawnListener
-            r['spawns'] = SpawningListener().spawns
-            r['bg_sound'] = SoundListener().bg_sound
-        dump(r, open(event.event_value, mode='w'), indent=2)
+            self.request_save(event.event_value, *self.take_snapshot())
+        elif event.event_type == 'tick':
+            self._check_thread()
+        elif event.event_type == 'service':
+            if event.event_value == 'shutdown':
+                self.wait()
+            else:
+                self._check_thread()
+        if self.reports:
+            r = self.reports
+            self.reports = []
+            return r
+
+
+class AutosaveListener(Listener, metaclass=Singleton):
+    """
+    Saves the game every few seconds, writing only what has changed.
+
+    The first autosave is a full save to ``file_name``. The following ones
+    are deltas: ``file_name.1``, ``file_name.2`` and so on (see `saves.py`).
+    Each delta contains the metadata, the states of the entities that have
+    changed since the previous autosave and the IDs of the entities that were
+    removed. Every ``compaction`` deltas, or when most of the entities have
+    changed (eg after a level switch), a new full save replaces the old one
+    and its deltas. LoadingListener applies the deltas when the full save
+    is loaded.
+
+    An entity has changed if it was created, moved, shown, hidden, damaged,
+    healed, picked up or used, or had its ammo changed. Entities that have
+    any components other than `stable_components`, or that are shown for a
+    while by their HidingComponent, are written every time, because their
+    state (AI, timers, health, animation) changes on its own.
+
+    The files are written by SavingListener in the background.
+    :param file_name: path of the full autosave
+    :param period: seconds between autosaves
+    :param compaction: number of deltas before the next full save
+    """
+    # Components that do not change without one of the events tracked here
+    stable_components = (WidgetComponent, SwitchWidgetComponent,
+                         DecorationWidgetComponent, PositionComponent,
+                         AttachedPositionComponent, CollisionComponent,
+                         DestructorComponent, LevelSwitchComponent,
+                         AmmoPickupCollisionComponent,
+                         ScorePickupCollisionComponent, SpawnerComponent,
+                         HidingComponent, CollectableBehaviourComponent,
+                         ItemBehaviourComponent,
+                         SpawningItemBehaviourComponent,
+                         HealingItemBehaviourComponent)
+
+    def __init__(self, *args, file_name='autosave.sav', period=60,
+                 compaction=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not isinstance(period, (int, float)) or period <= 0:
+            raise ValueError(f'Autosave period should be a positive number, got {period}')
+        if not isinstance(compaction, int) or compaction < 1:
+            raise ValueError(f'Autosave compaction should be a positive int, got {compaction}')
+        self.file_name = file_name
+        self.period = period
+        self.compaction = compaction
+        self.timer = 0
+        # ID of the current full save, or None before it is made
+        self.chain = None
+        self.delta_count = 0
+        # Entities as of the previous autosave, by ID
+        self.saved_entities = {}
+        # IDs of entities that changed since the previous autosave
+        self.dirty = set()
+
+    def is_stable(self, entity):
+        """
+        Check whether an entity only changes with the tracked events
+        :param entity: Entity
+        :return: bool
+        """
+        for name in entity.components:
+            component = getattr(entity, name)
+            if type(component) not in self.stable_components:
+                return False
+            # Hidden entities can only be changed by `show()`, which emits
+            # 'ecs_add', but shown ones age every tick
+            if type(component) is HidingComponent and component.is_working:
+                return False
+        return True
+
+    def autosave(self, full=False):
+        """
+        Save the game now.
+        :param full: bool. If True, a full save is made even if a delta would
+        do.
+        """
+        entities = EntityTracker().entities
+        saving = SavingListener()
+        if not full and self.chain and self.delta_count < self.compaction:
+            # Entities that were replaced by others with the same ID are
+            # changed as well
+            changed = [entity for entity_id, entity in entities.items()
+                       if entity_id in self.dirty
+                       or self.saved_entities.get(entity_id) is not entity
+                       or not self.is_stable(entity)]
+            # A delta that large gains nothing over a full save
+            full = len(changed) * 2 > len(entities)
+        else:
+            full = True
+        if full:
+            obsolete = [delta_file_name(self.file_name, x)
+                        for x in range(1, self.delta_count + 1)]
+            self.chain = uuid4().hex
+            self.delta_count = 0
+            saving.request_save(self.file_name,
+                                *saving.take_snapshot(chain=self.chain),
+                                obsolete=obsolete)
+        else:
+            self.delta_count += 1
+            removed = [x for x in self.saved_entities if x not in entities]
+            saving.request_save(delta_file_name(self.file_name,
+                                                self.delta_count),
+                                *saving.take_snapshot(changed,
+                                                      chain=self.chain,
+                                                      delta=self.delta_count),
+                                removed=removed)
+        self.saved_entities = dict(entities)
+        self.dirty = set()
+
+    def on_event(self, event):
+        if event.event_type == 'tick':
+            self.timer += event.event_value
+            if self.timer >= self.period:
+                self.timer = 0
+                self.autosave()
+        elif event.event_type in ('ecs_add', 'ecs_move', 'brut_damage',
+                                  'brut_heal', 'brut_change_ammo'):
+            self.dirty.add(event.event_value[0])
+        elif event.event_type in ('ecs_remove', 'brut_use_item'):
+            self.dirty.add(event.event_value)
+        elif event.event_type == 'brut_pick_up':
+            self.dirty.add(event.event_value[0])
+            self.dirty.add(event.event_value[2])
 
 
 class LoadingListener(Listener):
@@ -267,6 +883,9 @@ class LoadingListener(Listener):
     A Listener class that waits for a 'brut_load_game' event and loads
 
     Deserializes stuff from a file and sets attributes for various listeners.
+    Both JSON and binary saves are supported; the latter are recognized by
+    their contents and loaded while the file is being read. If an autosave
+    has deltas (see `AutosaveListener`), they are applied first.
     """
     def __init__(self, dispatcher, factory, levelgen, loop, **kwargs):
         super().__init__(**kwargs)
@@ -275,6 +894,43 @@ class LoadingListener(Listener):
         self.levelgen = levelgen
         self.loop = loop
 
+    @staticmethod
+    def read_autosave(file_name):
+        """
+        Read a full autosave and apply its deltas.
+
+        Deltas are applied in order until one is missing or belongs to a
+        different autosave.
+        :param file_name: path of the full autosave
+        :return: a tuple of (metadata dict, list of entity states)
+        """
+        save = {}
+        states = {}
+        with open(file_name, mode='rb') as save_file:
+            for record_type, value in read_records(save_file):
+                if record_type == ENTITY_RECORD:
+                    states[value['id']] = value
+                elif record_type == META_RECORD:
+                    save.update(value)
+        delta = 1
+        while 'chain' in save and path.exists(delta_file_name(file_name, delta)):
+            with open(delta_file_name(file_name, delta), mode='rb') as save_file:
+                records = read_records(save_file)
+                # Metadata is always the first record
+                record_type, meta = next(records)
+                if meta.get('chain') != save['chain'] \
+                        or meta.get('delta') != delta:
+                    break
+                save.update(meta)
+                for record_type, value in records:
+                    if record_type == ENTITY_RECORD:
+                        states[value['id']] = value
+                    elif record_type == REMOVED_RECORD:
+                        for entity_id in value:
+                            states.pop(entity_id, None)
+            delta += 1
+        return save, list(states.values())
+
     def on_event(self, event):
         if event.event_type == 'brut_load_game':
             self.levelgen.destroy_current_level(destroy_player=True)
@@ -285,15 +941,37 @@ class LoadingListener(Listener):
             spawner.player_entity = None
             level_switch.player_entity = None
             level_switch.player_id = None
-            save = load(open(event.event_value))
-            for line in save['entities']:
-                self.factory.load_entity_from_JSON(line)
+            # Don't read a save that is still being written
+            SavingListener().wait()
+            if path.exists(delta_file_name(event.event_value, 1)):
+                save, states = self.read_autosave(event.event_value)
+                for state in states:
+                    self.factory.load_entity_from_state(state)
+            else:
+                with open(event.event_value, mode='rb') as save_file:
+                    if is_binary_save(save_file):
+                        save = {}
+                        for record_type, value in read_records(save_file):
+                            if record_type == ENTITY_RECORD:
+                                self.factory.load_entity_from_state(value)
+                            elif record_type == META_RECORD:
+                                save.update(value)
+                    else:
+                        save = load(save_file)
+                        for state in save['entities']:
+                            if isinstance(state, str):
+                                # Saved before entity states were stored as dicts
+                                self.factory.load_entity_from_JSON(state)
+                            else:
+                                self.factory.load_entity_from_state(state)
             # Make all entities available for EntityTracker
             self.loop._run_iteration(0)
             for attr in save['level_switch_state']:
                 level_switch.__dict__[attr] = save['level_switch_state'][attr]
             self.levelgen.current_level = save['current_level']
             spawner.spawns = [SpawnItem(*x) for x in save['spawns']]
+            if 'stream_state' in save:
+                self.levelgen.set_stream_state(save['stream_state'])
             # Fixes and workarounds to display everything correctly on the first
             # frame
             self.dispatcher.add_event(BearEvent('brut_focus', 'cop_1'))
@@ -304,8 +982,6 @@ class LoadingListener(Listener):
             # Pseudo-events to redraw items in the HUD
             left_item = cop_entity.hands.left_item
             right_item = cop_entity.hands.right_item
-            EntityTracker().entities[left_item].hiding.hide()
-            EntityTracker().entities[right_item].hiding.hide()
             self.dispatcher.add_event(
                 BearEvent('brut_pick_up',
                           ('cop_1', 'left', f'{left_item}_pseudo')))
@@ -326,9 +1002,9 @@ class ConfigListener(Listener, metaclass=Singleton):
         if event.event_type == 'brut_change_config':
             if event.event_value[0] == 'sound':
                 if event.event_value[1]:
-                    SoundListener().turn_on()
+                    MixerListener().turn_on()
                 else:
-                    SoundListener().turn_off()
+                    MixerListener().turn_off()
             if event.event_value[0] == 'fullscreen':
                 self.terminal.fullscreen = event.event_value[1]
 
@@ -424,6 +1100,10 @@ class LevelSwitchListener(Listener, metaclass=Singleton):
                                                self.next_level])
             return BearEvent('play_sound', 'drive')
             self.next_level = None
+        elif event.event_type == 'tick':
+            # Levels are prepared in the background, but not in the same
+            # frame as the level switch
+            self.level_manager.start_preparation()
 
     def disable(self):
         """
@@ -652,3 +1332,135 @@ class ScoreListener(Listener):
                 self.score_widget.colors = [['#9E9E9E' for _ in range(5)]]
                 self.terminal.update_widget(self.score_widget)
                 self.is_highlighting = False
+
+
+class PerfOverlayListener(Listener):
+    """
+    Shows a debug overlay with performance stats.
+
+    The overlay is toggled by ``toggle_key`` in a ``'key_down'`` event. It is
+    drawn on a high layer over the game and shows FPS, the time of the last
+    tick and the average over the last 100 ticks, the number of events of
+    each type dispatched during the last tick (most frequent first), live
+    entity count, the number of listeners subscribed to the dispatcher and
+    the current states of all AI components.
+
+    This listener should be subscribed to ``['tick', 'key_down']`` before
+    anything else, so that it gets the tick first and can time all its
+    processing. While the overlay is shown, the listener subscribes itself to
+    all other event types to count them; the rest of the time it only checks
+    for the key. Tick time is measured from the ``'tick'`` event to the
+    ``'service'`` event that ends it, so it includes the layout redraw, but
+    not drawing to the terminal. The text is updated every ``update_period``
+    ticks.
+
+    :param dispatcher: BearEventDispatcher instance
+
+    :param terminal: BearTerminal instance
+
+    :param pos: overlay position on the screen
+
+    :param layer: terminal layer for the overlay
+
+    :param toggle_key: bearlibterminal key name
+
+    :param update_period: int. Ticks between text updates.
+    """
+    def __init__(self, dispatcher, terminal, *args, pos=(0, 0), layer=20,
+                 toggle_key='TK_F3', update_period=10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatcher = dispatcher
+        self.terminal = terminal
+        self.pos = pos
+        self.layer = layer
+        self.toggle_key = toggle_key
+        self.update_period = update_period
+        chars = [[' ' for x in range(30)] for y in range(14)]
+        self.widget = Widget(chars, copy_shape(chars, 'white'))
+        screen_chars = copy_shape(chars, '\u2588')
+        self.screen_widget = Widget(screen_chars,
+                                    copy_shape(screen_chars, 'black'))
+        self.currently_showing = False
+        # Event types this listener was subscribed to when showing
+        self.counted_types = []
+        self.frame_times = deque(maxlen=100)
+        self.tick_times = deque(maxlen=100)
+        self.tick_start = None
+        self.event_counts = Counter()
+        self.last_event_counts = Counter()
+        self.ticks_since_update = 0
+
+    def on_event(self, event):
+        if event.event_type == 'key_down' \
+                and event.event_value == self.toggle_key:
+            if self.currently_showing:
+                self.hide_overlay()
+            else:
+                self.show_overlay()
+        if not self.currently_showing:
+            return
+        self.event_counts[event.event_type] += 1
+        if event.event_type == 'tick':
+            self.tick_start = perf_counter()
+            self.frame_times.append(event.event_value)
+        elif event.event_type == 'service' \
+                and event.event_value == 'tick_over' \
+                and self.tick_start is not None:
+            self.tick_times.append(perf_counter() - self.tick_start)
+            self.tick_start = None
+            self.last_event_counts = self.event_counts
+            self.event_counts = Counter()
+            self.ticks_since_update += 1
+            if self.ticks_since_update >= self.update_period:
+                self.ticks_since_update = 0
+                self.update_overlay()
+
+    def show_overlay(self):
+        self.counted_types = [x for x in self.dispatcher.event_types
+                              if x not in ('tick', 'key_down')]
+        self.dispatcher.register_listener(self, self.counted_types)
+        self.terminal.add_widget(self.screen_widget, self.pos,
+                                 layer=self.layer - 1)
+        self.terminal.add_widget(self.widget, self.pos, layer=self.layer)
+        self.currently_showing = True
+        self.frame_times.clear()
+        self.tick_times.clear()
+        self.tick_start = None
+        self.event_counts = Counter()
+        self.ticks_since_update = 0
+
+    def hide_overlay(self):
+        self.dispatcher.unregister_listener(self, self.counted_types)
+        self.terminal.remove_widget(self.widget)
+        self.terminal.remove_widget(self.screen_widget)
+        self.currently_showing = False
+
+    def update_overlay(self):
+        """
+        Redraw the overlay with the current stats
+        """
+        fps = len(self.frame_times) / sum(self.frame_times) \
+            if sum(self.frame_times) else 0
+        average = sum(self.tick_times) / len(self.tick_times)
+        entities = EntityTracker().entities
+        listeners = {id(x) for event_type in self.dispatcher.listeners
+                     for x in self.dispatcher.listeners[event_type]}
+        ai_states = Counter(x.controller.current_state
+                            for x in entities.values()
+                            if 'controller' in x.components
+                            and isinstance(x.controller, AIComponent))
+        lines = [f'FPS {fps:.0f}',
+                 f'Tick {self.tick_times[-1] * 1000:.1f} ms, '
+                 f'avg {average * 1000:.1f} ms',
+                 f'Entities {len(entities)}, listeners {len(listeners)}',
+                 'Events per tick:']
+        lines += [f' {event_type} {count}' for event_type, count
+                  in self.last_event_counts.most_common(5)]
+        lines.append('AI states:')
+        lines += [f' {state} {count}' for state, count
+                  in ai_states.most_common(3)]
+        width = len(self.widget.chars[0])
+        height = len(self.widget.chars)
+        lines = lines[:height] + [''] * (height - len(lines))
+        self.widget.chars = [list(x[:width].ljust(width)) for x in lines]
+        self.terminal.update_widget(self.widget)
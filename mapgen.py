@@ -3,11 +3,17 @@ Map generators
 """
 
 import random
+from base64 import b64encode, b64decode
+from copy import copy
+from json import dumps, loads
 from math import sqrt
+from threading import Thread
+from zlib import compress, decompress
 
 from bear_hug.ecs import EntityTracker, Singleton
 from bear_hug.event import BearEvent, BearEventDispatcher
 
+from components import entity_state
 from entities import EntityFactory
 from listeners import SpawnItem, SpawningListener
 from plot import PlotManager
@@ -36,15 +42,123 @@ def restart(level_manager, factory, dispatcher, loop):
     level_manager.set_level('main_menu')
 
 
+class PreparedLevel:
+    """
+    A level that is generated in a background thread.
+
+    The level is built by a copy of the LevelManager with its own RNG, a
+    staging dispatcher and a detached copy of the factory (see
+    `EntityFactory.detached_copy`). Entities, their subscriptions and events
+    stay there until `EntityFactory.adopt_entities` is called from the main
+    thread. Spawns are collected here instead of the SpawningListener.
+
+    Entity IDs are still taken from the main factory's counters (under a
+    lock), so the prepared level never reuses IDs of the entities created in
+    the game in the meantime.
+
+    The thread is not started on creation: while it runs, it competes with the
+    main thread for the GIL, so LevelSwitchListener starts it on one of the
+    ticks after the level switch is over (see
+    `LevelManager.start_preparation`).
+
+    :param level_manager: LevelManager instance
+    :param level_id: Level identifier
+    :param seed: level seed (see `LevelManager.set_level`)
+    """
+    def __init__(self, level_manager, level_id, seed):
+        self.level_id = level_id
+        self.seed = seed
+        self.dispatcher = BearEventDispatcher()
+        for event_type in level_manager.dispatcher.event_types:
+            if event_type not in self.dispatcher.event_types:
+                self.dispatcher.register_event_type(event_type)
+        self.factory = level_manager.factory.detached_copy(self.dispatcher)
+        self.spawns = []
+        self.player_pos = None
+        self.error = None
+        # Copying bypasses the Singleton metaclass
+        self.level_manager = copy(level_manager)
+        self.level_manager.dispatcher = self.dispatcher
+        self.level_manager.factory = self.factory
+        self.level_manager.spawner = self
+        self.level_manager.random = random.Random()
+        self.level_manager.prepared_levels = {}
+        self.level_manager.pending_rooms = []
+        self.level_manager.dormant_chunks = {}
+        self.level_manager.live_chunk = 0
+        self.thread = Thread(target=self._build, daemon=True)
+
+    def _build(self):
+        try:
+            self.player_pos = self.level_manager._build_level(self.level_id,
+                                                              self.seed)
+        except Exception as e:
+            # set_level will generate the level anew, and fail there if the
+            # error is not a fluke
+            self.error = e
+
+    def add_spawns_iterable(self, spawns):
+        self.spawns.extend(spawns)
+
+    def start(self):
+        """
+        Start generating the level, unless it is already started.
+        """
+        if self.thread.ident is None:
+            self.thread.start()
+
+    def wait(self):
+        """
+        Wait until the level is ready, starting the generation if necessary.
+        :return: True if the level was generated successfully, False otherwise
+        """
+        self.start()
+        self.thread.join()
+        return self.error is None
+
+
 class LevelManager(metaclass=Singleton):
     """
     A class responsible for creating levels.
 
     For each level, it calls all appropriate factory methods to create
     everything except player character
+
+    When a level has a single exit, the level behind it is generated in a
+    background thread as soon as the current one is set (see PreparedLevel),
+    and `set_level` only swaps it in.
+
+    Every level is built from a seed. Layout choices are made by
+    `self.random`, while the factory uses its own streams for entities and
+    backgrounds (see `EntityFactory.seed`); all of them are reseeded from the
+    level seed before the level is built, so the same seed always gives the
+    same level, whether it is built in the background or not. Seeds for levels
+    that are not requested with an explicit seed are drawn from `self.seeds`.
+    Randomness during the gameplay (AI, damage, etc) is not affected.
+
+    Generated levels are made of rooms. If `stream_distance` is set, only the
+    rooms near the player are created when the level is set, and the rest are
+    kept in `self.pending_rooms` until the view approaches them. The parts of
+    the level far behind the view are retired to `self.dormant_chunks` (see
+    `self.update_chunks`, which is called by StreamingListener).
+
+    Levels are 500 chars wide, except for the generated levels that have the
+    width in their ID (see `self.get_level_width`). The layout is resized for
+    every level, so it should be a ChunkedECSLayout.
+
+    Prefab levels (listed in `self.prefabs`) have the same content every time.
+    Once such a level has been visited, a ready-built copy of it is kept in
+    `self.prepared_levels` and rebuilt in the background after every use, so
+    going back to the menu or another prefab never builds it in the switch
+    frame.
+    :param stream_distance: int or None. How far from the view the rooms are
+    created and chunks are retired. If None, levels are created at once and
+    never retired.
+    :param chunk_width: int. Width of the retired chunks.
     """
     def __init__(self, dispatcher, factory, spawner=None, level_switch=None,
-                 player_entity=None):
+                 player_entity=None,
+                 stream_distance=None, chunk_width=100):
         if not isinstance(dispatcher, BearEventDispatcher):
             raise TypeError(f'{type(dispatcher)} used as a dispatcher for LevelManager instead of BearEventDispatcher')
         self.dispatcher = dispatcher
@@ -88,6 +202,28 @@ class LevelManager(metaclass=Singleton):
                        'lab_fight': 'lab_bg'}
         self.styles = {'ghetto', 'dept', 'lab'}
         self.types = {'corridor'}
+        # Levels built only by create_entity calls with fixed arguments.
+        # Prefabs that call generate_level are not listed here
+        self.prefabs = {'main_menu', 'final', 'ghetto_test', 'department',
+                        'boss_leave_it', 'boss_saved', 'boss_failed'}
+        self.random = random.Random()
+        self.seeds = random.Random()
+        self.current_seed = None
+        # Level ID -> PreparedLevel
+        self.prepared_levels = {}
+        if stream_distance is not None and \
+                (not isinstance(stream_distance, int) or stream_distance < 0):
+            raise ValueError('LevelManager stream_distance should be a non-negative int or None')
+        self.stream_distance = stream_distance
+        self.chunk_width = chunk_width
+        # Width of the background tiles in generated levels
+        self.tile_width = 500
+        # (left edge, method name, args) tuples, sorted by left edge
+        self.pending_rooms = []
+        # Chunk index -> compressed JSON list of entity JSON strings
+        self.dormant_chunks = {}
+        # Index of the leftmost chunk that is not dormant
+        self.live_chunk = 0
 
     def should_remove(self, entity):
         """
@@ -117,39 +253,133 @@ class LevelManager(metaclass=Singleton):
     def destroy_current_level(self, destroy_player=False):
         # Remove every entity except self.player_entity
         filter_method = self.should_remove if not destroy_player else lambda x: True
-        for entity in EntityTracker().filter_entities(filter_method):
-            entity.destructor.destroy()
+        self.factory.remove_entities(
+            list(EntityTracker().filter_entities(filter_method)), hide=True)
         # Remove any un-triggered spawns
         self.spawner.remove_spawns()
+        # And the parts of level that are not in the game
+        self.pending_rooms = []
+        self.dormant_chunks = {}
+        self.live_chunk = 0
         # Disable level switch to make sure it doesn't trigger mid-level change
         self.level_switch.disable()
         self.dispatcher.add_event(BearEvent('set_bg_sound', None))
 
-    def set_level(self, level_id):
+    def set_level(self, level_id, seed=None):
         """
         Change level to level_id
 
         Destroys the existing level in the process. Does not affect PC in any
         way except position (which is set to self.starting_positions[level_id]).
 
+        If this level was prepared in the background, the prepared entities are
+        added to the game instead of generating new ones. If the preparation
+        is not finished yet, waits for it.
+
         :param level_id: Level identifier.
+        :param seed: Level seed. If None, a random one is used.
         :return:
         """
+        prepared = self.prepared_levels.pop(level_id, None)
+        if prepared and seed is not None and prepared.seed != seed:
+            prepared = None
+        if prepared:
+            seed = prepared.seed
+        elif seed is None:
+            seed = self.seeds.getrandbits(32)
+        # Levels prepared as the exit of the current one are no longer needed
+        for prepared_id in list(self.prepared_levels):
+            if prepared_id not in self.prefabs:
+                del self.prepared_levels[prepared_id]
         # if current level is set, destroy it
         if self.level_switch.current_level:
             self.destroy_current_level()
-        if level_id in self.methods:
-            getattr(self, self.methods[level_id])()
-            # set player position to whatever it should be
-            player = EntityTracker().entities[self.player_entity]
-            player.position.move(*self.starting_positions[level_id])
+        self.factory.layout.resize_layout(self.get_level_width(level_id))
+        if prepared and prepared.wait():
+            self.factory.adopt_entities(prepared.factory)
+            if prepared.spawns:
+                self.spawner.add_spawns_iterable(prepared.spawns)
+            self.pending_rooms = prepared.level_manager.pending_rooms
+            self.current_seed = seed
+            player_pos = prepared.player_pos
         else:
-            style, level_type = level_id.split('_')
-            player_pos = self.generate_level(style, level_type)
-            player = EntityTracker().entities[self.player_entity]
-            player.position.move(*player_pos)
+            with self.factory.bulk_creation():
+                player_pos = self._build_level(level_id, seed)
+        player = EntityTracker().entities[self.player_entity]
+        player.position.move(*player_pos)
         self.level_switch.current_level = level_id
         self.level_switch.enable()
+        self._prepare_exit()
+        if level_id in self.prefabs:
+            # The copy in use now belongs to the game, build another one
+            self._prepare_level(level_id)
+
+    def _prepare_exit(self):
+        """
+        Prepare the next level if there is only one way to go
+        """
+        next_levels = {x.level_switch.next_level for x in
+                       EntityTracker().filter_entities(
+                           lambda x: hasattr(x, 'level_switch')
+                           and not x.destructor.is_destroying)}
+        if len(next_levels) == 1:
+            self._prepare_level(next_levels.pop())
+
+    def _prepare_level(self, level_id):
+        """
+        Add a PreparedLevel for level_id, unless there already is one
+        """
+        if level_id not in self.prepared_levels:
+            self.prepared_levels[level_id] = PreparedLevel(
+                self, level_id, self.seeds.getrandbits(32))
+
+    def start_preparation(self):
+        """
+        Start generating the next prepared level in the background.
+
+        Does nothing if some level is already being generated, so that only
+        one background thread competes with the game at any time.
+        :return:
+        """
+        waiting = None
+        for prepared in self.prepared_levels.values():
+            if prepared.thread.is_alive():
+                return
+            if not waiting and prepared.thread.ident is None:
+                waiting = prepared
+        if waiting:
+            waiting.start()
+
+    def _build_level(self, level_id, seed):
+        """
+        Create all entities for a level.
+
+        :param level_id: Level identifier.
+        :param seed: Level seed.
+        :return: player position
+        """
+        self.current_seed = seed
+        self.random.seed(f'{seed}/layout')
+        self.factory.seed(seed)
+        if level_id in self.methods:
+            getattr(self, self.methods[level_id])()
+            return self.starting_positions[level_id]
+        style, level_type, *width = level_id.split('_')
+        return self.generate_level(style, level_type,
+                                   width=self.get_level_width(level_id))
+
+    def get_level_width(self, level_id):
+        """
+        Return the width of a level.
+
+        Generated levels may have it as the last part of their ID (eg
+        'ghetto_corridor_10000'). All others are 500 chars wide.
+        :param level_id: Level identifier.
+        :return: int
+        """
+        if level_id not in self.methods and level_id.count('_') == 2:
+            return int(level_id.rsplit('_', 1)[1])
+        return 500
 
     def next_goal_level(self):
         """
@@ -164,36 +394,37 @@ class LevelManager(metaclass=Singleton):
         player = EntityTracker().entities[self.player_entity]
 
     def generate_level(self, style='ghetto', level_type='corridor',
-                       next_level='ghetto_test'):
+                       next_level='ghetto_test', width=500):
         """
         Generate a required type of level
         :param style: str. A location type (ghetto, dept, lab, etc)
         :param level_type: str. A level type (corridor, hostage, etc)
         :param next_level: str. A level ID for the level switch
+        :param width: int. Level width, at least 500
         :return:
         """
         if style not in self.styles:
             raise ValueError(f'Invalid level style "{style}" for levelgen')
         if level_type not in self.types:
             raise ValueError(f'Invalid level type "{level_type}" for levelgen')
+        if not isinstance(width, int) or width < 500:
+            raise ValueError(f'Invalid level width {width} for levelgen')
         player_pos = (20, 20)
-        # Since the ScrollingECSLayout does not support resizing, "smaller"
-        # levels will still need to be 500 chars wide. To simulate less
-        # spacious places, just make a smaller piece surrounded with walls
-        # and/or level exits and leave the rest empty
-
         # Generate style basics: BG and decorations
+        # Long levels get these in tiles, so that they can be streamed
+        self.corridor_tile(0, style, min(self.tile_width, width))
+        for x in range(self.tile_width, width, self.tile_width):
+            self.pending_rooms.append((x, 'corridor_tile',
+                                       (style, min(self.tile_width,
+                                                   width - x))))
         if style == 'ghetto':
-            self.factory.create_entity('ghetto_bg', (0, 0), size=(500, 20))
-            self.factory.create_entity('floor', (0, 20), size=(500, 30))
-            self.factory.create_entity('invis', (0, 51), size=(500, 9))
             # Add some garbage. Each heap contains at least one garbage bag
             # and 2 to 5 other items (possibly including more bags)
             garbage_pos = []
             for _ in range(6):
                 # Make sure garbage heaps are properly spaced
                 while True:
-                    x = random.randint(0, 240)
+                    x = self.random.randint(0, 240)
                     max_dist = len(garbage_pos) > 0 \
                                and max((abs(x - i) for i in garbage_pos)) \
                                or 1000
@@ -201,53 +432,54 @@ class LevelManager(metaclass=Singleton):
                         garbage_pos.append(x)
                         break
                 self.factory.create_entity('garbage_bag', (x, 18))
-                for i in range(random.randint(3, 6)):
-                    t = random.choice(
+                for i in range(self.random.randint(3, 6)):
+                    t = self.random.choice(
                         ('can', 'can2', 'cigarettes', 'garbage_bag',
                          'bucket', 'pizza_box'))
-                    self.factory.create_entity(t, (x + random.randint(-5, 5),
-                                                   22 + random.randint(-2, 2)))
+                    self.factory.create_entity(t, (x + self.random.randint(-5, 5),
+                                                   22 + self.random.randint(-2, 2)))
         elif style == 'dept':
             self.dispatcher.add_event(BearEvent('set_bg_sound', 'supercop_bg'))
-            self.factory.create_entity('dept_bg', (0, 0), size=(500, 20))
-            self.factory.create_entity('floor', (0, 20), size=(500, 30))
-            self.factory.create_entity('invis', (0, 50), size=(500, 9))
             # No garbage or similar stuff on the department floor
-        elif style == 'lab':
-            self.factory.create_entity('lab_bg', (0, 0), size=(500, 20))
-            self.factory.create_entity('floor', (0, 20), size=(500, 30))
-            self.factory.create_entity('invis', (0, 51), size=(500, 9))
         # Placing actual game content
         #
         # The level is decomposed into a bunch of prefab-like "rooms".
         # They may correspond to the rooms (unexpected, huh?), piles of stuff,
         # enemy groups, etc.
+        # Only the room sizes are chosen here; the rooms themselves are
+        # created by `self.generate_rooms`
         if style == 'ghetto' and level_type == 'corridor':
             # In case of the ghetto, "rooms" are just piles of things placed
             # randomly (with some spacing), but with no actual walls
             # First 50 chars are left empty to make sure the player is not
             # dropped right into the middle of the battle
             running_len = 50
-            while running_len < 400:
-                running_len += self.ghetto_room(running_len)
-            # final barricade
-            self.factory.create_entity('barricade_1', (440, 12))
-            self.factory.create_entity('barricade_2', (435, 30))
-            self.factory.create_entity('barricade_3', (425, 40))
-            self.factory.create_entity('bottle_punk', (460, 30))
-            self.factory.create_entity('bottle_punk', (460, 25))
-            self.factory.create_entity('bottle_punk', (465, 10))
-            running_len = 450
+            while width - 100 - running_len >= 55:
+                room_width = self.random.randint(60, min(100, width - 50 -
+                                                         running_len))
+                self.pending_rooms.append((running_len, 'ghetto_room',
+                                           (room_width,)))
+                running_len += room_width
+            self.pending_rooms.append((width - 100, 'ghetto_barricade', ()))
+            running_len = width - 50
         elif style == 'dept' and level_type == 'corridor':
             # In case of the department, the map is made of rooms
             # Each room consists of some stuff and its rightmost wall
             running_len = 0
-            while running_len < 400:
-                running_len += self.dept_room(running_len)
+            while running_len < width - 100:
+                if width - 50 - running_len < 55:
+                    running_len = width - 50
+                    break
+                room_width = self.random.randint(55, min(100, width - 50 -
+                                                         running_len))
+                self.pending_rooms.append((running_len, 'dept_room',
+                                           (room_width,)))
+                running_len += room_width
             # Exit block should contain the level switch and maybe some stuff
         elif style == 'lab' and level_type == 'corridor':
-            # The lab consists of 6 70-char rooms plus the 80-char final zone.
-            # First and last room are prefabs, other 5 are randomly shuffled
+            # The lab consists of 70-char rooms plus the 80-char final zone.
+            # First and last room are prefabs. Others are the 5 room types
+            # randomly shuffled (repeatedly, if the level is long enough)
 
             # Initial room
             player_pos = (5, 20)
@@ -270,21 +502,158 @@ class LevelManager(metaclass=Singleton):
             self.factory.create_entity('spike', (35, 30))
             self.factory.create_entity('spike', (49, 15))
             # Final room - a simple machine to disassemble
-            self.factory.create_entity('spike', (440, 5), powered=True)
-            self.factory.create_entity('spike', (440, 30))
+            self.factory.create_entity('spike', (width - 60, 5),
+                                       powered=True)
+            self.factory.create_entity('spike', (width - 60, 30))
             running_len = 70
-            room_order = [0, 1, 2, 3, 4]
-            random.shuffle(room_order)
-            for room in room_order:
-                # Roomgen code will be here
-                running_len += self.lab_room(running_len, room)
-            running_len = 450
+            room_order = []
+            while running_len + 70 <= width - 80:
+                if not room_order:
+                    room_order = [0, 1, 2, 3, 4]
+                    self.random.shuffle(room_order)
+                self.pending_rooms.append((running_len, 'lab_room',
+                                           (room_order.pop(0),)))
+                running_len += 70
+            running_len = width - 50
         self.factory.create_entity('level_switch', (running_len+1, 20),
-                                   size=(500-running_len - 1, 30),
+                                   size=(width - running_len - 1, 30),
                                    next_level=next_level)
+        self.pending_rooms.sort(key=lambda x: x[0])
+        if self.stream_distance is None:
+            self.generate_rooms()
+        else:
+            self.generate_rooms(player_pos[0] + self.stream_distance)
         # Returns the starting position for the player
         return player_pos
 
+    def generate_rooms(self, right_edge=None):
+        """
+        Create the pending rooms of the current level.
+
+        Each room gets the RNGs reseeded from the level seed and its position,
+        so its contents do not depend on when it is created.
+        :param right_edge: int. Only the rooms that start to the left of it are
+        created. If None, all pending rooms are.
+        :return:
+        """
+        while self.pending_rooms and (right_edge is None or
+                                      self.pending_rooms[0][0] < right_edge):
+            left_edge, method, args = self.pending_rooms.pop(0)
+            self.random.seed(f'{self.current_seed}/{left_edge}')
+            self.factory.seed(f'{self.current_seed}/{left_edge}')
+            with self.factory.bulk_creation():
+                getattr(self, method)(left_edge, *args)
+
+    def update_chunks(self, view_x, view_width):
+        """
+        Generate and retire the parts of the level as the view moves.
+
+        Rooms are created when they come within `self.stream_distance` from
+        the right edge of the view. Chunks (`self.chunk_width` chars wide) that
+        are farther than that behind its left edge are retired: the entities
+        that end in them (along with the hands and items of characters) are
+        destroyed, and their JSON representations are kept compressed in
+        `self.dormant_chunks` until the view returns. Does nothing unless the
+        levels are streamed.
+        :param view_x: int. Left edge of the view
+        :param view_width: int. Width of the view
+        :return:
+        """
+        if self.stream_distance is None:
+            return
+        self.generate_rooms(view_x + view_width + self.stream_distance)
+        # Dormant chunks are always the ones to the left of self.live_chunk.
+        # Chunks are restored closer to the view than they are retired, so
+        # that walking back and forth at the boundary doesn't do it every time
+        while (self.live_chunk + 1) * self.chunk_width <= \
+                view_x - self.stream_distance:
+            self._retire_chunk(self.live_chunk)
+            self.live_chunk += 1
+        while self.live_chunk > 0 and self.live_chunk * self.chunk_width > \
+                view_x - self.stream_distance // 2:
+            self.live_chunk -= 1
+            self._restore_chunk(self.live_chunk)
+
+    def _retire_chunk(self, chunk):
+        left_edge = chunk * self.chunk_width
+        right_edge = left_edge + self.chunk_width
+        tracker = EntityTracker()
+        # Hands and items go with the characters that hold them, wherever
+        # they are
+        holders = {}
+        for entity in tracker.entities.values():
+            if 'hands' in entity.components:
+                for x in (*entity.hands.hand_entities.values(),
+                          entity.hands.left_item, entity.hands.right_item):
+                    holders[x] = entity.id
+            elif 'item_behaviour' in entity.components and \
+                    entity.item_behaviour.owning_entity:
+                owner = entity.item_behaviour.owning_entity
+                holders[entity.id] = owner if isinstance(owner, str) \
+                    else owner.id
+        # Entities wider than a chunk are retired with the chunk they end in
+        entities = []
+        attached = []
+        for entity in tracker.entities.values():
+            if 'position' not in entity.components \
+                    or 'widget' not in entity.components \
+                    or 'level_switch' in entity.components \
+                    or entity.destructor.is_destroying \
+                    or not self.should_remove(entity):
+                continue
+            if entity.id in holders:
+                attached.append(entity)
+            elif left_edge < entity.position.x + entity.widget.width \
+                    <= right_edge:
+                entities.append(entity)
+        retired = {entity.id for entity in entities}
+        entities.extend(entity for entity in attached
+                        if holders[entity.id] in retired)
+        # Most of the JSON is widget chars and colors, which compress well
+        self.dormant_chunks[chunk] = compress(
+            dumps([entity_state(entity) for entity in entities]).encode())
+        # Destructors make particles, sounds etc.; retiring is not supposed to
+        # be noticed
+        self.factory.remove_entities(entities)
+
+    def _restore_chunk(self, chunk):
+        if chunk not in self.dormant_chunks:
+            return
+        data = self.dormant_chunks.pop(chunk)
+        for state in loads(decompress(data).decode()):
+            if isinstance(state, str):
+                # Saved before entity states were stored as dicts
+                self.factory.load_entity_from_JSON(state)
+            else:
+                self.factory.load_entity_from_state(state)
+
+    def get_stream_state(self):
+        """
+        Return the JSON-serializable state of the current streamed level.
+
+        Contains the level seed, the rooms that are not created yet and
+        the dormant chunks.
+        """
+        return {'current_seed': self.current_seed,
+                'pending_rooms': self.pending_rooms,
+                'dormant_chunks': {chunk: b64encode(data).decode('ascii')
+                                   for chunk, data
+                                   in self.dormant_chunks.items()}}
+
+    def set_stream_state(self, state):
+        """
+        Restore the state returned by `self.get_stream_state`.
+
+        Dormant chunks are kept dormant.
+        """
+        self.current_seed = state['current_seed']
+        self.pending_rooms = [(left_edge, method, tuple(args))
+                              for left_edge, method, args
+                              in state['pending_rooms']]
+        self.dormant_chunks = {int(chunk): b64decode(data) for chunk, data
+                               in state['dormant_chunks'].items()}
+        self.live_chunk = max(self.dormant_chunks, default=-1) + 1
+
     def lab_room(self, left_edge, room_type=0):
         """
         Generate a lab room
@@ -309,7 +678,7 @@ class LevelManager(metaclass=Singleton):
             # The player probably already has enough weapons at this point and
             # can easily heal by walking back towards the level start
             self.factory.create_entity('dept_locker', (left_edge - 3, 4))
-            item = random.choice(('bandage', 'emitter', 'pistol'))
+            item = self.random.choice(('bandage', 'emitter', 'pistol'))
             self.factory.create_entity(item, (left_edge + 12, 24))
             self.factory.create_entity('science_table_3', (left_edge + 22, 15))
             self.factory.create_entity('spike', (left_edge + 50, 5))
@@ -318,7 +687,7 @@ class LevelManager(metaclass=Singleton):
             for i in range(4):
                 self.factory.create_entity('science_device_1', (left_edge + 20 * i - 4, 4))
                 self.factory.create_entity('science_device_1', (left_edge + 20 * i - 9, 10))
-                if i < 3 and random.random() < 0.3:
+                if i < 3 and self.random.random() < 0.3:
                     self.factory.create_entity('bandage', (left_edge + 20 * i + 5, 25))
         elif room_type == 4:
             self.factory.create_entity('science_table_4', (left_edge - 6, 12))
@@ -327,20 +696,17 @@ class LevelManager(metaclass=Singleton):
             self.factory.create_entity('scientist_enemy', (left_edge + 16, 18))
         return 70
 
-    def ghetto_room(self, left_edge):
+    def ghetto_room(self, left_edge, room_width):
         """
         Generate a single ghetto room
 
         (which is not actually a room, it is just a piece of street without
         walls which contains a single element)
         :param left_edge:
-        :return:
+        :param room_width:
+        :return: room width
         """
-        # The size of the future room
-        if 400 - left_edge < 55:
-            return 450 - left_edge
-        room_width = random.randint(60, min(100, 450-left_edge))
-        element = random.random()
+        element = self.random.random()
         # TODO: store the room probabilities in a parameter for easy editing
         if element < 0.1:
             # A broken car
@@ -350,84 +716,115 @@ class LevelManager(metaclass=Singleton):
             pass # Empty piece of land
         elif element < 0.7:
             # A simple battle
-            punk_count = random.randint(2, 3)
-            positions = [(random.randint(left_edge + 5,
+            punk_count = self.random.randint(2, 3)
+            positions = [(self.random.randint(left_edge + 5,
                                          left_edge + room_width-5),
-                                random.randint(10, 25))]
+                                self.random.randint(10, 25))]
             for _ in range(punk_count):
                 # Drop the punks at some distance from each other
                 dist = 0
                 while dist < 10:
-                    punk_pos = (random.randint(left_edge + 5,
+                    punk_pos = (self.random.randint(left_edge + 5,
                                                left_edge + room_width - 5),
-                                random.randint(10, 25))
+                                self.random.randint(10, 25))
                     dist = min(sqrt((punk_pos[0] - x[0]) ** 2 +
                                     (punk_pos[1] - x[1]) ** 2)
                                for x in positions)
                 positions.append(punk_pos)
             for punk_pos in positions:
-                self.factory.create_entity(random.choice(('bottle_punk',
+                self.factory.create_entity(self.random.choice(('bottle_punk',
                                                           'nunchaku_punk')),
                                            punk_pos)
-            if random.random() < 0.6:
+            if self.random.random() < 0.6:
                 # Maybe add them a barrel to hang around
                 barrel_pos = (left_edge + room_width // 2, 25)
                 self.factory.create_entity('barrel', barrel_pos)
-                for _ in range(random.randint(1, 3)):
+                for _ in range(self.random.randint(1, 3)):
                     # Sprinkle with some garbage
-                    self.factory.create_entity(random.choice(('can', 'can2',
+                    self.factory.create_entity(self.random.choice(('can', 'can2',
                                                               'cigarettes',
                                                               'garbage_bag',
                                                               'bucket',
                                                               'pizza_box')),
-                                               (barrel_pos[0] + random.randint(-5, 5),
-                                                barrel_pos[1] + 9 + random.randint(-2, 2)))
+                                               (barrel_pos[0] + self.random.randint(-5, 5),
+                                                barrel_pos[1] + 9 + self.random.randint(-2, 2)))
         else:
             # Barricaded stash
-            stash_y = random.choice((16, 37))
-            first = random.choice(('barricade_1', 'barricade_2', 'barricade_3'))
+            stash_y = self.random.choice((16, 37))
+            first = self.random.choice(('barricade_1', 'barricade_2', 'barricade_3'))
             second = first
             while second == first:
-                second = random.choice(('barricade_1', 'barricade_2',
+                second = self.random.choice(('barricade_1', 'barricade_2',
                                         'barricade_3'))
-            first_pos = (left_edge + room_width//2 - random.randint(20, 30),
-                         stash_y + random.randint(-3, 3))
-            second_pos = (first_pos[0] + random.randint(30, 45),
-                          first_pos[1] + random.randint(-3, 3))
+            first_pos = (left_edge + room_width//2 - self.random.randint(20, 30),
+                         stash_y + self.random.randint(-3, 3))
+            second_pos = (first_pos[0] + self.random.randint(30, 45),
+                          first_pos[1] + self.random.randint(-3, 3))
             self.factory.create_entity(first, first_pos)
             self.factory.create_entity(second, second_pos)
             items = ('ammo_pickup', 'bandage', 'nunchaku', 'shiv',
                      'bottle_launcher', 'pistol')
             item_probs = (0.3, 0.3, 0.1, 0.1, 0.1, 0.1)
-            for _ in range(random.randint(3, 5)):
-                roll = random.random()
+            for _ in range(self.random.randint(3, 5)):
+                roll = self.random.random()
                 for i, prob in enumerate(item_probs):
                     roll -= prob
                     if roll <= 0:
                         self.factory.create_entity(items[i],
-                                                   (random.randint(first_pos[0] + 20, second_pos[0] - 5),
-                                                    stash_y + random.randint(5, 10)))
+                                                   (self.random.randint(first_pos[0] + 20, second_pos[0] - 5),
+                                                    stash_y + self.random.randint(5, 10)))
                         break
-            if random.random() < 0.7:
+            if self.random.random() < 0.7:
                 # Most stashes are at least somewhat guarded
-                self.factory.create_entity(random.choice(('bottle_punk',
+                self.factory.create_entity(self.random.choice(('bottle_punk',
                                                          'nunchaku_punk')),
                                            (left_edge + room_width // 2,
-                                            min(stash_y + random.randint(-5, 5), 35)))
+                                            min(stash_y + self.random.randint(-5, 5), 35)))
 
         return room_width
 
-    def dept_room(self, left_edge):
+    def corridor_tile(self, left_edge, style, tile_width):
+        """
+        Generate the background, floor and bottom wall for a part of the level
+
+        :param left_edge:
+        :param style: str. A location type (ghetto, dept, lab, etc)
+        :param tile_width: int
+        :return:
+        """
+        self.factory.create_entity(f'{style}_bg', (left_edge, 0),
+                                   size=(tile_width, 20))
+        self.factory.create_entity('floor', (left_edge, 20),
+                                   size=(tile_width, 30))
+        # Department's bottom wall is one char higher
+        self.factory.create_entity('invis',
+                                   (left_edge, 50 if style == 'dept' else 51),
+                                   size=(tile_width, 9))
+
+    def ghetto_barricade(self, left_edge):
+        """
+        Generate the final barricade of the ghetto corridor
+
+        :param left_edge: 100 chars before the level end
+        :return:
+        """
+        self.factory.create_entity('barricade_1', (left_edge + 40, 12))
+        self.factory.create_entity('barricade_2', (left_edge + 35, 30))
+        self.factory.create_entity('barricade_3', (left_edge + 25, 40))
+        self.factory.create_entity('bottle_punk', (left_edge + 60, 30))
+        self.factory.create_entity('bottle_punk', (left_edge + 60, 25))
+        self.factory.create_entity('bottle_punk', (left_edge + 65, 10))
+
+    def dept_room(self, left_edge, room_width):
         """
         Generate a single department room.
 
+        :param left_edge:
+        :param room_width:
         :return: room width
         """
-        if 450 - left_edge < 55:
-            return 450 - left_edge
-        room_width = random.randint(55, min(100, 450-left_edge))
         # Most obvious: rightmost wall
-        door_style = random.randint(0, 2)
+        door_style = self.random.randint(0, 2)
         if door_style == 0:
             self.factory.create_entity('dept_wall_inner',
                                        (left_edge + room_width - 25,
@@ -450,7 +847,7 @@ class LevelManager(metaclass=Singleton):
                                        (left_edge + room_width - 27,
                                         12))
         # Populating the room
-        room_type = random.randint(0, 2)
+        room_type = self.random.randint(0, 2)
         # room_type = 0
         if room_type == 0:
             # office:
@@ -460,14 +857,15 @@ class LevelManager(metaclass=Singleton):
             tables = int(room_width/40)
             for table_column in range(tables):
                 for table_row in range(2):
-                    if random.random() < 0.25:
+                    if self.random.random() < 0.25:
                         continue
                     self.factory.create_entity('dept_chair_1', (left_edge + table_column * 40 + 3 - 20 * table_row,
                                                                 13 + 15 * table_row))
                     self.factory.create_entity('dept_table_1', (left_edge + 40 * table_column + 6 - 20 * table_row,
                                                                 10 + 15 * table_row))
-                    if random.random() < 0.3:
-                        monologue=PlotManager().get_peaceful_phrase('cops')
+                    if self.random.random() < 0.3:
+                        monologue=PlotManager().get_peaceful_phrase(
+                            'cops', rng=self.random)
                         self.factory.create_entity('cop_npc',
                                                    (left_edge + 40 * table_column + 3 - 20 * table_row,
                                                    5 + 20 * table_row),
@@ -479,7 +877,7 @@ class LevelManager(metaclass=Singleton):
             used_space = 10
             # Upper wall
             while used_space < room_width - 30:
-                element = random.random()
+                element = self.random.random()
                 if element < 0.3:
                     # A punchbag and some space
                     self.factory.create_entity('punchbag',
@@ -495,7 +893,7 @@ class LevelManager(metaclass=Singleton):
                     used_space += 20
                 else:
                     used_space += 10
-                if random.random() < 0.4:
+                if self.random.random() < 0.4:
                     # Bottom benches are placed regardless of top wall contents
                     self.factory.create_entity('dept_bench',
                                                (left_edge + used_space - 30,
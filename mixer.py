@@ -0,0 +1,498 @@
+"""
+Software sound mixer.
+
+bear_hug's SoundListener starts a separate simpleaudio playback for every
+`play_sound` event, so a big fight keeps dozens of OS-level voices busy. Here
+all active voices are summed by `Mixer` into a single stereo stream, which is
+produced in fixed-size blocks and passed to an output backend.
+
+The number of voices is limited. Every sound has a priority and a cooldown:
+a sound is not restarted until its cooldown has passed, and when all voices
+are busy, a new sound replaces (steals) the active voice with the lowest
+priority, unless that one is more important than the new sound.
+
+There are two backends: `SimpleaudioBackend` plays the stream, and
+`NullBackend` discards it, which is useful for benchmarks and for running
+the game without sound.
+"""
+
+from collections import Counter
+from threading import Lock, Thread
+from time import perf_counter, sleep
+import wave
+
+import numpy as np
+
+from bear_hug.bear_utilities import BearSoundException
+from bear_hug.ecs import EntityTracker, Singleton
+from bear_hug.widgets import Listener
+
+try:
+    import simpleaudio
+except ImportError:
+    simpleaudio = None
+
+
+def load_wave(file_name, rate=44100):
+    """
+    Load a 16-bit mono or stereo .wav file for the mixer.
+
+    There is no resampling, so the file should have the same sample rate as
+    the mixer.
+    :param file_name: path to a .wav file
+    :param rate: int. Expected sample rate.
+    :return: float32 array of shape (frames, channels) with values from -1 to 1
+    """
+    with wave.open(file_name, 'rb') as wave_file:
+        if wave_file.getsampwidth() != 2:
+            raise BearSoundException(f'{file_name} is not a 16-bit .wav file')
+        if wave_file.getnchannels() not in (1, 2):
+            raise BearSoundException(f'{file_name} is neither mono nor stereo')
+        if wave_file.getframerate() != rate:
+            raise BearSoundException(f'{file_name} has sample rate {wave_file.getframerate()}, expected {rate}')
+        samples = np.frombuffer(wave_file.readframes(wave_file.getnframes()),
+                                dtype='<i2')
+        samples = samples.reshape(-1, wave_file.getnchannels())
+    return samples.astype(np.float32) / 32768
+
+
+class Voice:
+    """
+    A single sound being played by the Mixer.
+
+    Not intended to be created directly; `Mixer.play` returns these.
+    """
+
+    __slots__ = ('sound_name', 'samples', 'position', 'gain', 'priority',
+                 'loop', 'start')
+
+    def __init__(self, sound_name, samples, gain, priority, loop, start):
+        self.sound_name = sound_name
+        self.samples = samples
+        self.position = 0
+        # Left and right channel volume
+        self.gain = gain
+        self.priority = priority
+        self.loop = loop
+        # Mixer time when the voice was started
+        self.start = start
+
+    @property
+    def is_playing(self):
+        return self.loop or self.position < len(self.samples)
+
+
+class Mixer:
+    """
+    Mixes the active voices into a stereo stream of int16 blocks.
+
+    Voices can be started (`play`) from any thread, while the blocks are
+    requested (`mix`) by the output thread. The mixer keeps several counters
+    of the sounds that were not played as requested: ``played``,
+    ``cooled_down`` (requests skipped because of the cooldown), ``stolen``
+    (voices stopped to make room for another sound) and ``dropped``
+    (requests skipped because all voices were busy with more important
+    sounds).
+
+    :param rate: int. Sample rate.
+
+    :param block_size: int. Number of frames in a block.
+
+    :param max_voices: int. Maximum number of sounds played at once.
+
+    :param volume: float. Master volume, from 0 to 1.
+    """
+    def __init__(self, rate=44100, block_size=512, max_voices=16, volume=1.0):
+        if block_size <= 0:
+            raise ValueError('Mixer block size should be positive')
+        if max_voices <= 0:
+            raise ValueError('Mixer should have at least one voice')
+        self.rate = rate
+        self.block_size = block_size
+        self.max_voices = max_voices
+        self.volume = volume
+        # Sound name -> (samples, priority, cooldown in frames)
+        self.sounds = {}
+        self.voices = []
+        # Sound name -> mixer time when it was last started
+        self.last_started = {}
+        # Number of frames mixed so far
+        self.time = 0
+        self.lock = Lock()
+        self.buffer = np.zeros((block_size, 2), dtype=np.float32)
+        self.played = 0
+        self.cooled_down = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    def register_sound(self, sound_name, samples, priority=0, cooldown=0.0):
+        """
+        Register a sound.
+
+        :param sound_name: str. Sound ID.
+
+        :param samples: an array from `load_wave` or a path to a .wav file.
+
+        :param priority: number. Sounds with higher priority can steal voices
+        from the ones with lower or equal priority.
+
+        :param cooldown: float. Minimum time, in seconds, between two starts of
+        this sound.
+        """
+        if isinstance(samples, str):
+            samples = load_wave(samples, self.rate)
+        elif not isinstance(samples, np.ndarray) or samples.ndim != 2 \
+                or samples.shape[1] not in (1, 2):
+            raise BearSoundException('Sound should be either a (frames, channels) array or a path')
+        if not len(samples):
+            raise BearSoundException(f'Sound {sound_name} is empty')
+        self.sounds[sound_name] = (samples, priority,
+                                   round(cooldown * self.rate))
+
+    def play(self, sound_name, volume=1.0, pan=0.0, priority=None,
+             loop=False):
+        """
+        Start playing a sound.
+
+        :param sound_name: str. A registered sound ID.
+
+        :param volume: float. Volume, from 0 to 1.
+
+        :param pan: float. -1 is left, 0 is center, 1 is right.
+
+        :param priority: number or None. If set, it is used instead of the
+        priority the sound was registered with.
+
+        :param loop: bool. If True, the sound is repeated until it is stopped.
+
+        :return: a Voice, or None if the sound was not started.
+        """
+        try:
+            samples, default_priority, cooldown = self.sounds[sound_name]
+        except KeyError:
+            raise BearSoundException(f'Nonexistent sound {sound_name} requested')
+        if priority is None:
+            priority = default_priority
+        gain = np.array((volume * min(1.0, 1.0 - pan),
+                         volume * min(1.0, 1.0 + pan)), dtype=np.float32)
+        with self.lock:
+            if sound_name in self.last_started and \
+                    self.time - self.last_started[sound_name] < cooldown:
+                self.cooled_down += 1
+                return None
+            if len(self.voices) >= self.max_voices:
+                # The least important voice; of those, the one that has been
+                # playing for the longest time
+                victim = min(self.voices, key=lambda x: (x.priority, x.start))
+                if victim.priority > priority:
+                    self.dropped += 1
+                    return None
+                self.voices.remove(victim)
+                self.stolen += 1
+            voice = Voice(sound_name, samples, gain, priority, loop, self.time)
+            self.voices.append(voice)
+            self.last_started[sound_name] = self.time
+            self.played += 1
+        return voice
+
+    def stop(self, voice):
+        """
+        Stop a voice. Does nothing if it has already stopped.
+        :param voice: a Voice returned by `play`
+        """
+        with self.lock:
+            if voice in self.voices:
+                self.voices.remove(voice)
+
+    def stop_all(self):
+        with self.lock:
+            self.voices = []
+
+    def mix(self):
+        """
+        Mix the next block.
+        :return: int16 array of shape (block_size, 2)
+        """
+        buffer = self.buffer
+        buffer.fill(0)
+        with self.lock:
+            for voice in self.voices:
+                filled = 0
+                while filled < self.block_size:
+                    chunk = voice.samples[voice.position:
+                                          voice.position + self.block_size - filled]
+                    buffer[filled:filled + len(chunk)] += chunk * voice.gain
+                    filled += len(chunk)
+                    voice.position += len(chunk)
+                    if voice.position < len(voice.samples):
+                        break
+                    if not voice.loop:
+                        break
+                    voice.position = 0
+            self.voices = [x for x in self.voices if x.is_playing]
+            self.time += self.block_size
+        if self.volume != 1.0:
+            buffer *= self.volume
+        np.clip(buffer, -1.0, 1.0, out=buffer)
+        return (buffer * 32767).astype(np.int16)
+
+
+class NullBackend:
+    """
+    An output backend that discards the stream.
+
+    It is not real-time, so MixerListener mixes the blocks on ticks instead of
+    a separate thread.
+    """
+    realtime = False
+
+    def __init__(self):
+        self.blocks = 0
+
+    def write(self, block):
+        self.blocks += 1
+
+    def close(self):
+        pass
+
+
+class SimpleaudioBackend:
+    """
+    An output backend that plays the stream with simpleaudio.
+
+    simpleaudio cannot append to a playing buffer, so the blocks are collected
+    into buffers of `buffer_blocks` blocks. The next buffer is mixed while the
+    current one plays, and started when the current one runs out. `write`
+    blocks until then, which paces the mixing thread. The end of the playing
+    buffer is computed from its length: `PlayObject.wait_done()` only checks
+    every 50 ms, longer than a default buffer lasts, so waiting on it left
+    audible gaps between the buffers.
+    :param rate: int. Sample rate.
+    :param buffer_blocks: int. Number of blocks in a single playback buffer.
+    """
+    realtime = True
+
+    def __init__(self, rate=44100, buffer_blocks=4):
+        if simpleaudio is None:
+            raise BearSoundException('simpleaudio is required for sound output')
+        self.rate = rate
+        self.buffer_blocks = buffer_blocks
+        self.blocks = []
+        self.play_object = None
+        # perf_counter() time when the playing buffer runs out
+        self.end_time = 0
+
+    def write(self, block):
+        self.blocks.append(block)
+        if len(self.blocks) < self.buffer_blocks:
+            return
+        data = np.concatenate(self.blocks)
+        self.blocks = []
+        delay = self.end_time - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        self.play_object = simpleaudio.play_buffer(data, 2, 2, self.rate)
+        self.end_time = max(self.end_time, perf_counter()) + \
+            len(data) / self.rate
+
+    def close(self):
+        if self.play_object:
+            self.play_object.stop()
+            self.play_object = None
+
+
+class MixerListener(Listener, metaclass=Singleton):
+    """
+    Plays sounds through a Mixer.
+
+    Accepts the same events as bear_hug's SoundListener:
+
+    `BearEvent(event_type='play_sound', event_value=sound_name)`
+
+    `BearEvent(event_type='set_bg_sound', event_value=sound_name or None)`
+
+    and should be subscribed to 'tick' as well. The background sound is looped
+    with the highest priority, so it is never stolen.
+
+    A 'play_sound' event value can also be a ``(sound_name, source)`` tuple,
+    where source is either an entity ID or an ``(x, y)`` position on the
+    layout. If the listener has a layout, sounds from the sources further than
+    `cull_margin` chars outside the visible area are not played, and the rest
+    get quieter and panned to the side with the distance from the view centre.
+    Skipped sounds are counted in ``culled``, a Counter of sound names. A
+    source entity that doesn't exist (anymore) is played as if it were in the
+    centre.
+
+    With a real-time backend, the stream is mixed and written by a daemon
+    thread. Otherwise, the blocks are mixed on 'tick' events to match the
+    elapsed time.
+
+    :param sounds: a dict of ``{'sound_id': path or array from load_wave}``
+
+    :param backend: an output backend. If None, a SimpleaudioBackend is used.
+
+    :param sound_settings: a dict of ``{'sound_id': (priority, cooldown)}``.
+    Sounds that are not listed get priority 0 and no cooldown.
+
+    :param layout: a ScrollableECSLayout whose visible area is used to place
+    the sources. If None, sources are ignored.
+
+    :param cull_margin: int. How far outside the visible area, in chars, the
+    sources are still heard.
+
+    :param attenuation: float. How much quieter, from 0 to 1, the sounds are at
+    `cull_margin` from the visible area, compared to the view centre.
+
+    :param max_pan: float. Pan at `cull_margin` from the visible area, from 0
+    (no panning) to 1 (only one channel).
+
+    :param mixer_kwargs: passed to the Mixer
+    """
+    def __init__(self, sounds, backend=None, sound_settings=None,
+                 layout=None, cull_margin=20, attenuation=0.5, max_pan=0.6,
+                 **mixer_kwargs):
+        if not isinstance(sounds, dict):
+            raise BearSoundException(
+                'Only a dict accepted at MixerListener creation')
+        if any((not isinstance(x, str) for x in sounds)):
+            raise BearSoundException('Only strings accepted as sound IDs')
+        self.mixer = Mixer(**mixer_kwargs)
+        self.sound_settings = sound_settings or {}
+        for sound_name in sounds:
+            self.register_sound(sounds[sound_name], sound_name)
+        self.backend = backend or SimpleaudioBackend(rate=self.mixer.rate)
+        self.layout = layout
+        self.cull_margin = cull_margin
+        self.attenuation = attenuation
+        self.max_pan = max_pan
+        self.culled = Counter()
+        self.bg_sound = None
+        self.bg_voice = None
+        self.is_on = True
+        # Frames that should have been mixed by now, but weren't, when mixing
+        # on ticks
+        self.lag = 0.0
+        self.thread = None
+        self.running = False
+        if self.backend.realtime:
+            self.running = True
+            self.thread = Thread(target=self._output, daemon=True)
+            self.thread.start()
+
+    def _output(self):
+        while self.running:
+            self.backend.write(self.mixer.mix())
+
+    def close(self):
+        """
+        Stop the output thread and close the backend.
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.backend.close()
+
+    def register_sound(self, sound, sound_name):
+        """
+        Register a new sound for this listener
+
+        :param sound: str or array. A path to a .wav file or an array from `load_wave`.
+
+        :param sound_name: name of this sound.
+        """
+        if sound_name in self.mixer.sounds:
+            raise BearSoundException(f'Duplicate sound name "{sound_name}"')
+        priority, cooldown = self.sound_settings.get(sound_name, (0, 0.0))
+        self.mixer.register_sound(sound_name, sound,
+                                  priority=priority, cooldown=cooldown)
+
+    def place(self, source):
+        """
+        Get the volume and pan for a sound source.
+
+        :param source: entity ID or (x, y) tuple
+
+        :return: (volume, pan) tuple, or None if the source is too far from
+        the visible area.
+        """
+        if isinstance(source, str):
+            try:
+                entity = EntityTracker().entities[source]
+                x = entity.position.x
+                y = entity.position.y
+            except (KeyError, AttributeError):
+                return 1.0, 0.0
+            if hasattr(entity, 'widget'):
+                x += entity.widget.width / 2
+                y += entity.widget.height / 2
+        else:
+            x, y = source
+        half_width = self.layout.view_size[0] / 2 + self.cull_margin
+        half_height = self.layout.view_size[1] / 2 + self.cull_margin
+        dx = x - self.layout.view_pos[0] - self.layout.view_size[0] / 2
+        dy = y - self.layout.view_pos[1] - self.layout.view_size[1] / 2
+        distance = max(abs(dx) / half_width, abs(dy) / half_height)
+        if distance > 1:
+            return None
+        return 1 - self.attenuation * distance, self.max_pan * dx / half_width
+
+    def play_sound(self, sound_name, source=None, **kwargs):
+        """
+        Play a sound.
+
+        In case you need to play the sound without requesting it through the
+        event.
+
+        :param sound_name: A sound to play.
+
+        :param source: entity ID, (x, y) tuple or None. Where the sound comes
+        from.
+
+        :param kwargs: passed to `Mixer.play`
+
+        :return: a Voice, or None if the sound was not started.
+        """
+        if sound_name not in self.mixer.sounds:
+            raise BearSoundException(
+                f'Nonexistent sound {sound_name} requested')
+        if not self.is_on:
+            return None
+        if source is not None and self.layout:
+            placement = self.place(source)
+            if placement is None:
+                self.culled[sound_name] += 1
+                return None
+            kwargs['volume'] = kwargs.get('volume', 1.0) * placement[0]
+            kwargs['pan'] = placement[1]
+        return self.mixer.play(sound_name, **kwargs)
+
+    def turn_on(self):
+        self.is_on = True
+
+    def turn_off(self):
+        self.is_on = False
+        self.bg_voice = None
+        self.mixer.stop_all()
+
+    def on_event(self, event):
+        if event.event_type == 'play_sound':
+            if isinstance(event.event_value, str):
+                self.play_sound(event.event_value)
+            else:
+                self.play_sound(*event.event_value)
+        elif event.event_type == 'set_bg_sound':
+            if self.bg_voice:
+                self.mixer.stop(self.bg_voice)
+                self.bg_voice = None
+            self.bg_sound = event.event_value or None
+        elif event.event_type == 'tick':
+            if self.bg_sound and not self.bg_voice:
+                self.bg_voice = self.play_sound(self.bg_sound,
+                                                priority=float('inf'),
+                                                loop=True)
+            if not self.backend.realtime:
+                self.lag += event.event_value * self.mixer.rate
+                while self.lag >= self.mixer.block_size:
+                    self.backend.write(self.mixer.mix())
+                    self.lag -= self.mixer.block_size
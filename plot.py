@@ -111,15 +111,16 @@ class PlotManager(metaclass=Singleton):
             self.current_goal = self.goals[next_goal]
             self.current_goal.current_stage = 0
 
-    def get_peaceful_phrase(self, faction='cops'):
+    def get_peaceful_phrase(self, faction='cops', rng=random):
         """
         Return a plot-appropriate monologue for a peaceful NPC of a given
         faction.
+        :param rng: random.Random instance or the random module
         :return:
         """
         if faction not in self.general_phrases:
             raise ValueError(f'Requested a phrase for a nonexistent faction "{faction}"')
-        return random.choice(self.general_phrases[faction])
+        return rng.choice(self.general_phrases[faction])
 
     def get_next_level(self):
         """
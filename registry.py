@@ -0,0 +1,127 @@
+"""
+Class registries for deserialization.
+
+bear_hug deserializers find the class for a saved object by looking up its
+name in the globals of every frame on the interpreter stack, which takes most
+of the time spent loading a game. Here the classes are looked up by name in a
+dict of the subclasses of a given base.
+
+A registry collects all the subclasses of its base, wherever they are
+defined, so there is no need to register classes by hand: whenever a name is
+missing, the registry looks through the subclasses again to pick up any
+classes defined since.
+"""
+
+import builtins
+from inspect import signature, Parameter
+
+from bear_hug.bear_utilities import BearJSONException
+
+
+class ClassRegistry:
+    """
+    Maps class names to the subclasses of a base class.
+
+    Also caches the kwargs that each class accepts, so that the saved data
+    can be checked before the object is created.
+    :param base: the base class. It is registered as well.
+    """
+    def __init__(self, base):
+        self.base = base
+        self.classes = {}
+        # Class -> set of accepted kwarg names
+        self.kwargs = {}
+        self.update()
+
+    def update(self):
+        """
+        Register the base class and all of its subclasses.
+        """
+        classes = {self.base.__name__: self.base}
+        unchecked = [self.base]
+        while unchecked:
+            for cls in unchecked.pop().__subclasses__():
+                if cls.__name__ not in classes:
+                    classes[cls.__name__] = cls
+                    unchecked.append(cls)
+        self.classes = classes
+
+    def get(self, name):
+        """
+        Return a class by name.
+        :param name: class name
+        :return: a subclass of the registry base
+        """
+        try:
+            return self.classes[name]
+        except KeyError:
+            self.update()
+        if name not in self.classes:
+            raise BearJSONException(f'{name} is not a subclass of {self.base.__name__}')
+        return self.classes[name]
+
+    def accepted_kwargs(self, cls):
+        """
+        Return the names of kwargs that the constructor of a class accepts.
+
+        The constructors that pass their **kwargs to the parent class are
+        followed through the MRO.
+        :param cls: class
+        :return: a set of names
+        """
+        try:
+            return self.kwargs[cls]
+        except KeyError:
+            pass
+        names = set()
+        for parent in cls.__mro__:
+            if parent is object:
+                break
+            if '__init__' not in parent.__dict__:
+                continue
+            passes_kwargs = False
+            for parameter in signature(parent.__init__).parameters.values():
+                if parameter.kind == Parameter.VAR_KEYWORD:
+                    passes_kwargs = True
+                elif parameter.kind in (Parameter.POSITIONAL_OR_KEYWORD,
+                                        Parameter.KEYWORD_ONLY):
+                    names.add(parameter.name)
+            if not passes_kwargs:
+                break
+        self.kwargs[cls] = names
+        return names
+
+    def check_kwargs(self, cls, kwargs):
+        """
+        Raise BearJSONException if a class does not accept some of the kwargs.
+        :param cls: class
+        :param kwargs: dict or other iterable of kwarg names
+        """
+        names = self.accepted_kwargs(cls)
+        unknown = [x for x in kwargs if x not in names]
+        if unknown:
+            raise BearJSONException(f'{cls.__name__} does not accept {", ".join(unknown)}')
+
+
+def split_converters(d):
+    """
+    Separate saved values from their converters.
+
+    As in bear_hug, a ``<key>_type`` entry holds the name of a builtin that
+    converts the value of ``<key>``. Unlike bear_hug, keys that merely end
+    with ``_type`` (eg ``on_event_type`` of a SwitchComponent) are kept
+    as values when there is no ``<key>`` for them.
+    :param d: a dict with a saved object
+    :return: a tuple of (dict of values, dict of {key: converter})
+    """
+    values = {}
+    converters = {}
+    for key, value in d.items():
+        if key.endswith('_type') and key[:-5] in d:
+            try:
+                converters[key[:-5]] = getattr(builtins, value)
+            except AttributeError:
+                raise BearJSONException(f'Converter {value} for {key[:-5]} is not a builtin')
+        else:
+            values[key] = value
+    return values, converters
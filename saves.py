@@ -0,0 +1,208 @@
+"""
+Binary save files.
+
+A save file starts with a short header (magic bytes, format version and
+flags) followed by a stream of records. Each record is a type byte, a payload
+length and a payload. Entity and metadata records hold compact UTF-8 JSON.
+String records hold a single string that is referenced from the later
+records by its number.
+
+Image rows, animations and other long strings are written once as string
+records. Entities that use them refer to them as ``{"__asset__": n}`` (for a
+single string) or ``{"__asset__": [n, m, ...]}`` (for a list of strings, such
+as the widget chars or colors). A level full of identical walls or spikes
+thus stores its images only once.
+
+If the compression flag is set, everything after the header is a single zlib
+stream.
+
+Autosaves (see `listeners.AutosaveListener`) are written as a full save and
+a series of deltas, each of which is a save file of its own. A delta has the
+metadata, the states of the entities that changed and a single record with
+the IDs of the removed entities. Metadata of both carries a ``chain`` ID, so
+that the deltas left from a different autosave are not applied, and deltas
+have a ``delta`` number as well.
+"""
+
+from json import dumps, JSONDecoder
+from struct import Struct
+from zlib import compressobj, decompressobj
+
+
+MAGIC = b'BRUT'
+VERSION = 1
+# Header flags
+COMPRESSED = 1
+
+# Record types
+STRING_RECORD = 1
+ENTITY_RECORD = 2
+META_RECORD = 3
+REMOVED_RECORD = 4
+
+_header = Struct('<4sBB')
+_record_header = Struct('<BI')
+
+# Strings and lists of strings shorter than that are written inline
+MIN_ASSET_LENGTH = 32
+
+
+def delta_file_name(file_name, number):
+    """
+    Return the path of an autosave delta.
+    :param file_name: path of the full autosave
+    :param number: int. Delta number, starting from 1
+    :return: str
+    """
+    return f'{file_name}.{number}'
+
+
+def is_binary_save(save_file):
+    """
+    Check if a file is a binary save.
+
+    The file position is restored afterwards.
+    :param save_file: a file object opened in binary mode
+    :return: bool
+    """
+    position = save_file.tell()
+    magic = save_file.read(len(MAGIC))
+    save_file.seek(position)
+    return magic == MAGIC
+
+
+class SaveWriter:
+    """
+    Writes records to a binary save file.
+
+    Can be used as a context manager, which finishes the file on exit. The
+    file object itself is not closed.
+    :param save_file: a writable file object opened in binary mode
+    :param compress: bool. If True, records are zlib-compressed.
+    :param compression_level: int. zlib compression level, from 1 to 9.
+    """
+    def __init__(self, save_file, compress=True, compression_level=6):
+        self.save_file = save_file
+        self.compressor = compressobj(compression_level) if compress else None
+        self.strings = {}
+        # Strings that were numbered while packing the current record, but
+        # not written yet
+        self.new_strings = []
+        self.save_file.write(_header.pack(MAGIC, VERSION,
+                                          COMPRESSED if compress else 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _intern(self, string):
+        try:
+            return self.strings[string]
+        except KeyError:
+            n = len(self.strings)
+            self.strings[string] = n
+            self.new_strings.append(string)
+            return n
+
+    def _pack(self, value):
+        """
+        Return a copy of value with the long strings replaced by references
+        """
+        if isinstance(value, dict):
+            return {k: self._pack(v) for k, v in value.items()}
+        elif isinstance(value, (list, tuple)):
+            if value and all(isinstance(x, str) for x in value) \
+                    and sum(len(x) for x in value) >= MIN_ASSET_LENGTH:
+                return {'__asset__': [self._intern(x) for x in value]}
+            return [self._pack(x) for x in value]
+        elif isinstance(value, str) and len(value) >= MIN_ASSET_LENGTH:
+            return {'__asset__': self._intern(value)}
+        return value
+
+    def _write(self, data):
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self.save_file.write(data)
+
+    def write_record(self, record_type, value):
+        """
+        Write a single record.
+
+        Any new strings it refers to are written before it.
+        :param record_type: ENTITY_RECORD, META_RECORD or REMOVED_RECORD
+        :param value: a JSON-serializable value
+        """
+        payload = dumps(self._pack(value), ensure_ascii=False,
+                        separators=(',', ':')).encode()
+        chunks = []
+        for string in self.new_strings:
+            encoded = string.encode()
+            chunks.append(_record_header.pack(STRING_RECORD, len(encoded)))
+            chunks.append(encoded)
+        self.new_strings = []
+        chunks.append(_record_header.pack(record_type, len(payload)))
+        chunks.append(payload)
+        self._write(b''.join(chunks))
+
+    def close(self):
+        if self.compressor:
+            self.save_file.write(self.compressor.flush())
+            self.compressor = None
+
+
+def read_records(save_file, chunk_size=65536):
+    """
+    Read records from a binary save file.
+
+    The file is read in chunks of ``chunk_size`` bytes, and every record is
+    yielded as soon as it is read. String records are consumed by the reader,
+    and string references in other records are replaced by their values.
+    :param save_file: a file object opened in binary mode
+    :param chunk_size: int. Number of bytes to read at once.
+    :yields: (record_type, value) tuples
+    """
+    magic, version, flags = _header.unpack(save_file.read(_header.size))
+    if magic != MAGIC:
+        raise ValueError(f'{save_file} is not a binary save file')
+    if version > VERSION:
+        raise ValueError(f'Save file version {version} is not supported')
+    decompressor = decompressobj() if flags & COMPRESSED else None
+    strings = []
+
+    def resolve(d):
+        if len(d) == 1 and '__asset__' in d:
+            ref = d['__asset__']
+            if isinstance(ref, list):
+                return [strings[x] for x in ref]
+            return strings[ref]
+        return d
+
+    decode = JSONDecoder(object_hook=resolve).decode
+    buffer = bytearray()
+    eof = False
+    while not eof:
+        chunk = save_file.read(chunk_size)
+        eof = not chunk
+        if decompressor:
+            chunk = decompressor.flush() if eof \
+                else decompressor.decompress(chunk)
+        buffer += chunk
+        position = 0
+        while len(buffer) - position >= _record_header.size:
+            record_type, length = _record_header.unpack_from(buffer, position)
+            start = position + _record_header.size
+            if len(buffer) - start < length:
+                break
+            payload = buffer[start:start + length].decode()
+            position = start + length
+            if record_type == STRING_RECORD:
+                strings.append(payload)
+            else:
+                yield record_type, decode(payload)
+        del buffer[:position]
+    if buffer:
+        raise ValueError(f'{save_file} ends with an incomplete record')
+    if decompressor and not decompressor.eof:
+        raise ValueError(f'{save_file} ends with an incomplete zlib stream')
@@ -0,0 +1,82 @@
+"""
+Tables shared by game.py, headless.py and benchmarks.py.
+"""
+
+# Game-specific event types. Expected values for each type shown in comments
+event_types = (
+    # Emitted by the main menu level generator
+    'brut_remove_splash', # Value ignored
+    # Level teardown
+    'brut_remove_entities', # list of Entities
+    # Combat system
+    'brut_damage', # EntityID, value (int)
+    'brut_heal', # EntityID, value (int)
+    # Item manipulations
+    'brut_use_item', # Entity ID of used item
+    'brut_use_hand', #hand entity ID
+    'brut_pick_up', # owner entity ID, which hand (left or right), picked up entity ID
+    'brut_change_ammo', # Item entity ID, new ammo value
+    'brut_score', # Value (add to score)
+    'brut_reset_score', # Value (set score to)
+    # View operations
+    'brut_focus',  # See listeners.ScrollListener
+    'brut_temporary_focus', # Entity ID
+    # Service
+    'brut_open_menu', # Value ignored
+    'brut_close_menu', # Value ignored
+    'brut_show_items', # Value ignored
+    'brut_save_game', # Path to savefile
+    'brut_load_game', # Path to savefile
+    'brut_save_done', # Path to savefile
+    'brut_save_failed', # Path to savefile, error message
+    'brut_change_config') # Config key and new value
+
+# Sound names and their files in the sounds/ directory
+sound_files = {'step': 'step.wav',
+               'shot': 'shot.wav',
+               'fist': 'fist.wav',
+               'shiv': 'shiv.wav',
+               'emitter': 'emitter.wav',
+               'punch': 'punch.wav',
+               'spark': 'spark.wav',
+               'nunchaku': 'nunchaku_wave.wav',
+               'reload': 'pistol_reload.wav',
+               'pistol_empty': 'pistol_trigger.wav',
+               'molotov_break': 'molotov_brake.wav',
+               'molotov_fire': 'molotov_fire.wav',
+               'molotov_throw': 'molotov_throw.wav',
+               'balloon': 'balloon.wav',
+               'blue_machine': 'blue_machine.wav',
+               'coin': 'coin.wav',
+               'coin_drop': 'coin_drop.wav',
+               'drive': 'drive.wav',
+               'supercop_bg': 'supercop.wav',
+               'ghetto_walk_bg': 'ghetto_walk.wav',
+               'punk_bg': 'punk_bg.wav',
+               'lab_bg': 'laboratory.wav',
+               'punk_hit': 'punk_hey.wav',
+               'punk_death': 'punk_ho.wav',
+               'cop_hit': 'cop_dmg.wav',
+               'cop_death': 'cop_death.wav',
+               'male_dmg': 'male_dmg.wav',
+               'female_dmg': 'fem_dmg.wav',
+               'male_death': 'male_death.wav',
+               'female_death': 'fem_death.wav',
+               'male_phrase_1': 'male_phrase_1.wav',
+               'male_phrase_2': 'male_phrase_2.wav',
+               'male_phrase_3': 'male_phrase_3.wav',
+               'male_phrase_4': 'male_phrase_4.wav',
+               'male_phrase_5': 'male_phrase_5.wav',
+               'female_phrase_1': 'f_scientist_1.wav',
+               'female_phrase_2': 'f_scientist_2.wav',
+               'female_phrase_3': 'f_scientist_3.wav',
+               'female_phrase_4': 'f_scientist_4.wav',
+               'female_phrase_5': 'f_scientist_5.wav',
+               'bandage': 'bandage.wav',
+               'target_hit': 'target.wav',
+               'item_drop': 'item_drop.wav',
+               'item_grab': 'item_grab.wav',
+               'menu': 'menu_switch.wav',
+               'switch_on': 'switch_on.wav',
+               'switch_off': 'switch_off.wav',
+               'neon': 'neon.wav'}
@@ -0,0 +1,118 @@
+"""
+Tests for the game components.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+import pytest
+
+from bear_hug.ecs import EntityTracker
+from bear_hug.event import BearEvent
+
+from components import PowerNetwork
+from headless import create_game
+
+
+@pytest.fixture
+def game(atlas):
+    dispatcher, layout, factory = create_game(atlas)
+    return dispatcher, factory, PowerNetwork()
+
+
+def add(game, entity_type, pos):
+    dispatcher, factory, network = game
+    factory.create_entity(entity_type, pos)
+    dispatcher.dispatch_events()
+    return max((x for x in EntityTracker().entities
+                if x.startswith(entity_type)),
+               key=lambda x: int(x.split('_')[-1]))
+
+
+def check_links(network):
+    """
+    Check that the links are symmetric and match the targets.
+    """
+    assert set(network.links) == set(network.nodes)
+    for node, linked in network.links.items():
+        for other in linked:
+            assert node in network.links[other]
+    for node, targets in network.targets.items():
+        assert len(targets) == len(set(targets))
+        for target in targets:
+            assert target in network.links[node]
+    for node, linked in network.links.items():
+        for other in linked:
+            assert other in network.targets.get(node, ()) \
+                or node in network.targets.get(other, ())
+
+
+def test_links_are_symmetric(game):
+    network = game[2]
+    spikes = [add(game, 'spike', (x, 20)) for x in range(0, 200, 15)]
+    props = [add(game, 'science_prop', (x, 30)) for x in range(5, 200, 25)]
+    check_links(network)
+    assert network.links[spikes[0]] == {spikes[1], spikes[2],
+                                        props[0], props[1]}
+    for node in spikes[::3] + props[1::2]:
+        network.remove_node(node)
+        check_links(network)
+        assert all(node not in x for x in network.links.values())
+        assert network.get_component(node) == set()
+
+
+def test_range_edges(game):
+    network = game[2]
+    spike = add(game, 'spike', (100, 40))
+    # Exactly at the range, horizontally and diagonally
+    near = [add(game, 'science_prop', pos)
+            for pos in ((140, 40), (60, 40), (124, 8), (76, 8))]
+    far = [add(game, 'science_prop', pos)
+           for pos in ((141, 40), (59, 40), (125, 8), (75, 8))]
+    assert network.targets[spike] == near
+    for prop in far:
+        assert network.links[prop] == set()
+
+
+def test_neighbours_in_adjacent_cells(game):
+    network = game[2]
+    # Both sides of a cell boundary, and across a corner
+    a = add(game, 'spike', (39, 39))
+    b = add(game, 'spike', (40, 39))
+    c = add(game, 'spike', (41, 41))
+    assert network._cell((39, 39)) != network._cell((40, 39)) \
+        != network._cell((41, 41))
+    assert network.targets[a] == [b, c]
+    assert network.targets[b] == [a, c]
+    assert network.targets[c] == [a, b]
+    check_links(network)
+
+
+def test_readding_a_node(game):
+    network = game[2]
+    spikes = [add(game, 'spike', (x, 20)) for x in (0, 30, 60)]
+    entity = EntityTracker().entities[spikes[1]]
+    network.add_node(entity)
+    network.add_node(entity)
+    check_links(network)
+    assert network.targets[spikes[1]] == [spikes[0], spikes[2]]
+    # A re-added node is the newest one
+    assert network.targets[spikes[0]] == [spikes[1]]
+    assert network.targets[spikes[2]] == [spikes[1]]
+    assert sum(spikes[1] in x for x in network.cells.values()) == 1
+
+
+def test_targets_order_after_removal(game):
+    network = game[2]
+    spike = add(game, 'spike', (100, 20))
+    props = [add(game, 'science_prop', (x, 30)) for x in (70, 130, 90, 110)]
+    assert network.targets[spike] == props
+    network.remove_node(props[1])
+    assert network.targets[spike] == [props[0], props[2], props[3]]
+    added = add(game, 'science_prop', (100, 40))
+    assert network.targets[spike] == [props[0], props[2], props[3], added]
+
+
+def test_destroyed_before_adding(game):
+    network = game[2]
+    network.on_event(BearEvent('ecs_add', ('spike_100', 0, 0)))
+    assert network.nodes == {}
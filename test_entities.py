@@ -0,0 +1,75 @@
+"""
+Tests for the entity factory.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+import pytest
+
+from bear_hug.ecs import EntityTracker
+from bear_hug.event import BearEvent
+
+from headless import create_game
+
+
+def subscriptions(dispatcher, entity):
+    """
+    Return {component name: sorted event types} for the entity.
+    """
+    return {name: sorted(event_type for event_type in dispatcher.listeners
+                         for x in dispatcher.listeners[event_type]
+                         if x is entity.__dict__[name])
+            for name in entity.components}
+
+
+def tick(dispatcher, dt=0.01):
+    dispatcher.add_event(BearEvent('tick', dt))
+    dispatcher.dispatch_events()
+    dispatcher.add_event(BearEvent('service', 'tick_over'))
+    dispatcher.dispatch_events()
+
+
+@pytest.mark.parametrize('entity_type', ('bullet', 'punch'))
+def test_recycled_entity_is_clean(atlas, entity_type):
+    dispatcher, layout, factory = create_game(atlas)
+    factory.create_entity(entity_type, (10, 10), direction='l', damage=7)
+    dispatcher.dispatch_events()
+    first = EntityTracker().entities[f'{entity_type}_1']
+    fresh = subscriptions(dispatcher, first)
+    for _ in range(3):
+        tick(dispatcher)
+    first.destructor.destroy()
+    tick(dispatcher)
+    assert f'{entity_type}_1' not in EntityTracker().entities
+    assert factory.pool_statistics()[entity_type]['free'] == 1
+    # Entities with a different direction are not taken from the pool
+    factory.create_entity(entity_type, (30, 30), direction='r')
+    dispatcher.dispatch_events()
+    assert EntityTracker().entities[f'{entity_type}_2'] is not first
+    factory.create_entity('spike', (30, 10))
+    dispatcher.dispatch_events()
+    spike = EntityTracker().entities['spike_1']
+    hitpoints = spike.health.hitpoints
+    x = 31 + spike.widget.width
+    factory.create_entity(entity_type, (x, 20), direction='l',
+                          z_level=spike.widget.z_level)
+    dispatcher.dispatch_events()
+    recycled = EntityTracker().entities[f'{entity_type}_3']
+    assert recycled is first
+    assert factory.pool_statistics()[entity_type]['hits'] == 1
+    assert recycled.position.pos == (x, 20)
+    assert (recycled.position.vx, recycled.position.vy) == (-50, 0)
+    assert recycled.widget.z_level == spike.widget.z_level
+    assert not recycled.destructor.is_destroying
+    if entity_type == 'punch':
+        assert recycled.collision.damage == 3
+        assert recycled.decay.age == 0
+    assert subscriptions(dispatcher, recycled) == fresh
+    # Moves and hits things like a new one
+    tick(dispatcher, 0.05)
+    assert recycled.position.x < x
+    for _ in range(5):
+        tick(dispatcher, 0.05)
+    assert recycled.id not in EntityTracker().entities
+    assert spike.health.hitpoints == \
+        hitpoints - (5 if entity_type == 'bullet' else 3)
@@ -0,0 +1,157 @@
+"""
+Tests for the game listeners.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+from random import Random
+
+import pytest
+
+from bear_hug.ecs import EntityTracker, CollisionListener
+from bear_hug.event import BearEvent
+from bear_hug.widgets import Listener
+
+from headless import Simulation, create_game, create_level_manager
+from listeners import AutosaveListener, LoadingListener, SavingListener, \
+    SpawnIndex, SpawnItem
+
+
+class EventRecorder(Listener):
+    """
+    Remembers the values of all events it gets.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = []
+
+    def on_event(self, event):
+        self.values.append(event.event_value)
+
+
+def test_load_autosave_made_during_attack(atlas, tmp_path):
+    file_name = str(tmp_path / 'autosave.sav')
+    simulation = Simulation(atlas, level_id='ghetto_corridor')
+    autosave = AutosaveListener(file_name=file_name, period=1000)
+    simulation.dispatcher.register_listener(
+        autosave, ('tick', 'ecs_add', 'ecs_move', 'ecs_remove',
+                   'brut_damage', 'brut_heal', 'brut_pick_up',
+                   'brut_use_item', 'brut_change_ammo'))
+    simulation.run(10)
+    autosave.autosave(full=True)
+    simulation.terminal.add_input(BearEvent('key_down', 'TK_Q'))
+    simulation.step(1 / 30)
+    # A delta with the hand in the middle of the punch
+    autosave.autosave()
+    SavingListener().wait()
+    save, states = LoadingListener.read_autosave(file_name)
+    assert any(x['id'].startswith('cop_1_hand')
+               and x['components']['hiding']['is_working']
+               for x in states)
+    simulation.dispatcher.add_event(BearEvent('brut_load_game', file_name))
+    # Load the game, but stop before the punch is over
+    simulation.run(2, fps=30)
+    hands = [x for x in EntityTracker().entities.values()
+             if x.id.startswith('cop_1_hand')]
+    assert any(x.hiding.is_working for x in hands)
+    for hand in hands:
+        assert (hand.widget.widget in simulation.layout.child_locations) \
+            == hand.hiding.is_working
+    # And hidden once the punch is over
+    simulation.run(30, fps=30)
+    for hand in hands:
+        assert hand.widget.widget not in simulation.layout.child_locations
+
+
+@pytest.mark.parametrize('y, hit', ((20, True), (40, False)))
+def test_fast_bullet_and_thin_wall(atlas, y, hit):
+    dispatcher, layout, factory = create_game(atlas)
+    factory.create_entity('dept_wall_inner', (250, 0))
+    dispatcher.dispatch_events()
+    wall = EntityTracker().entities['dept_wall_inner_1']
+    recorder = EventRecorder()
+    dispatcher.register_listener(recorder, 'ecs_collision')
+    factory.create_entity('bullet', (244, y), direction='r',
+                          z_level=wall.widget.z_level)
+    dispatcher.dispatch_events()
+    bullet = EntityTracker().entities['bullet_1']
+    # At 4 FPS, a bullet crosses the 3 chars thick wall in a single tick
+    dispatcher.add_event(BearEvent('tick', 0.25))
+    dispatcher.dispatch_events()
+    assert bullet.position.x > wall.position.x + 3
+    assert (('bullet_1', 'dept_wall_inner_1') in recorder.values) == hit
+
+
+def test_grid_finds_the_same_collisions(atlas):
+    dispatcher, layout, factory = create_game(atlas)
+    levelgen = create_level_manager(dispatcher, factory)
+    factory.create_entity('cop', (5, 25))
+    dispatcher.dispatch_events()
+    levelgen.set_level('ghetto_corridor', seed=0)
+    dispatcher.dispatch_events()
+    grid = factory.collision_listener
+    stock = CollisionListener()
+    stock.entities = dict(grid.entities)
+    stock.currently_tracked = set(grid.currently_tracked)
+    moves = [('cop_1', (x, y)) for x in range(0, 480, 4)
+             for y in range(10, 45, 5)]
+    moves.extend((x, EntityTracker().entities[x].position.pos)
+                 for x in grid.currently_tracked if x != 'cop_1')
+    found = 0
+    for moved_id, pos in moves:
+        expected = {x.event_value for x in
+                    stock.on_event(BearEvent('ecs_move', (moved_id, *pos)))}
+        assert {x.event_value for x in
+                grid.check_move(moved_id, pos, pos)} == expected
+        found += len(expected)
+    assert found
+
+
+def spawn(x, width, name='message'):
+    return SpawnItem(item=name, pos=(x, 0), size=(width, 50), kwargs={})
+
+
+def test_spawn_index_finds_wide_areas():
+    wide = spawn(0, 100)
+    index = SpawnIndex([spawn(50, 10), wide, spawn(120, 5)])
+    assert index.max_width == 100
+    # The wide area starts far to the left of the query, but reaches it
+    assert index.find((99, 10), (5, 5)) == [wide]
+    assert index.find((100, 10), (5, 5)) == []
+    assert index.find((45, 10), (10, 5)) == [wide, index.spawns[1]]
+    index.remove(wide)
+    assert index.find((99, 10), (5, 5)) == []
+
+
+def test_spawn_index_duplicate_starts():
+    first, second, third = spawn(10, 5), spawn(10, 5), spawn(10, 20)
+    index = SpawnIndex([first, second])
+    index.add(third)
+    assert index.spawns == [first, second, third]
+    # Removes this very item, even though there is an equal one before it
+    index.remove(second)
+    assert index.spawns == [first, third]
+    assert index.spawns[0] is first
+    assert index.find((25, 0), (1, 1)) == [third]
+    index.remove(first)
+    index.remove(third)
+    assert len(index) == 0
+    assert index.find((10, 0), (5, 5)) == []
+
+
+def test_spawn_index_matches_brute_force():
+    rng = Random(0)
+    spawns = [spawn(rng.randrange(0, 500), rng.randrange(1, 60))
+              for _ in range(100)]
+    index = SpawnIndex(spawns[:50])
+    for item in spawns[50:]:
+        index.add(item)
+    for item in spawns[::3]:
+        index.remove(item)
+    remaining = [x for i, x in enumerate(spawns) if i % 3]
+    for x in range(-10, 520, 7):
+        for width in (1, 10, 40):
+            found = index.find((x, 20), (width, 1))
+            expected = [s for s in remaining
+                        if s.pos[0] < x + width and x < s.pos[0] + s.size[0]]
+            assert sorted(map(id, found)) == sorted(map(id, expected))
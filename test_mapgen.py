@@ -0,0 +1,73 @@
+"""
+Tests for the level generation and streaming.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+from json import dumps, loads
+
+from bear_hug.ecs import EntityTracker
+
+from components import entity_state
+from headless import Simulation, create_game, create_level_manager
+from mapgen import PreparedLevel
+
+
+def entity_states():
+    # Through JSON, so that tuples and lists compare equal
+    return {entity_id: loads(dumps(entity_state(entity)))
+            for entity_id, entity in EntityTracker().entities.items()}
+
+
+def test_retire_and_restore_chunk(atlas):
+    simulation = Simulation(atlas, seed=0)
+    simulation.run(3)
+    levelgen = simulation.levelgen
+    before = entity_states()
+    levelgen._retire_chunk(1)
+    simulation.dispatcher.dispatch_events()
+    retired = set(before) - set(EntityTracker().entities)
+    assert 1 in levelgen.dormant_chunks
+    holders = [x for x in retired if 'hands' in before[x]['components']]
+    assert holders
+    # Hands and items are retired with their holders, wherever they are
+    for holder in holders:
+        hands = before[holder]['components']['hands']
+        attached = {*hands['hand_entities'].values(),
+                    hands['left_item'], hands['right_item']}
+        assert attached <= retired
+    for entity_id in retired:
+        state = before[entity_id]['components']
+        if 'item_behaviour' in state and \
+                state['item_behaviour']['owning_entity']:
+            assert state['item_behaviour']['owning_entity'] in retired
+    levelgen._restore_chunk(1)
+    simulation.dispatcher.dispatch_events()
+    assert 1 not in levelgen.dormant_chunks
+    assert entity_states() == before
+    # The restored characters can still use their hands
+    for holder in holders:
+        hands = EntityTracker().entities[holder].hands
+        for hand_id in hands.hand_entities.values():
+            assert hand_id in EntityTracker().entities
+
+
+def build_level(atlas, level_id, seed, prepare):
+    dispatcher, layout, factory = create_game(atlas)
+    levelgen = create_level_manager(dispatcher, factory)
+    factory.create_entity('cop', (5, 25))
+    dispatcher.dispatch_events()
+    if prepare:
+        prepared = PreparedLevel(levelgen, level_id, seed)
+        assert prepared.wait()
+        levelgen.prepared_levels[level_id] = prepared
+    levelgen.set_level(level_id, seed=seed)
+    dispatcher.dispatch_events()
+    return entity_states(), [tuple(x) for x in levelgen.spawner.spawns]
+
+
+def test_prepared_level_is_the_same(atlas):
+    direct = build_level(atlas, 'lab_corridor', 0, prepare=False)
+    prepared = build_level(atlas, 'lab_corridor', 0, prepare=True)
+    assert len(direct[0]) > 20
+    assert prepared == direct
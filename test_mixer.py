@@ -0,0 +1,114 @@
+"""
+Tests for the software sound mixer.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+import numpy as np
+import pytest
+
+from bear_hug.bear_utilities import BearSoundException
+
+from mixer import Mixer
+
+
+def tone(value, frames=100, channels=1):
+    return np.full((frames, channels), value, dtype=np.float32)
+
+
+@pytest.fixture
+def mixer():
+    mixer = Mixer(rate=1000, block_size=10, max_voices=2)
+    mixer.register_sound('step', tone(0.1))
+    mixer.register_sound('shot', tone(0.2), priority=1)
+    mixer.register_sound('music', tone(0.3, frames=15), priority=10)
+    return mixer
+
+
+def test_voice_stealing(mixer):
+    first = mixer.play('step')
+    mixer.mix()
+    second = mixer.play('step')
+    third = mixer.play('step')
+    # The oldest voice of the lowest priority goes first
+    assert mixer.voices == [second, third]
+    assert first not in mixer.voices
+    shot = mixer.play('shot')
+    assert mixer.voices == [third, shot]
+    # Priority takes precedence over age
+    important = mixer.play('step', priority=1)
+    assert mixer.voices == [shot, important]
+    # Equal priority is enough to steal
+    mixer.play('step', priority=1)
+    assert shot not in mixer.voices
+    assert (mixer.played, mixer.stolen, mixer.dropped) == (6, 4, 0)
+
+
+def test_voice_dropping(mixer):
+    mixer.play('music')
+    mixer.play('music', priority=5)
+    assert mixer.play('shot') is None
+    assert mixer.play('step') is None
+    assert len(mixer.voices) == 2
+    assert (mixer.played, mixer.stolen, mixer.dropped) == (2, 0, 2)
+
+
+def test_cooldown(mixer):
+    mixer.register_sound('shot', tone(0.2), cooldown=0.02)
+    assert mixer.play('shot')
+    assert mixer.play('shot') is None
+    mixer.mix()
+    assert mixer.play('shot') is None
+    # Other sounds are not affected
+    assert mixer.play('step')
+    mixer.mix()
+    assert mixer.play('shot')
+    assert (mixer.played, mixer.cooled_down) == (3, 2)
+
+
+def test_looping(mixer):
+    once = mixer.play('music')
+    looped = mixer.play('music', loop=True)
+    mixer.mix()
+    mixer.mix()
+    assert mixer.voices == [looped]
+    assert not once.is_playing
+    for _ in range(11):
+        mixer.mix()
+    assert looped.is_playing
+    assert looped.position == 130 % 15
+    mixer.stop(looped)
+    assert mixer.voices == []
+    assert not mixer.mix().any()
+
+
+def test_mixed_values(mixer):
+    mixer.register_sound('stereo', np.array([[0.5, -0.5]] * 20,
+                                            dtype=np.float32))
+    mixer.play('step', volume=0.5, pan=1.0)
+    mixer.play('stereo', pan=-0.5)
+    block = mixer.mix()
+    assert block.dtype == np.int16 and block.shape == (10, 2)
+    # Left: 0.5 from the stereo sound; right: 0.05 from the step and
+    # -0.5 * 0.5 from the stereo sound
+    expected = np.array([0.5, 0.05 - 0.25]) * 32767
+    assert np.abs(block - expected).max() <= 1
+    mixer.volume = 0.5
+    assert np.abs(mixer.mix() - expected * 0.5).max() <= 1
+
+
+def test_clipping():
+    mixer = Mixer(rate=1000, block_size=10)
+    mixer.register_sound('loud', tone(0.8, channels=2))
+    mixer.play('loud')
+    mixer.play('loud')
+    assert (mixer.mix() == 32767).all()
+
+
+def test_bad_sounds(mixer):
+    with pytest.raises(BearSoundException):
+        mixer.play('nonexistent')
+    with pytest.raises(BearSoundException):
+        mixer.register_sound('empty', tone(0, frames=0))
+    with pytest.raises(BearSoundException):
+        mixer.register_sound('flat', np.zeros(10, dtype=np.float32))
@@ -0,0 +1,97 @@
+"""
+Tests for the class registries used to load saved objects.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+import pytest
+
+from bear_hug.bear_utilities import BearJSONException
+from bear_hug.ecs import EntityTracker
+
+from components import component_state, load_component
+from headless import create_game
+from registry import ClassRegistry, split_converters
+
+
+class Base:
+    def __init__(self, name, size=1):
+        self.name = name
+        self.size = size
+
+
+class Forwarding(Base):
+    def __init__(self, *args, colour='red', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.colour = colour
+
+
+class Closed(Forwarding):
+    def __init__(self, weight, flag=False, *, depth=0):
+        super().__init__(weight)
+        self.flag = flag
+        self.depth = depth
+
+
+class ForwardingAgain(Closed):
+    def __init__(self, *args, shape='round', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shape = shape
+
+
+def test_forwarded_kwargs():
+    registry = ClassRegistry(Base)
+    assert registry.accepted_kwargs(Base) == {'self', 'name', 'size'}
+    assert registry.accepted_kwargs(Forwarding) == \
+        {'self', 'name', 'size', 'colour'}
+    registry.check_kwargs(Forwarding, {'name': 'a', 'colour': 'blue'})
+
+
+def test_kwargs_not_forwarded():
+    registry = ClassRegistry(Base)
+    # The parents' kwargs are not reachable from Closed
+    assert registry.accepted_kwargs(Closed) == \
+        {'self', 'weight', 'flag', 'depth'}
+    assert registry.accepted_kwargs(ForwardingAgain) == \
+        {'self', 'weight', 'flag', 'depth', 'shape'}
+    with pytest.raises(BearJSONException):
+        registry.check_kwargs(Closed, {'weight': 1, 'colour': 'blue'})
+
+
+def test_get():
+    registry = ClassRegistry(Base)
+    assert registry.get('ForwardingAgain') is ForwardingAgain
+
+    class Late(Base):
+        pass
+
+    # Subclasses defined after the registry are found as well
+    assert registry.get('Late') is Late
+    with pytest.raises(BearJSONException):
+        registry.get('object')
+
+
+def test_split_converters():
+    values, converters = split_converters({'class': 'Widget',
+                                           'pos': [1, 2],
+                                           'pos_type': 'tuple',
+                                           'on_event_type': 'brut_damage'})
+    assert values == {'class': 'Widget', 'pos': [1, 2],
+                      'on_event_type': 'brut_damage'}
+    assert converters == {'pos': tuple}
+    with pytest.raises(BearJSONException):
+        split_converters({'pos': [1, 2], 'pos_type': 'not_a_builtin'})
+
+
+def test_switch_event_types_are_loaded(atlas):
+    dispatcher, layout, factory = create_game(atlas)
+    factory.create_entity('wall_switch', (10, 10))
+    dispatcher.dispatch_events()
+    switch = EntityTracker().entities['wall_switch_1']
+    switch.health.on_event_type = 'brut_damage'
+    state = component_state(switch.health)
+    assert state['on_event_type'] == 'brut_damage'
+    component = load_component(state, dispatcher)
+    assert component.on_event_type == 'brut_damage'
+    assert component.off_event_type == 'brut_change_config'
+    assert component.on_event_value == switch.health.on_event_value
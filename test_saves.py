@@ -0,0 +1,80 @@
+"""
+Tests for the binary save format.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+from io import BytesIO
+
+import pytest
+
+from saves import SaveWriter, read_records, is_binary_save, MAGIC, VERSION, \
+    ENTITY_RECORD, META_RECORD, REMOVED_RECORD, MIN_ASSET_LENGTH, _header
+
+
+IMAGE = ['#' * MIN_ASSET_LENGTH, '.' * MIN_ASSET_LENGTH]
+
+
+def write_save(records, compress):
+    save_file = BytesIO()
+    with SaveWriter(save_file, compress=compress) as writer:
+        for record_type, value in records:
+            writer.write_record(record_type, value)
+    return save_file.getvalue()
+
+
+def wall(n):
+    return {'id': f'wall_{n}',
+            'components': {'widget': {'class': 'WidgetComponent',
+                                      'widget': {'chars': IMAGE,
+                                                 'colors': 'gray'}}}}
+
+
+@pytest.mark.parametrize('compress', (False, True))
+def test_round_trip(compress):
+    records = [(META_RECORD, {'current_level': 'ghetto_corridor'}),
+               (REMOVED_RECORD, ['bullet_1', 'punch_2']),
+               (ENTITY_RECORD, wall(1)),
+               (ENTITY_RECORD, wall(2))]
+    data = write_save(records, compress)
+    save_file = BytesIO(data)
+    assert is_binary_save(save_file)
+    assert list(read_records(save_file)) == records
+
+
+def test_assets_are_written_once():
+    data = write_save([(ENTITY_RECORD, wall(1)), (ENTITY_RECORD, wall(2))],
+                      compress=False)
+    for row in IMAGE:
+        assert data.count(row.encode()) == 1
+    # Short strings stay inline
+    assert data.count(b'gray') == 2
+
+
+@pytest.mark.parametrize('compress', (False, True))
+def test_record_across_chunks(compress):
+    # Every record is longer than a chunk, and none ends on a chunk boundary
+    records = [(ENTITY_RECORD, {'id': f'sign_{n}', 'text': 'x' * (100 + n)})
+               for n in range(5)]
+    data = write_save(records, compress)
+    assert list(read_records(BytesIO(data), chunk_size=7)) == records
+
+
+@pytest.mark.parametrize('compress', (False, True))
+def test_truncated_file(compress):
+    data = write_save([(ENTITY_RECORD, wall(1))], compress)
+    for end in (len(data) // 2, len(data) - 5):
+        with pytest.raises(ValueError):
+            list(read_records(BytesIO(data[:end])))
+
+
+def test_newer_version():
+    data = write_save([(ENTITY_RECORD, wall(1))], compress=False)
+    data = _header.pack(MAGIC, VERSION + 1, 0) + data[_header.size:]
+    with pytest.raises(ValueError):
+        list(read_records(BytesIO(data)))
+
+
+def test_not_a_save():
+    with pytest.raises(ValueError):
+        list(read_records(BytesIO(b'{"entities": []}')))
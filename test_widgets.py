@@ -0,0 +1,25 @@
+"""
+Tests for the game-specific widgets.
+
+Run with `python3 -m pytest` from the game directory.
+"""
+
+import pytest
+
+from bear_hug.bear_utilities import BearLayoutException
+from bear_hug.ecs import EntityTracker
+
+from headless import create_game
+
+
+def test_move_entity_that_was_never_shown(atlas):
+    dispatcher, layout, factory = create_game(atlas)
+    factory.create_entity('can', (10, 20), emit_show=False)
+    dispatcher.dispatch_events()
+    can = EntityTracker().entities['can_1']
+    # Hidden entities still move and emit 'ecs_move'
+    can.position.move(15, 20)
+    dispatcher.dispatch_events()
+    assert can.widget.widget not in layout.child_locations
+    with pytest.raises(BearLayoutException):
+        layout.move_child(can.widget.widget, (20, 20))
@@ -2,15 +2,86 @@
 Various game-specific widgets
 """
 
-from json import dumps
+from json import dumps, loads
 from math import sqrt
 from random import choice, uniform
 
-from bear_hug.bear_utilities import copy_shape
+from bear_hug.bear_utilities import copy_shape, BearLayoutException, \
+    BearJSONException
 from bear_hug.ecs import EntityTracker
+from bear_hug.ecs_widgets import ScrollableECSLayout
 from bear_hug.event import BearEvent
 from bear_hug.widgets import Animation, Widget, Label, Layout, \
-    SimpleAnimationWidget
+    SimpleAnimationWidget, SwitchingWidget, deserialize_animation
+
+from registry import ClassRegistry, split_converters
+
+
+# Classes for `load_widget`
+widget_classes = ClassRegistry(Widget)
+
+
+def widget_state(widget):
+    """
+    Return a dict that describes a widget for `deserialize_widget`.
+
+    Widgets from this module provide `to_state()`. Plain Widgets and
+    SwitchingWidgets, which hold most of the images in a save, are described
+    here directly. Other bear_hug widgets only have JSON __repr__, which is
+    parsed.
+    :param widget: a Widget
+    :return: dict
+    """
+    if hasattr(widget, 'to_state'):
+        return widget.to_state()
+    if type(widget) is Widget:
+        return {'class': 'Widget',
+                'chars': [''.join(x) for x in widget.chars],
+                'colors': [','.join(x) for x in widget.colors]}
+    if type(widget) is SwitchingWidget:
+        return {'class': 'SwitchingWidget',
+                'initial_image': widget.current_image,
+                'images_dict': {x: [[''.join(y) for y in widget.images[x][0]],
+                                    [','.join(y) for y in widget.images[x][1]]]
+                                for x in widget.images}}
+    return loads(repr(widget))
+
+
+def load_widget(state, atlas=None):
+    """
+    Create a widget from a dict made by `widget_state` or a JSON string.
+
+    Works like `bear_hug.widgets.deserialize_widget`, but the class is looked
+    up in `widget_classes` instead of the interpreter stack.
+    :param state: dict or JSON string
+    :param atlas: Atlas for the animations that refer to it
+    :return: Widget
+    """
+    if isinstance(state, str):
+        state = loads(state)
+    elif not isinstance(state, dict):
+        raise BearJSONException(f'Attempting to deserialize {type(state)} to Widget')
+    for forbidden_key in ('name', 'owner', 'dispatcher'):
+        if forbidden_key in state:
+            raise BearJSONException(f'Forbidden key {forbidden_key} in widget JSON')
+    if 'class' not in state:
+        raise BearJSONException('No class provided in widget JSON')
+    values, converters = split_converters(state)
+    class_var = widget_classes.get(values.pop('class'))
+    widget_classes.check_kwargs(class_var, values)
+    kwargs = {}
+    for key, value in values.items():
+        if key in converters:
+            kwargs[key] = converters[key](value)
+        elif key == 'animation':
+            kwargs[key] = deserialize_animation(value, atlas)
+        elif key == 'chars':
+            kwargs[key] = [list(x) for x in value]
+        elif key == 'colors':
+            kwargs[key] = [x.split(',') for x in value]
+        else:
+            kwargs[key] = value
+    return class_var(**kwargs)
 
 
 class HitpointBar(Layout):
@@ -326,19 +397,292 @@ class SignpostWidget(Layout):
         l = text.split('\n')
         if len(l) > 2 or any(len(x) > 10 for x in l):
             raise ValueError('Signpost accepts at most 2 lines 10 chars each')
+        self.text = text
+        self.text_color = text_color
         label = Label(text=text, color=text_color, just='center', width=10)
         self.add_child(label, (1, 1))
         self._rebuild_self()
 
-    def __repr__(self):
+    def to_state(self):
         # Since this widget doesn't do anything about it being a layout (such as
         # changing children or whatever), it might as well save as a simple
         # widget. This code from bear_hug.widgets.Widget is repeated here since
         # the default layout throws exception on __repr__
-        char_strings = [self._serialize_charline(x) for x in self.chars]
-        for string in char_strings:
-            string.replace('\"', '\u0022"').replace('\\', '\u005c')
-        d = {'class': self.__class__.__name__,
-             'chars': char_strings,
-             'colors': [','.join(x) for x in self.colors]}
-        return dumps(d)
+        return {'class': self.__class__.__name__,
+                'chars': [''.join(x) for x in self.chars],
+                'colors': [','.join(x) for x in self.colors],
+                'text': self.text,
+                'text_color': self.text_color}
+
+    def __repr__(self):
+        return dumps(self.to_state())
+
+
+class ChunkedECSLayout(ScrollableECSLayout):
+    """
+    A ScrollableECSLayout that keeps its surface in chunks.
+
+    ScrollableECSLayout stores a list of child pointers for every char of the
+    layout, so its size is fixed on creation and its memory use grows with
+    level length. This layout splits the surface into `chunk_width`-wide
+    vertical chunks, which are allocated when some child is placed in them
+    and dropped when the last child leaves. Memory use thus depends on where
+    the entities are, not on the layout size.
+
+    The layout size is only used to detect collisions with the borders and to
+    limit scrolling, and can be changed at any time with `resize_layout`. The
+    layout has no background widget; levels have background entities anyway.
+
+    :param width: Layout width.
+
+    :param height: Layout height.
+
+    :param view_pos: Top left corner of the initial visible area, 2-tuple (x, y).
+
+    :param view_size: The size of the visible area, 2-tuple (x, y).
+
+    :param chunk_width: Width of a single chunk.
+    """
+    def __init__(self, width, height, view_pos=(0, 0), view_size=(10, 10),
+                 chunk_width=100):
+        if not 0 < view_size[0] <= width or not 0 < view_size[1] <= height:
+            raise BearLayoutException('Invalid view field size')
+        if not 0 <= view_pos[0] <= width - view_size[0] \
+                or not 0 <= view_pos[1] <= height - view_size[1]:
+            raise BearLayoutException('Initial viewpoint outside ' +
+                                      'ChunkedECSLayout')
+        # Layout.__init__ would allocate the pointers for the entire surface
+        chars = [[' ' for x in range(view_size[0])]
+                 for y in range(view_size[1])]
+        Widget.__init__(self, chars, copy_shape(chars, 'white'))
+        self.children = []
+        self.child_locations = {}
+        self.need_redraw = False
+        self.entities = {}
+        self.widgets = {}
+        self.layout_width = width
+        self.layout_height = height
+        self.chunk_width = chunk_width
+        # Chunk index -> rows of the child pointer lists
+        self._chunks = {}
+        # Chunk index -> number of children that are at least partially there
+        self._chunk_children = {}
+        self.view_pos = view_pos[:]
+        self.view_size = view_size[:]
+        self._rebuild_self()
+
+    def resize_layout(self, width):
+        """
+        Change the layout width.
+
+        Children outside the new width are left where they are. The view is
+        moved left if necessary.
+        :param width: int
+        """
+        if width < self.view_size[0]:
+            raise BearLayoutException('ChunkedECSLayout cannot be narrower than its view')
+        self.layout_width = width
+        if self.view_pos[0] > width - self.view_size[0]:
+            self.view_pos = (width - self.view_size[0], self.view_pos[1])
+            self.need_redraw = True
+
+    def _chunk_range(self, child, pos):
+        return range(pos[0] // self.chunk_width,
+                     (pos[0] + child.width - 1) // self.chunk_width + 1)
+
+    def add_child(self, child, pos, skip_checks=False):
+        if not isinstance(child, Widget):
+            raise BearLayoutException('Cannot add non-Widget to a Layout')
+        if child in self.child_locations and not skip_checks:
+            raise BearLayoutException('Cannot add the same widget to layout twice')
+        # Children partially to the left of the layout are allowed, since the
+        # chunks to the left are never shown anyway
+        if pos[0] + child.width > self.layout_width or \
+                pos[1] + child.height > self.layout_height:
+            raise BearLayoutException('Child won\'t fit at this position')
+        if child is self:
+            raise BearLayoutException('Cannot add Layout as its own child')
+        if not skip_checks:
+            self.children.append(child)
+        self.child_locations[child] = pos
+        child.terminal = self.terminal
+        child.parent = self
+        for chunk_index in self._chunk_range(child, pos):
+            if chunk_index not in self._chunks:
+                self._chunks[chunk_index] = [
+                    [[] for x in range(self.chunk_width)]
+                    for y in range(self.layout_height)]
+                self._chunk_children[chunk_index] = 0
+            self._chunk_children[chunk_index] += 1
+            chunk = self._chunks[chunk_index]
+            left = chunk_index * self.chunk_width
+            start = max(pos[0], left)
+            end = min(pos[0] + child.width, left + self.chunk_width)
+            for y in range(pos[1], pos[1] + child.height):
+                row = chunk[y]
+                for x in range(start - left, end - left):
+                    row[x].append(child)
+
+    def remove_child(self, child, remove_completely=True):
+        if child not in self.child_locations:
+            raise BearLayoutException('Layout can only remove its child')
+        pos = self.child_locations[child]
+        for chunk_index in self._chunk_range(child, pos):
+            self._chunk_children[chunk_index] -= 1
+            if not self._chunk_children[chunk_index]:
+                # Nothing else is there
+                del self._chunks[chunk_index]
+                del self._chunk_children[chunk_index]
+                continue
+            chunk = self._chunks[chunk_index]
+            left = chunk_index * self.chunk_width
+            start = max(pos[0], left)
+            end = min(pos[0] + child.width, left + self.chunk_width)
+            for y in range(pos[1], pos[1] + child.height):
+                row = chunk[y]
+                for x in range(start - left, end - left):
+                    row[x].remove(child)
+        if remove_completely:
+            del self.child_locations[child]
+            self.children.remove(child)
+            child.terminal = None
+            child.parent = None
+
+    def move_child(self, child, new_pos):
+        if child not in self.child_locations:
+            raise BearLayoutException('Layout can only move its child')
+        # Otherwise a chunk where the child is alone would be dropped and
+        # allocated anew on every step
+        old_chunks = self._chunk_range(child, self.child_locations[child])
+        for chunk_index in old_chunks:
+            self._chunk_children[chunk_index] += 1
+        super().move_child(child, new_pos)
+        for chunk_index in old_chunks:
+            self._chunk_children[chunk_index] -= 1
+            if not self._chunk_children[chunk_index]:
+                del self._chunks[chunk_index]
+                del self._chunk_children[chunk_index]
+
+    def remove_entity(self, entity_id):
+        # ScrollableECSLayout forgets the entity, but not its widget
+        super().remove_entity(entity_id)
+        self.widgets.pop(entity_id, None)
+
+    def remove_children(self, children):
+        """
+        Remove a lot of children at once, eg when the level is destroyed.
+
+        Chunks left without children are dropped without touching their
+        pointers. In every other affected chunk, each pointer list that held
+        a removed child is filtered once.
+        :param children: an iterable of child widgets
+        """
+        children = list(children)
+        removed = {id(x) for x in children}
+        # Chunk index -> {y: bytearray with the affected x marked}
+        dirty = {}
+        for child in children:
+            if child not in self.child_locations:
+                raise BearLayoutException('Layout can only remove its child')
+            pos = self.child_locations[child]
+            for chunk_index in self._chunk_range(child, pos):
+                self._chunk_children[chunk_index] -= 1
+                left = chunk_index * self.chunk_width
+                start = max(pos[0], left) - left
+                end = min(pos[0] + child.width, left + self.chunk_width) - left
+                if chunk_index not in dirty:
+                    dirty[chunk_index] = {}
+                rows = dirty[chunk_index]
+                for y in range(pos[1], pos[1] + child.height):
+                    if y not in rows:
+                        rows[y] = bytearray(self.chunk_width)
+                    rows[y][start:end] = b'\x01' * (end - start)
+        for chunk_index, rows in dirty.items():
+            if not self._chunk_children[chunk_index]:
+                del self._chunks[chunk_index]
+                del self._chunk_children[chunk_index]
+                continue
+            chunk = self._chunks[chunk_index]
+            for y, marks in rows.items():
+                row = chunk[y]
+                x = marks.find(1)
+                while x != -1:
+                    row[x] = [c for c in row[x] if id(c) not in removed]
+                    x = marks.find(1, x + 1)
+        for child in children:
+            del self.child_locations[child]
+            child.terminal = None
+            child.parent = None
+        self.children = [x for x in self.children if id(x) not in removed]
+
+    def _rebuild_self(self):
+        chars = [[' ' for x in range(self.view_size[0])]
+                 for y in range(self.view_size[1])]
+        colors = copy_shape(chars, 'white')
+        for char in range(self.view_size[0]):
+            x = self.view_pos[0] + char
+            chunk = self._chunks.get(x // self.chunk_width)
+            if not chunk:
+                continue
+            chunk_x = x % self.chunk_width
+            for line in range(self.view_size[1]):
+                y = self.view_pos[1] + line
+                highest_z = 0
+                col = 'white'
+                c = ' '
+                for child in chunk[y][chunk_x]:
+                    # Same rules as in ScrollableECSLayout
+                    if child.z_level >= highest_z:
+                        child_x, child_y = self.child_locations[child]
+                        tmp_c = child.chars[y - child_y][x - child_x]
+                        if c != ' ' and tmp_c == ' ':
+                            continue
+                        else:
+                            highest_z = child.z_level
+                            c = tmp_c
+                            col = child.colors[y - child_y][x - child_x]
+                chars[line][char] = c
+                colors[line][char] = col
+        self.chars = chars
+        self.colors = colors
+
+    def scroll_to(self, pos):
+        if not (len(pos) == 2 and all((isinstance(x, int) for x in pos))):
+            raise BearLayoutException('Field of view position should be 2 ints')
+        if not 0 <= pos[0] <= self.layout_width - self.view_size[0] \
+                or not 0 <= pos[1] <= self.layout_height - self.view_size[1]:
+            raise BearLayoutException('Scrolling to invalid position')
+        self.view_pos = pos
+
+    def get_child_on_pos(self, pos, return_bg=False):
+        chunk = self._chunks.get(pos[0] // self.chunk_width)
+        if chunk and chunk[pos[1]][pos[0] % self.chunk_width]:
+            return chunk[pos[1]][pos[0] % self.chunk_width][-1]
+        return None
+
+    def on_event(self, event):
+        if event.event_type == 'ecs_remove' \
+                and self.widgets.get(event.event_value) \
+                not in self.child_locations:
+            # Entities hidden by a level teardown (see
+            # `EntityFactory.remove_entities`) may still have one queued
+            return
+        if event.event_type != 'ecs_move':
+            return super().on_event(event)
+        # ScrollableECSLayout checks the borders against its pointers
+        entity_id, x, y = event.event_value
+        if entity_id not in self.entities or entity_id not in self.widgets:
+            # Some entities may not be shown right now, but still have a
+            # PositionComponent that moves and emits events
+            return
+        widget = self.widgets[entity_id]
+        if x < 0 or x + widget.width > self.layout_width or y < 0 or \
+                y + widget.height > self.layout_height:
+            return BearEvent(event_type='ecs_collision',
+                             event_value=(entity_id, None))
+        try:
+            self.move_child(widget, (x, y))
+        except BearLayoutException:
+            # Moving entities that are not on the layout
+            pass
+        self.need_redraw = True